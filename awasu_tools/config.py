@@ -31,7 +31,106 @@ import sys
 import os
 import io
 import re
+import mmap
+import itertools
+import collections
+import hashlib
+import marshal
+import shutil
+import threading
+import time
+import tempfile
+import urllib.parse
 import unittest
+from stat import S_ISREG
+
+from awasu_tools.stats import timed
+
+# NOTE: This parses the lines in a config file. It works the same way as stripping each line,
+# ignoring comments and blank lines, then checking for a section header, and if that fails,
+# a key/value pair. The key is the first run of characters (other than "[" or "=")
+# that is followed by a "=". The BOM is also removed, if present.
+_LINE_REGEX = re.compile( r"""
+    (?: (?<=\n) | \A (?: \ufeff | (?!\ufeff) ) )
+    [^\S\n]* (?= [^\s#;'] )
+    (?:
+        \[ ( [^\]\n]+ ) \]
+    |
+        (?: [^\n]*? [\[=] )?? ( [^\[=\n]+ ) = ( [^\n]* )
+    )
+""", re.VERBOSE )
+
+# NOTE: This must be applied to a line that has been stripped.
+_SECTION_HEADER_REGEX = re.compile( r"^\[\s*([^]]+)\s*\]" )
+
+_TEXTVAL_FLAG_REGEX = re.compile( r"\n\*(\d)$" )
+
+_EOL_REGEX = re.compile( rb"[\r\n]" )
+
+_ENCODE_REGEX = re.compile( r"[%\x00-\x1f\x7f]" )
+_LATIN1_REGEX = re.compile( r"[\x00-\xff]" )
+
+_SNAPSHOT_VERSION = 1
+
+# ---------------------------------------------------------------------
+
+class IndirectFileCache:
+    """Cache the contents of files loaded by ConfigFile.get_string_indirect().
+
+    Files are re-read if their size or modified time changes, and the least-recently used
+    files are dropped once the total size of the cached files exceeds max_bytes.
+    """
+
+    def __init__( self, max_bytes=32*1024*1024 ):
+        """Initialize the IndirectFileCache."""
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict() # nb: fname => ( stat_key, val )
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get( self, fname ):
+        """Return the contents of a file (or None, if it's not a file)."""
+
+        # check if the file is in the cache
+        try:
+            stat = os.stat( fname )
+        except ( OSError, ValueError ):
+            return None
+        if not S_ISREG( stat.st_mode ):
+            return None
+        fname = os.path.abspath( fname )
+        stat_key = ( stat.st_size, stat.st_mtime_ns )
+        with self._lock:
+            entry = self._entries.get( fname )
+            if entry and entry[0] == stat_key:
+                self._entries.move_to_end( fname )
+                return entry[1]
+
+        # load the file
+        with open( fname, "r", encoding="utf-8" ) as fp:
+            val = fp.read()
+
+        # add it to the cache
+        with self._lock:
+            self._drop( fname )
+            if stat.st_size <= self.max_bytes:
+                self._entries[ fname ] = ( stat_key, val )
+                self._nbytes += stat.st_size
+                while self._nbytes > self.max_bytes:
+                    self._drop( next( iter( self._entries ) ) )
+        return val
+
+    def clear( self ):
+        """Clear the cache."""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def _drop( self, fname ):
+        """Remove a file from the cache."""
+        entry = self._entries.pop( fname, None )
+        if entry:
+            self._nbytes -= entry[0][0]
 
 # ---------------------------------------------------------------------
 
@@ -44,43 +143,174 @@ class ConfigFile:
     TVT_PLAINTEXT = 1
     TVT_HTML = 2
 
-    def __init__( self, src ):
-        """Load an Awasu config file."""
+    # NOTE: This is shared by all ConfigFile's (but can be changed for an individual ConfigFile).
+    indirect_cache = IndirectFileCache()
+
+    @timed( "config.init" )
+    def __init__( self, src, lazy=False, cache=None ):
+        """Load an Awasu config file.
+
+        If lazy is set (and a file was specified), the file is memory-mapped and only indexed,
+        and each section is parsed the first time a value is requested from it.
+
+        If cache is set (and a file was specified), the parsed file is saved in a snapshot,
+        which will be used the next time the file is loaded (if it hasn't changed). The snapshot
+        is stored in the directory specified by cache, or next to the file if cache is True.
+        """
+        self.sections = {}
+        self._decoded_vals = {} # nb: ( section, key ) => decoded value
+        self._section_offsets = None
+        self._sections_to_parse = 0
+        self._mmap = None
+        self._changes = {}
+        self._read_only = False
         # load the config file
         if os.path.isfile( src ):
+            self.filename = src
+            if cache:
+                self._load_cached( cache, lazy )
+                return
+            if lazy:
+                self._index_file()
+                return
             with open( src, "r", encoding="utf-8" ) as fp:
                 buf = fp.read()
-            self.filename = src
         elif isinstance( src, bytes ):
             buf = src.decode( "utf-8" )
             self.filename = None
         else:
             buf = str( src )
             self.filename = None
-        if buf[0] == "\ufeff":
-            buf = buf[1:] # nb: remove the BOM
         # NOTE: We can't use win32api.GetPrivateProfileXXX() since it barfs
         # on very long strings (~2K), so we parse the INI file manually :-/
         # However, we don't use ConfigParser, since we need full control
         # over how the file gets parsed.
-        self.sections = {}
-        curr_section_name = None
-        for line_buf in io.StringIO( buf ):
-            line_buf = line_buf.strip()
-            if not line_buf or line_buf.startswith( ( "#", ";", "'" ) ):
-                continue # nb: ignore comments and blank lines
-            mo = re.search( r"^\[\s*([^]]+)\s*\]", line_buf )
-            if mo:
+        self._parse_lines( buf )
+
+    def _parse_lines( self, buf, curr_section=None ):
+        """Parse lines from a config file."""
+        # NOTE: Comments, blank lines and invalid lines are skipped over by the regex,
+        # so we only see section headers and key/value pairs.
+        for mo in _LINE_REGEX.finditer( buf ):
+            section_name, key, val = mo.groups()
+            if section_name is not None:
                 # found the start of a new section
-                curr_section_name = mo.group(1).strip().lower()
-                self.sections[ curr_section_name ] = {}
-                continue
-            mo = re.search( r"([^[=]+)\s*=", line_buf )
-            if mo and curr_section_name:
+                section_name = section_name.strip().lower()
+                curr_section = self.sections[ section_name ] = {}
+                if not section_name:
+                    curr_section = None # nb: we ignore keys in sections that have no name
+            elif curr_section is not None:
                 # found a new key/value pair
-                key = mo.group( 1 ).strip().lower()
-                val = line_buf[ mo.end(0) : ].strip()
-                self.sections[ curr_section_name ][ key ] = val
+                curr_section[ key.strip().lower() ] = val.strip()
+
+    def _load_cached( self, cache, lazy ):
+        """Load the config file, using a snapshot if possible."""
+
+        # check if we have a valid snapshot
+        # NOTE: If the file's size and modified time haven't changed, we still check
+        # the content hash, since the file could have been changed without them changing.
+        fname = os.path.abspath( self.filename )
+        if cache is True:
+            snapshot_fname = fname + ".cache"
+        else:
+            snapshot_fname = os.path.join( cache,
+                hashlib.sha1( fname.encode( "utf-8" ) ).hexdigest() + ".cache"
+            )
+        stat = os.stat( fname )
+        snapshot_key = [ _SNAPSHOT_VERSION, fname, stat.st_size, stat.st_mtime_ns ]
+        buf = None
+        try:
+            with open( snapshot_fname, "rb" ) as fp:
+                snapshot = marshal.load( fp )
+        except ( OSError, EOFError, ValueError, TypeError ):
+            snapshot = None
+        if isinstance( snapshot, tuple ) and len( snapshot ) == 3 and snapshot[0] == snapshot_key:
+            with open( fname, "rb" ) as fp:
+                buf = fp.read()
+            if hashlib.blake2b( buf, digest_size=16 ).digest() == snapshot[1]:
+                self.sections = snapshot[2]
+                return
+        if lazy:
+            self._index_file()
+            return
+
+        # parse the config file
+        if buf is None:
+            with open( fname, "rb" ) as fp:
+                buf = fp.read()
+        digest = hashlib.blake2b( buf, digest_size=16 ).digest()
+        # NOTE: We translate line endings the same way open() does in text mode.
+        buf = buf.decode( "utf-8" ).replace( "\r\n", "\n" ).replace( "\r", "\n" )
+        self._parse_lines( buf )
+
+        # save a snapshot
+        # NOTE: This is just an optimization, so we ignore any errors.
+        temp_fname = "{}.{}.tmp".format( snapshot_fname, os.getpid() )
+        try:
+            with open( temp_fname, "wb" ) as fp:
+                marshal.dump( ( snapshot_key, digest, self.sections ), fp )
+            os.replace( temp_fname, snapshot_fname )
+        except OSError:
+            try:
+                os.unlink( temp_fname )
+            except OSError:
+                pass
+
+    def _index_file( self ):
+        """Record where each section starts and ends in the config file."""
+        self._section_offsets = {}
+        if os.path.getsize( self.filename ) == 0:
+            return # nb: we can't mmap an empty file
+        with open( self.filename, "rb" ) as fp:
+            self._mmap = mmap.mmap( fp.fileno(), 0, access=mmap.ACCESS_READ )
+        self._section_offsets = _find_sections( self._mmap )
+        # NOTE: Sections may have already been parsed (if we are re-indexing the file).
+        self._sections_to_parse = sum(
+            1 for section_name in self._section_offsets if section_name not in self.sections
+        )
+        if not self._sections_to_parse:
+            self.close()
+
+    def _get_section( self, section_name ):
+        """Return the key/values for a section (parsing it, if necessary)."""
+        section = self.sections.get( section_name )
+        if section is not None or self._mmap is None:
+            return section
+        offsets = self._section_offsets.get( section_name )
+        if not offsets:
+            return None
+        # parse the section
+        # NOTE: We translate line endings the same way open() does in text mode.
+        buf = self._mmap[ offsets[0] : offsets[1] ].decode( "utf-8" )
+        buf = buf.replace( "\r\n", "\n" ).replace( "\r", "\n" )
+        section = self.sections[ section_name ] = {}
+        if section_name:
+            self._parse_lines( buf, section ) # nb: we ignore keys in sections that have no name
+        self._sections_to_parse -= 1
+        if self._sections_to_parse <= 0:
+            self.close() # nb: everything has been parsed
+        return section
+
+    def freeze( self ):
+        """Make the ConfigFile read-only.
+
+        This is used when a ConfigFile is to be shared between threads. Lazy mode is not
+        thread-safe, so any sections that have not yet been parsed are parsed now.
+        """
+        if self._section_offsets:
+            for section_name in self._section_offsets:
+                self._get_section( section_name )
+        self.close()
+        self._read_only = True
+
+    def close( self ):
+        """Release the memory-mapped config file (lazy mode only).
+
+        NOTE: Any sections that have not yet been parsed will no longer be available.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
 
     def get_string( self, section, key, default="" ):
         """Return a string config value."""
@@ -108,32 +338,42 @@ class ConfigFile:
 
     def get_string_list( self, section, default=None ):
         """Return a list of string values."""
-        vals = []
-        for i in range( 1, sys.maxsize ):
-            val, text_type = self.__get_val( section, str(i), "" )
-            assert text_type is None
-            if not val:
-                break
-            vals.append( val )
+        vals = self._get_string_list( section.lower() )
         if vals:
             return vals
         else:
             return default if default is not None else []
 
-    def get_string_indirect( self, section, key, default="", required=False ):
+    def _get_string_list( self, section ):
+        """Return a list of string values (or an empty list)."""
+        vals = []
+        for i in itertools.count( 1 ):
+            val = self._get_decoded_val( section, str(i) )
+            if val is None:
+                break
+            assert val[1] is None
+            if not val[0]:
+                break
+            vals.append( val[0] )
+        return vals
+
+    def get_string_indirect( self, section, key, default="", required=False, view=False ):
         """Return a string config value, possibly from a file.
 
+        File contents are cached (in indirect_cache), and only re-read if the file changes.
+        If view is set, a read-only memory-mapped view of the file's bytes is returned instead
+        (which the caller can decode as needed, and should close when finished with it).
+
         NOTE: Awasu doesn't use this feature, but it's useful when writing extensions.
         """
         val, text_type = self.__get_val( section, key, default )
         assert text_type is None
-        if os.path.isfile( val ):
-            # a file was specified - return the string from that
-            with open( val, "r", encoding="utf-8" ) as fp:
-                val = fp.read()
-        else:
-            if required:
-                raise RuntimeError( "Can't find file: "+val )
+        # check if a file was specified (and if so, return the string from that)
+        buf = _map_file( val ) if view else self.indirect_cache.get( val )
+        if buf is not None:
+            return buf
+        if required:
+            raise RuntimeError( "Can't find file: "+val )
         return val
 
     def get_int( self, section, key, default=0 ):
@@ -144,38 +384,182 @@ class ConfigFile:
     def get_bool( self, section, key, default=False ):
         """Return a boolean config value."""
         val, _ = self.__get_val( section, key, default )
-        if val.lower() in [ "1", "true", "yes", "on", "enable", "enabled" ]:
-            return True
-        if val.lower() in [ "0", "false", "no", "off", "disable", "disabled" ]:
-            return False
-        raise ValueError( "Invalid boolean: " + val )
+        return _parse_bool( val )
+
+    def get_values( self, section, schema ):
+        """Return the config values for a section, as described by a ConfigSchema.
+
+        The values are returned in a record object, whose attributes are the ConfigKey names.
+        """
+        section = section.lower()
+        record = schema.record_class()
+        for config_key in schema.keys:
+            if config_key.val_type is list:
+                val = self._get_string_list( section ) or None
+            else:
+                val = self._get_decoded_val( section, config_key.key )
+            if val is None:
+                # the value is not present - use the default
+                val = config_key.make_default()
+            elif config_key.val_type is not list:
+                val, text_type = val
+                try:
+                    if config_key.textval:
+                        val = ( val, config_key.default[1] if text_type is None else text_type )
+                    elif text_type is not None:
+                        raise ValueError( "Unexpected TextVal" )
+                    elif config_key.val_type is int:
+                        val = int( val )
+                    elif config_key.val_type is bool:
+                        val = _parse_bool( val )
+                except ValueError as ex:
+                    raise ValueError( "Invalid config value: [{}] {}: {}".format(
+                        section, config_key.key, ex
+                    ) ) from ex
+            setattr( record, config_key.name, val )
+        return record
 
+    @timed( "config.get_val" )
     def __get_val( self, section, key, default ):
         """Return a raw config value.
 
         NOTE: A value that is present, but empty, is treated the same as
         a value that is not present i.e. it will return the default value.
         """
-        val = self.sections.get( section.lower(), {} ).get( key.lower() )
-        if not val:
+        val = self._get_decoded_val( section.lower(), key.lower() )
+        if val is None:
             # NOTE: We can't pass the default value into get(), since we need to handle both
             # the case where the key is not present, and where the key is present but empty.
-            val = "" if default is None else str(default)
-        # decode any %XX characters
-        val = re.sub( "%[0-9A-Fa-f]{2}",
-            lambda mo: chr( int( mo.group()[1:], 16 ) ),
-            val
-        )
-        # check for an Awasu TextVal type flag
-        mo = re.search( r"\n\*(\d)$", val )
-        if mo:
-            return ( val[:mo.start(0)], int(mo.group(1)) )
-        else:
-            return ( val, None )
+            val = _decode_val( "" if default is None else str(default) )
+        return val
+
+    def _get_decoded_val( self, section, key ):
+        """Return a decoded config value (or None, if it is not present or empty).
+
+        NOTE: The section and key names must already be in lower-case.
+        """
+        # check if we've already decoded this value
+        try:
+            return self._decoded_vals[ ( section, key ) ]
+        except KeyError:
+            pass
+        # decode the value
+        keyvals = self._get_section( section )
+        val = keyvals.get( key ) if keyvals else None
+        val = _decode_val( val ) if val else None
+        self._decoded_vals[ ( section, key ) ] = val
+        return val
+
+    def set_string( self, section, key, val ):
+        """Set a string config value.
+
+        NOTE: Changes are not written to the config file until commit() is called.
+        """
+        self._set_val( section, key, _encode_val( val ) )
+
+    def set_textval( self, section, key, val, text_type ):
+        """Set a TextVal config value."""
+        self._set_val( section, key, _encode_val( "{}\n*{}".format( val, text_type ) ) )
+
+    def set_int( self, section, key, val ):
+        """Set an integer config value."""
+        self._set_val( section, key, str( int( val ) ) )
+
+    def set_bool( self, section, key, val ):
+        """Set a boolean config value."""
+        self._set_val( section, key, "1" if val else "0" )
+
+    def _set_val( self, section, key, val ):
+        """Set a raw config value."""
+        if self._read_only:
+            raise RuntimeError( "This ConfigFile is read-only." )
+        # check the section and key names
+        section, key = section.strip(), key.strip()
+        if not section or "]" in section or _has_eol( section ):
+            raise ValueError( "Invalid section name: " + section )
+        if not key or key[0] in "#;'[" or "=" in key or "[" in key or _has_eol( key ):
+            raise ValueError( "Invalid key name: " + key )
+        # update the value
+        section_name, key_name = section.lower(), key.lower()
+        keyvals = self._get_section( section_name )
+        if keyvals is None:
+            keyvals = self.sections[ section_name ] = {}
+        keyvals[ key_name ] = val
+        self._decoded_vals.pop( ( section_name, key_name ), None )
+        self._changes[ ( section_name, key_name ) ] = ( section, key, val )
+
+    def commit( self ):
+        """Write any changed values back to the config file.
+
+        Only the changed values are written: the rest of the file (comments, the case
+        of key names, layout, etc.) is left as-is. If every changed value fits in the space
+        used by its old value, the file is updated in-place, otherwise a new copy is written
+        to a temp file, which then replaces the config file.
+        """
+        if not self._changes:
+            return
+        if not self.filename:
+            raise RuntimeError( "Can't commit a ConfigFile that was not loaded from a file." )
+        # NOTE: We release the file (if it was loaded lazily), since we may be replacing it.
+        # Any sections that have not yet been parsed will be re-indexed afterwards.
+        lazy = self._section_offsets is not None
+        self.close()
+        with open( self.filename, "rb" ) as fp:
+            if os.fstat( fp.fileno() ).st_size > 0:
+                buf = mmap.mmap( fp.fileno(), 0, access=mmap.ACCESS_READ )
+            else:
+                buf = b""
+        try:
+            patches = _make_patches( buf, self._changes.values() )
+            if all( len(new_val) <= end-start for start, end, new_val in patches ):
+                # update the file in-place
+                # NOTE: Values are stripped when they are read, so we can pad them with spaces.
+                buf.close()
+                with open( self.filename, "r+b" ) as fp:
+                    for start, end, new_val in patches:
+                        fp.seek( start )
+                        fp.write( new_val + b" " * ( end - start - len(new_val) ) )
+            else:
+                # write a new copy of the file
+                self._write_patched( buf, patches )
+        finally:
+            if isinstance( buf, mmap.mmap ):
+                buf.close()
+        self._changes = {}
+        if lazy:
+            self._index_file()
+
+    def _write_patched( self, buf, patches ):
+        """Write a patched copy of the config file."""
+        temp_fname = "{}.{}.tmp".format( self.filename, os.getpid() )
+        try:
+            with open( temp_fname, "wb" ) as fp:
+                pos = 0
+                for start, end, new_val in patches:
+                    fp.write( buf[ pos : start ] )
+                    fp.write( new_val )
+                    pos = end
+                fp.write( buf[ pos: ] )
+            shutil.copymode( self.filename, temp_fname )
+            if isinstance( buf, mmap.mmap ):
+                buf.close() # nb: so that we can replace the file on Windows
+            os.replace( temp_fname, self.filename )
+        finally:
+            if os.path.isfile( temp_fname ):
+                os.unlink( temp_fname )
 
     def dump( self, out=sys.stdout ):
         """Dump the ConfigFile."""
-        for section, keyvals in self.sections.items():
+        sections = self.sections
+        if self._section_offsets:
+            # make sure all the sections have been parsed (and dump them in file order)
+            sections = {
+                section: self._get_section( section )
+                for section in self._section_offsets
+            }
+        for section, keyvals in sections.items():
+            if keyvals is None:
+                continue # nb: the file was closed before this section was parsed
             print( "[{}]".format( section ), file=out )
             for key, val in keyvals.items():
                 print( "{} = {}".format( key, val ), file=out )
@@ -183,6 +567,350 @@ class ConfigFile:
 
 # ---------------------------------------------------------------------
 
+class ConfigKey:
+    """Describe a value to be read from a config section.
+
+    val_type can be str, int, bool or list (for a list of string values). If textval is set,
+    the value is returned as a (val, text_type) tuple, as for get_textval().
+    """
+
+    __slots__ = ( "name", "key", "val_type", "default", "textval" )
+
+    def __init__( self, name, val_type=str, default=None, key=None, textval=False ):
+        """Initialize the ConfigKey."""
+        if not name.isidentifier():
+            raise ValueError( "Invalid ConfigKey name: " + name )
+        if val_type not in ( str, int, bool, list ):
+            raise ValueError( "Invalid ConfigKey type: " + str(val_type) )
+        if textval and val_type is not str:
+            raise ValueError( "TextVal's must be strings: " + name )
+        self.name = name
+        self.key = ( key if key else name ).lower()
+        self.val_type = val_type
+        if default is None:
+            # use the same defaults as the get_XXX() methods
+            if textval:
+                default = ( "", ConfigFile.TVT_UNKNOWN )
+            else:
+                default = val_type()
+        self.default = default
+        self.textval = textval
+
+    def make_default( self ):
+        """Return the default value."""
+        # NOTE: We return a new list each time, so that records don't share (and can't change)
+        # the schema's default value.
+        return list( self.default ) if isinstance( self.default, list ) else self.default
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+class ConfigSchema:
+    """Describe the values to be read from a config section.
+
+    This lets ConfigFile.get_values() read all the values for a section in one go.
+    """
+
+    def __init__( self, *keys, record_name="ConfigRecord" ):
+        """Initialize the ConfigSchema."""
+        self.keys = keys
+        self.record_class = type( record_name, ( ConfigRecord, ), {
+            "__slots__": tuple( k.name for k in keys )
+        } )
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+class ConfigRecord:
+    """Base class for records returned by ConfigFile.get_values()."""
+
+    __slots__ = ()
+
+    def __repr__( self ):
+        return "{}( {} )".format(
+            type(self).__name__,
+            ", ".join( "{}={!r}".format( k, getattr( self, k ) ) for k in self.__slots__ )
+        )
+
+# ---------------------------------------------------------------------
+
+class ConfigStore:
+    """Manage ConfigFile's that are shared between threads, and reloaded when they change.
+
+    get() returns a read-only ConfigFile, which can be shared between threads. If the file
+    changes, the next call to get() will return a new ConfigFile, but any existing ones
+    continue to work (returning the old values). Files that have not been used recently
+    are dropped, once there are more than max_files of them.
+    """
+
+    def __init__( self, max_files=100, check_interval=0, cache=None ):
+        """Initialize the ConfigStore.
+
+        If check_interval is set, we wait at least that many seconds before checking
+        if a file has changed. cache is passed through to ConfigFile.
+        """
+        self.max_files = max_files
+        self.check_interval = check_interval
+        self.cache = cache
+        # NOTE: Readers don't lock anything - they just look up the current entry for a file,
+        # and entries are replaced (atomically) when a file is reloaded.
+        self._entries = {}
+        self._ticks = itertools.count()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def get( self, fname ):
+        """Return a ConfigFile for the specified file."""
+
+        # check if the file has changed
+        fname = os.path.abspath( fname )
+        entry = self._entries.get( fname )
+        now = time.monotonic()
+        if entry:
+            if now - entry.check_time < self.check_interval:
+                entry.last_used = next( self._ticks )
+                return entry.config_file
+            stat_key = _get_stat_key( fname )
+            if stat_key == entry.stat_key:
+                entry.check_time = now
+                entry.last_used = next( self._ticks )
+                return entry.config_file
+
+        # (re)load the file
+        # NOTE: We make sure that only one thread (re)loads a given file.
+        with self._load_locks.setdefault( fname, threading.Lock() ):
+            # check if another thread has already reloaded the file
+            stat_key = _get_stat_key( fname )
+            entry = self._entries.get( fname )
+            if entry and stat_key == entry.stat_key:
+                entry.last_used = next( self._ticks )
+                return entry.config_file
+            # NOTE: We get the file's details before we load it, so that if it changes
+            # while we are loading it, we will notice next time.
+            config_file = ConfigFile( fname, cache=self.cache )
+            config_file.freeze()
+            entry = _ConfigStoreEntry( config_file, stat_key, now, next( self._ticks ) )
+            with self._lock:
+                self._entries[ fname ] = entry
+        self._evict()
+        return config_file
+
+    def invalidate( self, fname=None ):
+        """Drop the specified file (or all files)."""
+        with self._lock:
+            if fname:
+                self._entries.pop( os.path.abspath( fname ), None )
+            else:
+                self._entries.clear()
+
+    def _evict( self ):
+        """Drop the least-recently used files."""
+        if len( self._entries ) <= self.max_files:
+            return
+        with self._lock:
+            entries = sorted( self._entries.items(), key = lambda e: e[1].last_used )
+            for fname, _ in entries[ : len(entries) - self.max_files ]:
+                del self._entries[ fname ]
+                self._load_locks.pop( fname, None )
+
+class _ConfigStoreEntry:
+    """Holds a ConfigFile managed by a ConfigStore."""
+
+    __slots__ = ( "config_file", "stat_key", "check_time", "last_used" )
+
+    def __init__( self, config_file, stat_key, check_time, last_used ):
+        self.config_file = config_file
+        self.stat_key = stat_key
+        self.check_time = check_time
+        self.last_used = last_used
+
+def _get_stat_key( fname ):
+    """Return the details used to check if a file has changed."""
+    stat = os.stat( fname )
+    return ( stat.st_size, stat.st_mtime_ns, stat.st_ino )
+
+# ---------------------------------------------------------------------
+
+def _find_sections( buf ):
+    """Find where each section starts and ends in a config file.
+
+    Returns a dictionary of section names => [ start, end ] byte offsets.
+    """
+    # NOTE: We only look at lines that contain a "[", and check them the same way
+    # that _parse_lines() does, so that we find exactly the same sections. We also
+    # look for line endings the same way open() does in text mode.
+    sections = {}
+    curr_offsets = None
+    line_end = 3 if buf[:3] == b"\xef\xbb\xbf" else 0 # nb: skip over the BOM
+    pos = buf.find( b"[", line_end )
+    while pos >= 0:
+        # find the line that contains the "["
+        line_start = max( buf.rfind( b"\n", line_end, pos ), buf.rfind( b"\r", line_end, pos ) )
+        line_start = line_start+1 if line_start >= 0 else line_end
+        mo = _EOL_REGEX.search( buf, pos )
+        line_end = mo.start() if mo else len(buf)
+        line_buf = buf[ line_start : line_end ].decode( "utf-8" ).strip()
+        mo = _SECTION_HEADER_REGEX.search( line_buf )
+        if mo:
+            # found the start of a new section
+            if curr_offsets:
+                curr_offsets[1] = line_start
+            # NOTE: If a section appears more than once, the last one wins (as it does
+            # when the file is parsed normally).
+            curr_offsets = [ line_end, len(buf) ]
+            sections[ mo.group(1).strip().lower() ] = curr_offsets
+        pos = buf.find( b"[", line_end )
+    return sections
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _map_file( fname ):
+    """Return a read-only memory-mapped view of a file (or None, if it's not a file)."""
+    if not os.path.isfile( fname ):
+        return None
+    with open( fname, "rb" ) as fp:
+        if os.fstat( fp.fileno() ).st_size == 0:
+            return b"" # nb: we can't mmap an empty file
+        return mmap.mmap( fp.fileno(), 0, access=mmap.ACCESS_READ )
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _make_patches( buf, changes ):
+    """Work out how to update a config file with changed values.
+
+    Returns a sorted list of ( start, end, new_val ) tuples, where start and end are byte offsets.
+    """
+
+    # initialize
+    eol = b"\r\n" if buf.find( b"\r\n", 0, 64*1024 ) >= 0 else b"\n"
+    section_offsets = _find_sections( buf )
+    section_changes = {}
+    for section, key, val in changes:
+        section_changes.setdefault( section.lower(), [] ).append( ( section, key, val ) )
+
+    def find_eol( section_buf, pos ):
+        # find the end of the line that contains the specified position
+        mo = _EOL_REGEX.search( section_buf, pos )
+        if not mo:
+            return len( section_buf )
+        return mo.start() + ( 2 if section_buf[ mo.start() : mo.start()+2 ] == b"\r\n" else 1 )
+    def to_bytes( text, pos ):
+        # convert a character offset to a byte offset
+        return len( text[:pos].encode( "utf-8" ) )
+
+    patches = []
+    new_sections = []
+    for section_name, keyvals in section_changes.items():
+        offsets = section_offsets.get( section_name )
+        if not offsets:
+            new_sections.append( keyvals )
+            continue
+        # find where each key's value is in the section
+        # NOTE: We replace CR's with LF's (so that we see line endings the same way open() does),
+        # which doesn't change any character offsets. If a key appears more than once,
+        # the last one wins (as it does when the file is parsed).
+        section_buf = buf[ offsets[0] : offsets[1] ]
+        text = section_buf.decode( "utf-8" ).replace( "\r", "\n" )
+        val_spans = {}
+        insert_pos = 0
+        for mo in _LINE_REGEX.finditer( text ):
+            val = mo.group( 3 )
+            start = mo.start( 3 ) + len(val) - len( val.lstrip() )
+            val_spans[ mo.group(2).strip().lower() ] = ( start, start + len( val.strip() ) )
+            insert_pos = mo.end( 3 )
+        insert_pos = find_eol( section_buf, to_bytes( text, insert_pos ) )
+        new_lines = []
+        for _, key, val in keyvals:
+            span = val_spans.get( key.lower() )
+            if span:
+                # replace the existing value
+                patches.append( (
+                    offsets[0] + to_bytes( text, span[0] ), offsets[0] + to_bytes( text, span[1] ),
+                    val.encode( "utf-8" )
+                ) )
+            else:
+                # add a new key/value
+                new_lines.append( "{} = {}".format( key, val ).encode( "utf-8" ) + eol )
+        if new_lines:
+            at_eol = insert_pos < len(section_buf) or section_buf[-1:] in ( b"\r", b"\n" )
+            prefix = b"" if at_eol else eol
+            pos = offsets[0] + insert_pos
+            patches.append( ( pos, pos, prefix + b"".join( new_lines ) ) )
+
+    # add any new sections
+    if new_sections:
+        new_lines = []
+        at_eol = not buf or buf[-1:] in ( b"\r", b"\n" ) or any( p[0] == len(buf) for p in patches )
+        if not at_eol:
+            new_lines.append( eol ) # nb: terminate the last line
+        for keyvals in new_sections:
+            if buf or new_lines:
+                new_lines.append( eol ) # nb: leave a blank line between sections
+            new_lines.append( "[{}]".format( keyvals[0][0] ).encode( "utf-8" ) + eol )
+            for _, key, val in keyvals:
+                new_lines.append( "{} = {}".format( key, val ).encode( "utf-8" ) + eol )
+        patches.append( ( len(buf), len(buf), b"".join( new_lines ) ) )
+
+    patches.sort( key = lambda p: p[0] )
+    return patches
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _decode_val( val ):
+    """Decode a raw config value.
+
+    Returns a (val, text_type) tuple, where text_type is None if the value is not a TextVal.
+    """
+    # decode any %XX characters
+    # NOTE: Each %XX is decoded to a single character (i.e. not as UTF-8).
+    if "%" in val:
+        val = urllib.parse.unquote( val, encoding="latin-1" )
+    # check for an Awasu TextVal type flag
+    # NOTE: The flag can only be in the last few characters, so we don't search the whole value.
+    mo = _TEXTVAL_FLAG_REGEX.search( val, max( len(val)-4, 0 ) )
+    if mo:
+        return ( val[:mo.start(0)], int(mo.group(1)) )
+    else:
+        return ( val, None )
+
+def _encode_val( val ):
+    """Encode a config value."""
+    # NOTE: We encode "%" and control characters (so that the value stays on one line),
+    # and leading/trailing whitespace (since values are stripped when they are read).
+    # Whitespace characters above U+00FF can't be encoded, and will be lost.
+    val = _ENCODE_REGEX.sub( _encode_char, str(val) )
+    val2 = val.strip()
+    if val2 != val:
+        lead = len(val) - len( val.lstrip() )
+        trail = len(val) - lead - len(val2)
+        val = _LATIN1_REGEX.sub( _encode_char, val[:lead] ) \
+            + val2 \
+            + _LATIN1_REGEX.sub( _encode_char, val[len(val)-trail:] )
+        val = val.strip()
+    return val
+
+def _encode_char( mo ):
+    """Encode a character as %XX."""
+    return "%{:02X}".format( ord( mo.group() ) )
+
+def _has_eol( val ):
+    """Check if a value contains a line ending."""
+    return "\n" in val or "\r" in val
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _parse_bool( val ):
+    """Parse a boolean config value."""
+    val2 = val.lower()
+    if val2 in _TRUE_VALS:
+        return True
+    if val2 in _FALSE_VALS:
+        return False
+    raise ValueError( "Invalid boolean: " + val )
+
+_TRUE_VALS = frozenset( [ "1", "true", "yes", "on", "enable", "enabled" ] )
+_FALSE_VALS = frozenset( [ "0", "false", "no", "off", "disable", "disabled" ] )
+
+# ---------------------------------------------------------------------
+
 class ConfigFileTestCase( unittest.TestCase ):
     """Test this module."""
 
@@ -299,6 +1027,375 @@ japan = \xE6\x97\xA5\xE6\x9C\xAC
         check( "japan", "\u65e5\u672c" )
         check( "\u65e5\u672c", "nihon" )
 
+    def test_parse( self ):
+        """Test parsing unusual lines."""
+
+        # initialize
+        config_file = ConfigFile( "\ufeff[ Section ]\n" \
+            "  key with spaces  =  val = 1  \n" \
+            "\t# comment = 1\n" \
+            "  ' comment = 2\n" \
+            "a[b = 2\n" \
+            "=c=3\n" \
+            "[d=4\n" \
+            "no value\n" \
+            "[ ]\n" \
+            "ignored = 5\n"
+        )
+
+        # check the parsed values
+        self.assertEqual( config_file.sections, {
+            "section": { "key with spaces": "val = 1", "b": "2", "c": "3", "d": "4" },
+            "": {}
+        } )
+
+    def test_decode_val( self ):
+        """Test decoding %XX characters and TextVal flags."""
+
+        # initialize
+        config_file = ConfigFile( b"""
+[section]
+escapes = 100%25 %41%62c %zz %4 %e9%
+flag = Some text.%0A*1%0A
+not_flag = *1 is not a flag.
+""" )
+
+        # check that values are decoded correctly (and the same, when they are cached)
+        for _ in range( 2 ):
+            self.assertEqual(
+                config_file.get_string( "section", "escapes" ),
+                "100% Abc %zz %4 \u00e9%"
+            )
+            self.assertEqual(
+                config_file.get_textval( "section", "flag" ),
+                ( "Some text.", ConfigFile.TVT_PLAINTEXT )
+            )
+            self.assertEqual(
+                config_file.get_textval( "section", "not_flag" ),
+                ( "*1 is not a flag.", ConfigFile.TVT_UNKNOWN )
+            )
+            self.assertEqual( config_file.get_string( "section", "missing", "%41" ), "A" )
+
+    def test_cache( self ):
+        """Test caching parsed config files."""
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+
+            # initialize
+            fname = os.path.join( temp_dir, "test.ini" )
+            def write_config_file( val ):
+                with open( fname, "w", encoding="utf-8" ) as fp:
+                    fp.write( "[section]\r\nkey = {}\r\n".format( val ) )
+                os.utime( fname, ns=( 1000000000, 1000000000 ) )
+            write_config_file( "foo" )
+
+            # load the config file (this will create a snapshot)
+            config_file = ConfigFile( fname, cache=temp_dir )
+            self.assertEqual( config_file.get_string( "section", "key" ), "foo" )
+            snapshot_fnames = [ f for f in os.listdir( temp_dir ) if f.endswith( ".cache" ) ]
+            self.assertEqual( len( snapshot_fnames ), 1 )
+
+            # load the config file again (this will use the snapshot)
+            config_file = ConfigFile( fname, cache=temp_dir )
+            self.assertEqual( config_file.get_string( "section", "key" ), "foo" )
+            self.assertEqual( config_file.sections, ConfigFile( fname ).sections )
+
+            # change the config file (without changing its size or modified time)
+            write_config_file( "bar" )
+            config_file = ConfigFile( fname, cache=temp_dir, lazy=True )
+            self.assertEqual( config_file.get_string( "section", "key" ), "bar" )
+            config_file = ConfigFile( fname, cache=temp_dir )
+            self.assertEqual( config_file.get_string( "section", "key" ), "bar" )
+
+            # corrupt the snapshot
+            with open( os.path.join( temp_dir, snapshot_fnames[0] ), "wb" ) as fp:
+                fp.write( b"corrupted" )
+            config_file = ConfigFile( fname, cache=temp_dir )
+            self.assertEqual( config_file.get_string( "section", "key" ), "bar" )
+
+            # check storing the snapshot next to the config file
+            config_file = ConfigFile( fname, cache=True )
+            self.assertTrue( os.path.isfile( fname + ".cache" ) )
+            config_file = ConfigFile( fname, cache=True )
+            self.assertEqual( config_file.get_string( "section", "key" ), "bar" )
+
+    def test_commit( self ):
+        """Test writing changes back to a config file."""
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+
+            # initialize
+            fname = os.path.join( temp_dir, "test.ini" )
+            with open( fname, "wb" ) as fp:
+                fp.write( b"; state file\r\n" \
+                    b"[State]\r\n" \
+                    b"LastSeenId = 12345\r\n" \
+                    b"Cursor = abcdef\r\n" \
+                    b"\r\n" \
+                    b"[Other] ; comment\r\n" \
+                    b"Key = val" )
+            def read_config_file():
+                with open( fname, "rb" ) as fp:
+                    return fp.read()
+
+            # update a value in-place
+            config_file = ConfigFile( fname )
+            config_file.set_int( "state", "lastseenid", 99 )
+            self.assertEqual( config_file.get_int( "state", "lastseenid" ), 99 )
+            config_file.commit()
+            self.assertEqual( read_config_file(), b"; state file\r\n" \
+                b"[State]\r\n" \
+                b"LastSeenId = 99   \r\n" \
+                b"Cursor = abcdef\r\n" \
+                b"\r\n" \
+                b"[Other] ; comment\r\n" \
+                b"Key = val"
+            )
+
+            # update values that don't fit, and add new values and sections
+            config_file = ConfigFile( fname, lazy=True )
+            config_file.set_string( "State", "Cursor", " 100% \u65e5\u672c \n" )
+            config_file.set_bool( "State", "Enabled", True )
+            config_file.set_textval( "New Section", "Title", "<b>Title</b>", ConfigFile.TVT_HTML )
+            config_file.set_string( "other", "key2", "val2" )
+            config_file.commit()
+            self.assertEqual( read_config_file().decode( "utf-8" ), "; state file\r\n" \
+                "[State]\r\n" \
+                "LastSeenId = 99   \r\n" \
+                "Cursor = %20100%25 \u65e5\u672c %0A\r\n" \
+                "Enabled = 1\r\n" \
+                "\r\n" \
+                "[Other] ; comment\r\n" \
+                "Key = val\r\n" \
+                "key2 = val2\r\n" \
+                "\r\n" \
+                "[New Section]\r\n" \
+                "Title = <b>Title</b>%0A*2\r\n"
+            )
+            self.assertEqual( config_file.get_string( "other", "key" ), "val" )
+
+            # check that the values were written correctly
+            config_file = ConfigFile( fname )
+            self.assertEqual( config_file.get_int( "state", "lastseenid" ), 99 )
+            self.assertEqual( config_file.get_string( "state", "cursor" ), " 100% \u65e5\u672c \n" )
+            self.assertIs( config_file.get_bool( "state", "enabled" ), True )
+            self.assertEqual(
+                config_file.get_textval( "new section", "title" ),
+                ( "<b>Title</b>", ConfigFile.TVT_HTML )
+            )
+
+            # check that invalid names are rejected
+            with self.assertRaises( ValueError ):
+                config_file.set_string( "state", "foo=bar", "" )
+            with self.assertRaises( ValueError ):
+                config_file.set_string( "[state]", "foo", "" )
+
+    def test_get_string_indirect( self ):
+        """Test getting string values from files."""
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+
+            # initialize
+            def write_file( fname, val, mtime ):
+                fname = os.path.join( temp_dir, fname )
+                with open( fname, "w", encoding="utf-8" ) as fp:
+                    fp.write( val )
+                os.utime( fname, ( mtime, mtime ) )
+                return fname
+            fname1 = write_file( "test1.txt", "Hello, \u65e5\u672c!", 1000 )
+            fname2 = write_file( "test2.txt", "x" * 20, 1000 )
+            config_file = ConfigFile( "[section]\nfile1 = {}\nfile2 = {}\nmissing = {}\n".format(
+                fname1, fname2, os.path.join( temp_dir, "missing.txt" )
+            ) )
+            config_file.indirect_cache = IndirectFileCache( max_bytes=30 )
+
+            # check that file contents are cached
+            val = config_file.get_string_indirect( "section", "file1" )
+            self.assertEqual( val, "Hello, \u65e5\u672c!" )
+            self.assertIs( config_file.get_string_indirect( "section", "file1" ), val )
+
+            # check that files are re-read if they change
+            write_file( "test1.txt", "Hello, world!", 2000 )
+            self.assertEqual( config_file.get_string_indirect( "section", "file1" ), "Hello, world!" )
+
+            # check that the least-recently used files are dropped
+            val = config_file.get_string_indirect( "section", "file1" )
+            self.assertEqual( config_file.get_string_indirect( "section", "file2" ), "x" * 20 )
+            self.assertIsNot( config_file.get_string_indirect( "section", "file1" ), val )
+
+            # check getting a memory-mapped view of a file
+            buf = config_file.get_string_indirect( "section", "file1", view=True )
+            self.assertEqual( buf[:], b"Hello, world!" )
+            buf.close()
+
+            # check handling of missing files
+            self.assertEqual(
+                config_file.get_string_indirect( "section", "missing" ),
+                os.path.join( temp_dir, "missing.txt" )
+            )
+            with self.assertRaises( RuntimeError ):
+                config_file.get_string_indirect( "section", "missing", required=True )
+
+    def test_get_values( self ):
+        """Test getting values using a ConfigSchema."""
+
+        # initialize
+        config_file = ConfigFile( b"""
+[Channel]
+Title = My channel%0A*1
+Description = Not a TextVal.
+Max Items = 42
+Enabled = yes
+1 = foo
+2 = bar
+4 = not included
+Bad Int = ???
+""" )
+        schema = ConfigSchema(
+            ConfigKey( "title", textval=True ),
+            ConfigKey( "description", textval=True, default=("",ConfigFile.TVT_HTML) ),
+            ConfigKey( "max_items", int, key="Max Items" ),
+            ConfigKey( "enabled", bool ),
+            ConfigKey( "vals", list ),
+            ConfigKey( "url", default="http://test.com" ),
+            ConfigKey( "missing_int", int ),
+        )
+
+        # check that the values are returned correctly
+        # NOTE: Record attributes are created dynamically, so we use getattr() to read them.
+        record = config_file.get_values( "channel", schema )
+        self.assertIsInstance( record, ConfigRecord )
+        self.assertFalse( hasattr( record, "__dict__" ) )
+        self.assertEqual( getattr( record, "title" ), ( "My channel", ConfigFile.TVT_PLAINTEXT ) )
+        self.assertEqual( getattr( record, "description" ), ( "Not a TextVal.", ConfigFile.TVT_HTML ) )
+        self.assertEqual( getattr( record, "max_items" ), 42 )
+        self.assertIs( getattr( record, "enabled" ), True )
+        self.assertEqual( getattr( record, "vals" ), [ "foo", "bar" ] )
+        self.assertEqual( getattr( record, "url" ), "http://test.com" )
+        self.assertEqual( getattr( record, "missing_int" ), 0 )
+        record = config_file.get_values( "missing", schema )
+        self.assertEqual( getattr( record, "title" ), ( "", ConfigFile.TVT_UNKNOWN ) )
+        self.assertEqual( getattr( record, "vals" ), [] )
+
+        # check that records don't share default values
+        getattr( record, "vals" ).append( "X" )
+        record2 = config_file.get_values( "missing", schema )
+        self.assertEqual( getattr( record2, "vals" ), [] )
+        self.assertEqual( schema.keys[4].default, [] )
+        schema2 = ConfigSchema( ConfigKey( "vals", list, default=[ "default" ] ) )
+        getattr( config_file.get_values( "missing", schema2 ), "vals" ).append( "X" )
+        self.assertEqual( getattr( config_file.get_values( "missing", schema2 ), "vals" ), [ "default" ] )
+
+        # check that invalid values are detected
+        with self.assertRaises( ValueError ):
+            config_file.get_values( "channel", ConfigSchema( ConfigKey( "bad_int", int, key="Bad Int" ) ) )
+        with self.assertRaises( ValueError ):
+            config_file.get_values( "channel", ConfigSchema( ConfigKey( "title" ) ) )
+        with self.assertRaises( ValueError ):
+            ConfigKey( "not valid" )
+
+    def test_lazy( self ):
+        """Test loading a ConfigFile lazily."""
+
+        # initialize
+        buf = "\ufeff[first]\r\n" \
+              "key = val [1]\r\n" \
+              "a[b=c\r\n" \
+              "; [not a section]\r\n" \
+              "  [ Second ]  \r\n" \
+              "japan = \u65e5\u672c\r\n" \
+              "text = Some text.%0A*2\r\n" \
+              "[first]\n" \
+              "key = val [2]\n" \
+              "\u3000[third]\r" \
+              "1 = one\r" \
+              "2 = two\r" \
+              "[]\n" \
+              "[empty]\n"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fname = os.path.join( temp_dir, "test.ini" )
+            with open( fname, "w", encoding="utf-8", newline="" ) as fp:
+                fp.write( buf )
+            config_file = ConfigFile( fname )
+            lazy_config_file = ConfigFile( fname, lazy=True )
+
+            # check that the lazy ConfigFile returns the same values
+            self.assertEqual( lazy_config_file.sections, {} )
+            self.assertEqual(
+                lazy_config_file.get_string( "second", "japan" ),
+                config_file.get_string( "second", "japan" )
+            )
+            self.assertEqual( list( lazy_config_file.sections.keys() ), [ "second" ] )
+            self.assertEqual(
+                lazy_config_file.get_textval( "Second", "text" ),
+                ( "Some text.", ConfigFile.TVT_HTML )
+            )
+            self.assertEqual( lazy_config_file.get_string( "first", "key" ), "val [2]" )
+            self.assertEqual( lazy_config_file.get_string_list( "third" ), [ "one", "two" ] )
+            self.assertEqual( lazy_config_file.get_string( "missing", "key", "?" ), "?" )
+            out, lazy_out = io.StringIO(), io.StringIO()
+            config_file.dump( out )
+            lazy_config_file.dump( lazy_out )
+            self.assertEqual( lazy_config_file.sections, config_file.sections )
+            self.assertEqual( lazy_out.getvalue(), out.getvalue() )
+            self.assertIsNone( lazy_config_file._mmap ) #pylint: disable=protected-access
+
+# ---------------------------------------------------------------------
+
+class ConfigStoreTestCase( unittest.TestCase ):
+    """Test the ConfigStore class."""
+
+    def test_config_store( self ):
+        """Test getting ConfigFile's from a ConfigStore."""
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+
+            # initialize
+            def write_config_file( fname, val, mtime ):
+                fname = os.path.join( temp_dir, fname )
+                with open( fname, "w", encoding="utf-8" ) as fp:
+                    fp.write( "[section]\nkey = {}\n".format( val ) )
+                os.utime( fname, ( mtime, mtime ) )
+                return fname
+            fname1 = write_config_file( "test1.ini", "foo", 1000 )
+            fname2 = write_config_file( "test2.ini", "bar", 1000 )
+            fname3 = write_config_file( "test3.ini", "baz", 1000 )
+            config_store = ConfigStore( max_files=2 )
+
+            # check that files are only loaded once
+            config_file1 = config_store.get( fname1 )
+            self.assertEqual( config_file1.get_string( "section", "key" ), "foo" )
+            self.assertIs( config_store.get( fname1 ), config_file1 )
+            with self.assertRaises( RuntimeError ):
+                config_file1.set_string( "section", "key", "xyz" )
+
+            # check that files are reloaded when they change
+            write_config_file( "test1.ini", "foo2", 2000 )
+            config_file1b = config_store.get( fname1 )
+            self.assertIsNot( config_file1b, config_file1 )
+            self.assertEqual( config_file1b.get_string( "section", "key" ), "foo2" )
+            self.assertEqual( config_file1.get_string( "section", "key" ), "foo" )
+
+            # check that the least-recently used files are dropped
+            config_file2 = config_store.get( fname2 )
+            self.assertIs( config_store.get( fname1 ), config_file1b )
+            config_store.get( fname3 )
+            self.assertIs( config_store.get( fname1 ), config_file1b )
+            self.assertIsNot( config_store.get( fname2 ), config_file2 )
+
+            # check that files can be shared between threads
+            write_config_file( "test1.ini", "foo3", 3000 )
+            results = []
+            def get_val():
+                for _ in range( 100 ):
+                    results.append( config_store.get( fname1 ).get_string( "section", "key" ) )
+            threads = [ threading.Thread( target=get_val ) for _ in range( 8 ) ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual( set( results ), { "foo3" } )
+
 # ---------------------------------------------------------------------
 
 if __name__ == "__main__":
@@ -29,42 +29,180 @@
 
 import sys
 import os
+import io
+import re
+import math
+import array
+import string
+import itertools
+import heapq
+import functools
+import collections
+import concurrent.futures
+import hashlib
+import gzip
+import contextlib
+import marshal
+import threading
+import queue
+import atexit
 import time
+import tempfile
+import unittest
 
 from awasu_tools.utils import safe_xml, pretty_xml
-from awasu_tools.log import log_msg, log_raw_msg
+from awasu_tools.timestamps import parse_timestamp, format_iso8601
+import awasu_tools.log
+from awasu_tools.log import log_msg, log_raw_msg, is_logging
+from awasu_tools.stats import timed
+
+_RENDER_CACHE_VERSION = 3
+
+# NOTE: Feed items are only cached if all the values used by their template are one of these types,
+# since we need to be sure that the same key means the same XML. The codes are stored in the cache keys.
+_CACHEABLE_TYPES = { str: "s", int: "i", float: "f", bool: "b", type(None): "n" }
 
 # ---------------------------------------------------------------------
 
 class Feed:
     """Container for a feed and its items."""
 
-    def __init__( self, title, home_url, description=None, image_url=None, updated_time=None, extra_args=None ):
-        """Initialize the Feed."""
+    # NOTE: Feeds with fewer items than this are always rendered serially.
+    PARALLEL_THRESHOLD = 1000
+
+    # NOTE: save_xml() generates feeds in memory, unless they get larger than this.
+    SPOOL_SIZE = 16*1024*1024
+
+    DEFAULT_TEMPL = """<?xml version="1.0" encoding="UTF-8"?>""" "\n" \
+                    """<feed xmlns="http://www.w3.org/2005/Atom" xmlns:xh="http://www.w3.org/1999/xhtml">""" "\n" \
+                    """<title type="text">{title}</title>""" "\n" \
+                    """<subtitle type="html">{description}</subtitle>""" "\n" \
+                    """<link href="{url}" />""" "\n" \
+                    """<logo>{image_url}</logo>""" "\n" \
+                    """<updated>{updated_time}</updated>""" "\n" \
+                    """{feed_items}""" "\n" \
+                    """</feed>"""
+
+    def __init__( self, title, home_url, description=None, image_url=None, updated_time=None, extra_args=None,
+        render_cache=None, max_items=None
+    ):
+        """Initialize the Feed.
+
+        If render_cache is set, it should be a RenderCache, which will be used to re-use
+        the XML generated for feed items that haven't changed.
+
+        If max_items is set, only the newest max_items feed items are kept (see NewestFeedItems).
+        """
         self.title = title
         self.home_url = home_url
         self.description = description
         self.image_url = image_url
         self.updated_time = updated_time if updated_time else time.time()
         self.extra_args = extra_args
-        self.feed_items = []
+        self.feed_items = NewestFeedItems( max_items ) if max_items else []
+        self.render_cache = render_cache
 
-    def get_xml( self, templ=None, log=None ):
-        """Generate the feed XML."""
+    @timed( "feed.get_xml" )
+    def get_xml( self, templ=None, log=None, workers=None, use_processes=False ):
+        """Generate the feed XML.
+
+        log can be a FeedItemLogger, to control how feed items are logged. If workers is set, feed items
+        are rendered in parallel, using a thread pool (or a process pool, if use_processes is set).
+        """
+        return "".join( self.iter_xml( templ, log, workers, use_processes ) )
+
+    @timed( "feed.write_xml" )
+    def write_xml( self, fp, templ=None, log=None, workers=None, use_processes=False ):
+        """Write the feed XML to a file (or pipe).
+
+        If fp is a binary file, the XML is written as UTF-8.
+        """
+        if isinstance( fp, io.TextIOBase ):
+            for buf in self.iter_xml( templ, log, workers, use_processes ):
+                fp.write( buf )
+        else:
+            for buf in self.iter_xml( templ, log, workers, use_processes ):
+                fp.write( buf.encode( "utf-8" ) )
+
+    @timed( "feed.save_xml" )
+    def save_xml( self, fname, templ=None, log=None, workers=None, use_processes=False, gzip_fname=None ):
+        """Save the feed XML to a file (only if it has changed).
+
+        A digest of the XML is stored in fname.digest, and if the XML is the same as the last time
+        it was saved, the file is not re-written. If gzip_fname is set, a compressed copy of the file
+        is also saved (to fname.gz, if gzip_fname is True).
+
+        Returns True if the file was saved, False if it was unchanged.
+        """
+
+        # generate the feed XML
+        if gzip_fname is True:
+            gzip_fname = fname + ".gz"
+        digest_fname = fname + ".digest"
+        hasher = hashlib.blake2b( digest_size=16 )
+        with tempfile.SpooledTemporaryFile( max_size=Feed.SPOOL_SIZE ) as spool:
+            for buf in self.iter_xml( templ, log, workers, use_processes ):
+                buf = buf.encode( "utf-8" )
+                hasher.update( buf )
+                spool.write( buf )
+            digest = "{} {}".format( hasher.hexdigest(), spool.tell() )
+
+            # check if the feed has changed
+            # NOTE: We also check that the files are still there, and that the feed XML file
+            # is the right size (in case someone else has changed it).
+            try:
+                with open( digest_fname, "r", encoding="utf-8" ) as fp:
+                    prev_digest = fp.read().strip()
+                if prev_digest == digest \
+                  and os.path.getsize( fname ) == spool.tell() \
+                  and ( not gzip_fname or os.path.isfile( gzip_fname ) ):
+                    return False
+            except OSError:
+                pass
+
+            # save the feed XML
+            # NOTE: We write the compressed copy at the same time, and then replace the files
+            # in one go, so that they are never out of sync (or only partially written).
+            spool.seek( 0 )
+            save_fnames = [ fname, gzip_fname ] if gzip_fname else [ fname ]
+            temp_fnames = [ "{}.{}.tmp".format( f, os.getpid() ) for f in save_fnames ]
+            try:
+                with contextlib.ExitStack() as stack:
+                    outputs = [ stack.enter_context( open( temp_fnames[0], "wb" ) ) ]
+                    if gzip_fname:
+                        fp = stack.enter_context( open( temp_fnames[1], "wb" ) )
+                        # nb: we set the filename and timestamp, so that the output is always the same
+                        outputs.append( stack.enter_context( gzip.GzipFile(
+                            filename=gzip_fname, mode="wb", fileobj=fp, mtime=0
+                        ) ) )
+                    while True:
+                        buf = spool.read( 64*1024 )
+                        if not buf:
+                            break
+                        for out in outputs:
+                            out.write( buf )
+                for temp_fname, save_fname in zip( temp_fnames, save_fnames ):
+                    os.replace( temp_fname, save_fname )
+                with open( temp_fnames[0], "w", encoding="utf-8" ) as fp:
+                    fp.write( digest )
+                os.replace( temp_fnames[0], digest_fname )
+            finally:
+                for temp_fname in temp_fnames:
+                    if os.path.isfile( temp_fname ):
+                        os.unlink( temp_fname )
+        return True
+
+    def iter_xml( self, templ=None, log=None, workers=None, use_processes=False ):
+        """Generate the feed XML, in pieces.
+
+        The feed header, each feed item, and the feed footer are generated separately,
+        so that the XML for a large feed doesn't have to be held in memory all at once.
+        """
         # initialize
         if templ:
             assert isinstance( templ, str )
         else:
-            # use the default template
-            templ = """<?xml version="1.0" encoding="UTF-8"?>""" "\n" \
-                    """<feed xmlns="http://www.w3.org/2005/Atom" xmlns:xh="http://www.w3.org/1999/xhtml">""" "\n" \
-                    """<title type="text">{title}</title>""" "\n" \
-                    """<subtitle type="html">{description}</subtitle>""" "\n" \
-                    """<link href="{url}" />""" "\n" \
-                    """<logo>{image_url}</logo>""" "\n" \
-                    """<updated>{updated_time}</updated>""" "\n" \
-                    """{feed_items}""" "\n" \
-                    """</feed>"""
+            templ = Feed.DEFAULT_TEMPL
         # generate the feed XML
         args = {
             "title": self.title,
@@ -88,25 +226,117 @@ class Feed:
             args["image_url"] = "file:///" + os.path.join( dname, self.image_url )
         if self.extra_args:
             args.update( self.extra_args )
-        args = {
-            k: safe_xml( v ) if v is not None else ""
-            for k, v in args.items()
-        }
-        args["feed_items"] = "\n".join(
-            fi.get_xml(log) for fi in self.feed_items
-        )
+        if isinstance( log, FeedItemLogger ):
+            log.reset()
+        if self.render_cache is not None:
+            # NOTE: The cache only gets saved once all the feed items have been generated.
+            yield from self._iter_xml( templ, args, log, workers, use_processes )
+            self.render_cache.save()
+        else:
+            yield from self._iter_xml( templ, args, log, workers, use_processes )
+
+    def _iter_xml( self, templ, args, log, workers, use_processes ):
+        """Generate the feed XML, in pieces."""
         if not self.feed_items:
             # tidy up the output if there are no feed items
             pos = templ.find( "{feed_items}\n" )
             if pos >= 0:
                 templ = templ[:pos] + templ[pos+13:]
-        return templ.format( **args )
+            yield _compile_templ( templ ).render( args, { "feed_items": "" } )
+            return
+        templ_parts = _compile_feed_templ( templ )
+        if not templ_parts:
+            # NOTE: We can't split the template (e.g. because {feed_items} appears more than once),
+            # so we have to generate everything in one go.
+            feed_items = "\n".join(
+                self._render_feed_items( log, workers, use_processes )
+            )
+            yield _compile_templ( templ ).render( args, { "feed_items": feed_items } )
+            return
+        yield templ_parts[0].render( args )
+        for i, buf in enumerate( self._render_feed_items( log, workers, use_processes ) ):
+            if i > 0:
+                yield "\n"
+            yield buf
+        yield templ_parts[1].render( args )
+
+    def _render_feed_items( self, log, workers, use_processes ):
+        """Generate the XML for each feed item (in order)."""
+
+        # check if we have a render cache
+        cache = self.render_cache
+        if cache is None:
+            yield from Feed._render_uncached( self.feed_items, log, workers, use_processes )
+            return
+
+        # look for feed items that have already been rendered
+        feed_items = list( self.feed_items )
+        templ_args = [ feed_item._get_templ_args() for feed_item in feed_items ] #pylint: disable=protected-access
+        keys = [ cache.make_key( templ, args ) for templ, args in templ_args ]
+        bufs = [ cache.get( key ) for key in keys ]
+
+        # check if we should render the feed items that weren't in the cache in parallel
+        uncached = [ feed_item for feed_item, buf in zip( feed_items, bufs ) if buf is None ]
+        if workers and workers > 1 and len( uncached ) >= Feed.PARALLEL_THRESHOLD:
+            rendered = Feed._render_uncached( uncached, log, workers, use_processes )
+        else:
+            rendered = None
+
+        # generate the XML for each feed item
+        # NOTE: We render the feed items that weren't in the cache as we go, so that everything
+        # gets logged in the correct order.
+        for feed_item, ( templ, args ), key, buf in zip( feed_items, templ_args, keys, bufs ):
+            if buf is None:
+                if rendered is not None:
+                    # nb: this also logs the feed item
+                    buf = next( rendered, None )
+                    if buf is None:
+                        raise RuntimeError( "Missing XML for feed item: {}".format( feed_item.title ) )
+                    cache.put( key, buf )
+                    yield buf
+                    continue
+                buf = templ.render( args )
+                cache.put( key, buf )
+            if log:
+                feed_item._log_rendered_xml( log, buf ) #pylint: disable=protected-access
+            yield buf
+
+    @staticmethod
+    def _render_uncached( feed_items, log, workers, use_processes ):
+        """Generate the XML for each feed item (in order)."""
+
+        # check if we should render the feed items in parallel
+        if not workers or workers <= 1 or len( feed_items ) < Feed.PARALLEL_THRESHOLD:
+            for feed_item in feed_items:
+                yield feed_item.get_xml( log )
+            return
+
+        # render the feed items in parallel
+        # NOTE: The workers don't do any logging (log files aren't shared with other processes,
+        # and messages from multiple threads would get interleaved), so we log each feed item
+        # here, once it has been rendered, which generates the same messages as usual.
+        feed_items = list( feed_items )
+        chunk_size = max( len(feed_items) // (4*workers), 1 )
+        chunks = [
+            feed_items[ pos : pos+chunk_size ]
+            for pos in range( 0, len(feed_items), chunk_size )
+        ]
+        pool_class = concurrent.futures.ProcessPoolExecutor if use_processes \
+            else concurrent.futures.ThreadPoolExecutor
+        with pool_class( max_workers=workers ) as pool:
+            for chunk, bufs in zip( chunks, pool.map( _render_feed_items, chunks ) ):
+                for feed_item, buf in zip( chunk, bufs ):
+                    if log:
+                        feed_item._log_rendered_xml( log, buf ) #pylint: disable=protected-access
+                    yield buf
 
 # ---------------------------------------------------------------------
 
 class FeedItem:
     """Container for a feed item."""
 
+    __slots__ = ( "title", "url", "content", "updated_time", "templ", "extra_args" )
+
     def __init__( self, title, url, content=None, updated_time=None, templ=None, extra_args=None ):
         """Initialize the FeedItem."""
         self.title = title
@@ -116,54 +346,1075 @@ class FeedItem:
         self.templ = templ
         self.extra_args = extra_args
 
-    def get_xml( self, log=None ):
-        """Generate the feed item XML."""
-        # initialize
-        if self.templ:
-            assert isinstance( self.templ, str )
-            templ = self.templ
-        else:
-            # use the default template
-            templ = """<entry>""" \
+    DEFAULT_TEMPL = """<entry>""" \
                     """<title type="text">{title}</title>""" \
                     """<link href="{url}" />""" \
                     """<updated>{updated_time}</updated>""" \
                     """<content type="html">{content}</content>""" \
                     """</entry>"""
+
+    @timed( "feed_item.get_xml" )
+    def get_xml( self, log=None ):
+        """Generate the feed item XML.
+
+        log can be a FeedItemLogger, to control how the feed item is logged.
+        """
+        # initialize
+        templ = self._get_templ()
+        logger = _get_feed_item_logger( log )
         # prepare to generate the feed item XML
+        args = self._get_args( templ, logger )
+        if logger:
+            logger.log_args( args )
+        # generate the feed item XML
+        buf = templ.render( args )
+        if logger:
+            logger.log_xml( buf )
+        return buf
+
+    def _get_templ( self ):
+        """Return the template for this feed item."""
+        if self.templ:
+            assert isinstance( self.templ, str )
+            return _compile_templ( self.templ )
+        else:
+            return _compile_templ( FeedItem.DEFAULT_TEMPL )
+
+    def _get_templ_args( self ):
+        """Return the template for this feed item, and the values to be inserted into it."""
+        templ = self._get_templ()
+        return templ, self._get_args( templ, False )
+
+    def _get_args( self, templ, log ):
+        """Return the values to be inserted into the template."""
+        # NOTE: We only format the updated time if it's going to be used.
         args = {
             "title": self.title,
             "url": self.url,
-            "updated_time": _format_time( self.updated_time ),
+            "updated_time": _format_time( self.updated_time ) \
+                if log or "updated_time" in templ.field_names else None,
             "content": self.content,
         }
         if self.extra_args:
             args.update( self.extra_args )
-        if log:
-            log_msg( "" )
-            log_msg( "Generating feed item..." )
-            for key, val in args.items():
-                log_msg( "- {} = {}", key, "" if val is None else val )
-        # generate the feed item XML
-        args = {
-            k: safe_xml( v ) if v is not None else ""
-            for k, v in args.items()
-        }
-        buf = templ.format( **args )
-        if log:
-            log_msg( "Generated feed item XML:" )
-            log_raw_msg( pretty_xml( buf ) )
-        return buf
+        return args
+
+    def _log_rendered_xml( self, log, buf ):
+        """Log a feed item that was rendered elsewhere."""
+        logger = _get_feed_item_logger( log )
+        if logger:
+            logger.log_args( self._get_args( self._get_templ(), True ) )
+            logger.log_xml( buf )
+
+# ---------------------------------------------------------------------
+
+class FeedItemLogger:
+    """Control how feed items are logged.
+
+    This can be passed in as the log parameter when generating feeds. If first and/or every are set,
+    only the first few feed items, and/or every Nth one, are logged. If max_val_len is set, long
+    values are truncated. If pretty is not set, the generated XML is logged as-is (instead of
+    being pretty-printed), and if background is set, the log messages are generated and written
+    in a background thread (call flush() to wait for them to finish). The feed items are counted
+    from the start of each feed.
+
+    Nothing is done if logging has not been enabled.
+    """
+
+    def __init__( self, first=None, every=None, max_val_len=None, pretty=True, background=False ):
+        """Initialize the FeedItemLogger."""
+        self.first = first
+        self.every = every
+        self.max_val_len = max_val_len
+        self.pretty = pretty
+        self.background = background
+        self._item_nos = itertools.count()
+
+    def reset( self ):
+        """Start counting feed items from the beginning again."""
+        self._item_nos = itertools.count()
+
+    def should_log( self ):
+        """Check if the next feed item should be logged."""
+        item_no = next( self._item_nos )
+        if self.first is None and self.every is None:
+            return True
+        if self.first is not None and item_no < self.first:
+            return True
+        return bool( self.every ) and item_no % self.every == 0
+
+    def log_args( self, args ):
+        """Log the values to be inserted into a feed item's template."""
+        if self.max_val_len is not None:
+            args = { k: self._truncate( v ) for k, v in args.items() }
+        self._submit( self._write_args, args )
+
+    def log_xml( self, buf ):
+        """Log the XML generated for a feed item."""
+        self._submit( self._write_xml, buf )
+
+    def flush( self ):
+        """Wait for any log messages being written in the background."""
+        if self.background and _background_log_queue is not None:
+            _background_log_queue.join()
+
+    def _submit( self, func, arg ):
+        """Write a log message (or queue it, to be written in the background)."""
+        if self.background:
+            _get_background_log_queue().put( ( func, arg ) )
+        else:
+            func( arg )
+
+    def _truncate( self, val ):
+        """Truncate a long value."""
+        if val is None:
+            return None
+        val = str( val )
+        if len( val ) <= self.max_val_len:
+            return val
+        return "{}... ({} chars)".format( val[ : self.max_val_len ], len(val) )
+
+    @staticmethod
+    def _write_args( args ):
+        """Log the values to be inserted into a feed item's template."""
+        log_msg( "" )
+        log_msg( "Generating feed item..." )
+        for key, val in args.items():
+            log_msg( "- {} = {}", key, "" if val is None else val )
+
+    def _write_xml( self, buf ):
+        """Log the XML generated for a feed item."""
+        log_msg( "Generated feed item XML:" )
+        log_raw_msg( pretty_xml( buf ) if self.pretty else buf )
+
+_DEFAULT_FEED_ITEM_LOGGER = FeedItemLogger()
+
+# NOTE: All FeedItemLogger's share the same background thread.
+_background_log_queue = None
+_background_log_lock = threading.Lock()
+
+def _get_background_log_queue():
+    """Return the queue for log messages to be written in the background (starting the thread, if necessary)."""
+    global _background_log_queue
+    if _background_log_queue is None:
+        with _background_log_lock:
+            if _background_log_queue is None:
+                # NOTE: We limit the size of the queue, so that it can't grow without limit
+                # if feed items are generated faster than they can be logged.
+                queue_ = queue.Queue( maxsize=1000 )
+                threading.Thread( target=_run_background_logger, args=(queue_,), daemon=True ).start()
+                atexit.register( queue_.join )
+                _background_log_queue = queue_
+    return _background_log_queue
+
+def _run_background_logger( queue_ ):
+    """Write log messages in the background."""
+    # NOTE: This thread is shared by all FeedItemLogger's, so if logging something fails, we need
+    # to keep going, otherwise anyone waiting for the log messages to be written will wait forever.
+    while True:
+        func, arg = queue_.get()
+        try:
+            func( arg )
+        except Exception as ex: #pylint: disable=broad-except
+            try:
+                log_msg( "Can't log feed item: {}", ex )
+            except Exception: #pylint: disable=broad-except
+                pass
+        finally:
+            queue_.task_done()
+
+# ---------------------------------------------------------------------
+
+class FeedItemBatch:
+    """Store a large number of feed items, in columns.
+
+    This uses much less memory than a list of FeedItem's, and can be used as a Feed's feed_items.
+    Retrieving a feed item returns a new FeedItem, so changing it won't change the FeedItemBatch.
+    """
+
+    def __init__( self, feed_items=None ):
+        """Initialize the FeedItemBatch."""
+        self._titles = []
+        self._urls = []
+        self._contents = []
+        # NOTE: Updated times are stored as floats, or NaN if they are something else,
+        # in which case the actual value is stored in _other_times (unless it's None).
+        self._updated_times = array.array( "d" )
+        self._other_times = {} # nb: index => updated time
+        self._templs = []
+        self._extra_keys = []
+        self._extra_vals = []
+        # NOTE: Templates, and the keys and string values in extra_args, are often repeated,
+        # so we only store one copy of each.
+        self._interned = {}
+        if feed_items:
+            self.extend( feed_items )
+
+    def add( self, title, url, content=None, updated_time=None, templ=None, extra_args=None ):
+        """Add a feed item."""
+        intern = self._intern
+        if type( updated_time ) is float and not math.isnan( updated_time ): #pylint: disable=unidiomatic-typecheck
+            self._updated_times.append( updated_time )
+        else:
+            if updated_time is not None:
+                self._other_times[ len( self._titles ) ] = updated_time
+            self._updated_times.append( math.nan )
+        self._titles.append( title )
+        self._urls.append( url )
+        self._contents.append( content )
+        self._templs.append( intern( templ ) )
+        if extra_args is None:
+            self._extra_keys.append( None )
+            self._extra_vals.append( None )
+        else:
+            keys = tuple( map( intern, extra_args ) )
+            if all( type( k ) is str for k in keys ): #pylint: disable=unidiomatic-typecheck
+                keys = self._interned.setdefault( keys, keys )
+            self._extra_keys.append( keys )
+            self._extra_vals.append( tuple( map( intern, extra_args.values() ) ) )
+
+    def append( self, feed_item ):
+        """Add a FeedItem."""
+        self.add( feed_item.title, feed_item.url, feed_item.content, feed_item.updated_time,
+            feed_item.templ, feed_item.extra_args
+        )
+
+    def extend( self, feed_items ):
+        """Add FeedItem's."""
+        for feed_item in feed_items:
+            self.append( feed_item )
+
+    def __len__( self ):
+        """Return the number of feed items."""
+        return len( self._titles )
+
+    def __getitem__( self, pos ):
+        """Return the specified feed item(s)."""
+        if isinstance( pos, slice ):
+            return [ self[i] for i in range( *pos.indices( len(self._titles) ) ) ]
+        if pos < 0:
+            pos += len( self._titles )
+        if pos < 0 or pos >= len( self._titles ):
+            raise IndexError( "FeedItemBatch index out of range." )
+        updated_time = self._updated_times[ pos ]
+        if math.isnan( updated_time ):
+            updated_time = self._other_times.get( pos )
+        extra_keys = self._extra_keys[ pos ]
+        return FeedItem( self._titles[pos], self._urls[pos], self._contents[pos], updated_time,
+            templ = self._templs[pos],
+            extra_args = dict( zip( extra_keys, self._extra_vals[pos] ) ) if extra_keys is not None else None
+        )
+
+    def __iter__( self ):
+        """Iterate over the feed items."""
+        for pos in range( len( self._titles ) ):
+            yield self[ pos ]
+
+    def _intern( self, val ):
+        """Return the stored copy of a value (if it's a string)."""
+        # NOTE: We only intern strings, since other values might not be hashable (e.g. a tuple containing
+        # a list), or might be equal to values that are actually different (e.g. (1,) and (True,)).
+        if type( val ) is not str: #pylint: disable=unidiomatic-typecheck
+            return val
+        return self._interned.setdefault( val, val )
+
+# ---------------------------------------------------------------------
+
+class NewestFeedItems:
+    """Keep only the newest feed items.
+
+    Feed items can be added one at a time, or from an iterator, and only the newest max_items
+    are kept (in a heap), so memory use depends on max_items, not the number of feed items added.
+    Feed items without a valid updated time are treated as being the oldest. Iterating over
+    the feed items returns them newest first (or in the order they were added, if they have
+    the same updated time).
+    """
+
+    def __init__( self, max_items, feed_items=None ):
+        """Initialize the NewestFeedItems."""
+        if max_items < 1:
+            raise ValueError( "Invalid max_items: {}".format( max_items ) )
+        self.max_items = max_items
+        # NOTE: Each entry is ( updated_time, -seq_no, feed_item ), so the oldest feed item
+        # (and for feed items with the same time, the one that was added last) is at the top.
+        self._heap = []
+        self._seq_no = itertools.count()
+        if feed_items:
+            self.extend( feed_items )
+
+    def append( self, feed_item ):
+        """Add a feed item."""
+        entry = ( _parse_time( feed_item.updated_time ), -next( self._seq_no ), feed_item )
+        if len( self._heap ) < self.max_items:
+            heapq.heappush( self._heap, entry )
+        else:
+            heapq.heappushpop( self._heap, entry )
+
+    def extend( self, feed_items ):
+        """Add feed items."""
+        for feed_item in feed_items:
+            self.append( feed_item )
+
+    def __len__( self ):
+        """Return the number of feed items."""
+        return len( self._heap )
+
+    def __iter__( self ):
+        """Iterate over the feed items (newest first)."""
+        for entry in sorted( self._heap, reverse=True ):
+            yield entry[2]
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def merge_feed_items( *sources, key=None, limit=None, max_seen=100000 ):
+    """Merge feed items from several sources.
+
+    Each source must return its feed items newest first (e.g. a NewestFeedItems, or a FeedReader
+    for a feed that is in that order), and the merged feed items are returned newest first.
+    Duplicates (feed items with the same key, by default their URL) are dropped, although
+    to limit memory use, only the last max_seen keys are remembered. If limit is set,
+    we stop after that many feed items have been returned.
+    """
+    if limit is not None and limit <= 0:
+        return
+    if key is None:
+        key = _get_url
+    seen = collections.OrderedDict()
+    nitems = 0
+    for feed_item in heapq.merge( *sources, key=_get_sort_time, reverse=True ):
+        # check if we've already seen this feed item
+        item_key = key( feed_item )
+        if item_key is not None:
+            if item_key in seen:
+                continue
+            seen[ item_key ] = None
+            if len( seen ) > max_seen:
+                seen.popitem( last=False )
+        # return the feed item
+        yield feed_item
+        nitems += 1
+        if nitems == limit:
+            return
+
+def _get_url( feed_item ):
+    """Return a feed item's URL."""
+    return feed_item.url
+
+def _get_sort_time( feed_item ):
+    """Return a feed item's updated time (for sorting)."""
+    return _parse_time( feed_item.updated_time )
+
+# ---------------------------------------------------------------------
+
+class RenderCache:
+    """Cache the XML generated for feed items, across runs.
+
+    Feed items are looked up using their template, and the values used by it. The cache is saved
+    in a file, and the least-recently used entries are dropped once the total size of the cached XML
+    (and the values used to generate it) exceeds max_size.
+
+    NOTE: Rendering a feed item is cheap, and loading and looking up a cached one costs about the same,
+    so this won't make generating most feeds any faster (and it will slow down the first run). It's only
+    worthwhile if the feed items have a lot of content that needs escaping.
+    """
+
+    def __init__( self, fname, max_size=32*1024*1024 ):
+        """Initialize the RenderCache."""
+        self.fname = fname
+        self.max_size = max_size
+        self.hits = self.misses = 0
+        self._entries = None # nb: key => XML (loaded on demand)
+        self._size = 0
+        self._loaded_keys = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key( templ, args ):
+        """Generate the key for a template and its values (or None, if they can't be cached)."""
+        # NOTE: The key is just the template and its values. Hashing them ourselves (so that we could store
+        # a shorter key) would cost more than rendering most feed items, and we can't use hash(),
+        # since string hashes change from one run to the next.
+        try:
+            vals = tuple( map( args.__getitem__, templ.field_names ) )
+        except KeyError:
+            return None # nb: the template will fail when it's rendered
+        try:
+            type_codes = "".join( map( _CACHEABLE_TYPES.__getitem__, map( type, vals ) ) )
+        except KeyError:
+            return None
+        if type_codes.strip( "s" ):
+            # NOTE: Values of different types can compare equal (e.g. True, 1 and 1.0), as can 0.0 and -0.0,
+            # so we include the type of each value in the key, and store anything that isn't a string
+            # as its repr() (which is exact for floats).
+            vals = tuple( val if isinstance( val, str ) else repr( val ) for val in vals )
+        return ( templ.templ, type_codes, vals )
+
+    def get( self, key ):
+        """Return the XML for the specified key (or None, if it's not in the cache)."""
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            buf = self._entries.get( key ) if key else None
+            if buf is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end( key )
+            self.hits += 1
+            return buf
+
+    def put( self, key, buf ):
+        """Add XML to the cache."""
+        if not key:
+            return
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            prev_buf = self._entries.pop( key, None )
+            if prev_buf is not None:
+                self._size -= _get_entry_size( key, prev_buf )
+            size = _get_entry_size( key, buf )
+            if size > self.max_size:
+                return
+            self._entries[ key ] = buf
+            self._size += size
+            while self._size > self.max_size:
+                self._size -= _get_entry_size( *self._entries.popitem( last=False ) )
+
+    def save( self ):
+        """Save the cache (if it has changed)."""
+
+        # check if anything has changed
+        with self._lock:
+            if self._entries is None:
+                return
+            keys = tuple( self._entries )
+            if keys == self._loaded_keys:
+                return
+            entries = list( self._entries.items() )
+
+        # save the cache
+        # NOTE: This is just an optimization, so we ignore any errors.
+        temp_fname = "{}.{}.tmp".format( self.fname, os.getpid() )
+        try:
+            with open( temp_fname, "wb" ) as fp:
+                marshal.dump( ( _RENDER_CACHE_VERSION, entries ), fp )
+            os.replace( temp_fname, self.fname )
+        except OSError:
+            try:
+                os.unlink( temp_fname )
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._loaded_keys = keys
+
+    def clear( self ):
+        """Clear the cache."""
+        with self._lock:
+            self._entries = collections.OrderedDict()
+            self._size = 0
+
+    def _load( self ):
+        """Load the cache."""
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        try:
+            # nb: marshal.load() reads the file in small pieces, which is much slower
+            with open( self.fname, "rb" ) as fp:
+                saved = marshal.loads( fp.read() )
+        except ( OSError, EOFError, ValueError, TypeError ):
+            saved = None
+        if isinstance( saved, tuple ) and len( saved ) == 2 and saved[0] == _RENDER_CACHE_VERSION:
+            for key, buf in saved[1]:
+                self._entries[ key ] = buf
+                self._size += _get_entry_size( key, buf )
+            while self._size > self.max_size:
+                self._size -= _get_entry_size( *self._entries.popitem( last=False ) )
+        self._loaded_keys = tuple( self._entries )
+
+def _get_entry_size( key, buf ):
+    """Return the (approximate) size of a RenderCache entry."""
+    # nb: we only count the values, since the template is shared by all the feed items that use it
+    return len( buf ) + sum( map( len, key[2] ) )
+
+# ---------------------------------------------------------------------
+
+@timed( "feed.render_items" )
+def _render_feed_items( feed_items ):
+    """Generate the XML for a list of feed items (in a worker thread or process)."""
+    return [ feed_item.get_xml() for feed_item in feed_items ]
+
+def _get_feed_item_logger( log ):
+    """Return the FeedItemLogger to use for the next feed item (or None, if it shouldn't be logged)."""
+    # NOTE: We check if logging has been enabled first, to avoid generating log messages
+    # (e.g. pretty-printing the XML) that would be thrown away.
+    if not log or not is_logging():
+        return None
+    logger = log if isinstance( log, FeedItemLogger ) else _DEFAULT_FEED_ITEM_LOGGER
+    return logger if logger.should_log() else None
 
 # ---------------------------------------------------------------------
 
+def _parse_time( val ):
+    """Convert a time value to an epoch time (for sorting)."""
+    if isinstance( val, ( float, int ) ):
+        return -math.inf if math.isnan( val ) else float( val )
+    # NOTE: Time values that are strings are inserted into the feed as-is,
+    # so they will normally be ISO 8601 timestamps.
+    tstamp = parse_timestamp( val )
+    return float( tstamp ) if tstamp is not None else -math.inf
+
 def _format_time( val ):
     """Format a time value for insertion into a feed."""
     if isinstance( val, float ):
-        return time.strftime( "%Y-%m-%dT%H:%M:%SZ", time.gmtime( val ) )
+        return format_iso8601( val )
     else:
         return val
 
+class _Template:
+    """A template that has been parsed, ready to be rendered.
+
+    Only the fields that are used by the template are XML-escaped when it is rendered.
+    """
+
+    __slots__ = ( "templ", "field_names", "_format" )
+
+    def __init__( self, templ ):
+        """Parse the template."""
+        self.templ = templ
+        # NOTE: If all the fields are simple names, we convert the template to use positional
+        # fields (so that we can just pass in a list of values when rendering it), otherwise
+        # we use the template as-is (and pass in the values by name).
+        field_names = []
+        parts = []
+        is_simple = True
+        for literal_text, field_name, format_spec, conversion in string.Formatter().parse( templ ):
+            parts.append( literal_text.replace( "{", "{{" ).replace( "}", "}}" ) )
+            if field_name is None:
+                continue
+            if not field_name.isidentifier() or format_spec or conversion:
+                is_simple = False
+                field_name = re.split( r"[.[]", field_name )[0]
+                if not field_name.isidentifier():
+                    continue # nb: this is a positional field (which will fail when rendered)
+            if field_name not in field_names:
+                field_names.append( field_name )
+            parts.append( "{" + str( field_names.index( field_name ) ) + "}" )
+        self.field_names = tuple( field_names )
+        self._format = "".join( parts ).format if is_simple else None
+
+    def render( self, args, raw_args=None ):
+        """Render the template.
+
+        Values in raw_args are inserted as-is, everything else is XML-escaped.
+        """
+        if raw_args:
+            vals = [
+                raw_args[k] if k in raw_args else _escape( args[k] )
+                for k in self.field_names
+            ]
+        else:
+            vals = [ _escape( args[k] ) for k in self.field_names ]
+        if self._format:
+            return self._format( *vals )
+        return self.templ.format( **dict( zip( self.field_names, vals ) ) )
+
+@functools.lru_cache( maxsize=256 )
+def _compile_templ( templ ):
+    """Compile a template (or return it from the cache)."""
+    return _Template( templ )
+
+@functools.lru_cache( maxsize=256 )
+def _compile_feed_templ( templ ):
+    """Compile a feed template, split into header and footer templates.
+
+    Returns a ( header, footer ) tuple of templates, or None if {feed_items} doesn't appear
+    exactly once (without a conversion or format spec).
+    """
+    parts = [ [] ]
+    for literal_text, field_name, format_spec, conversion in string.Formatter().parse( templ ):
+        parts[-1].append( literal_text.replace( "{", "{{" ).replace( "}", "}}" ) )
+        if field_name is None:
+            continue
+        if field_name == "feed_items" and not format_spec and not conversion:
+            parts.append( [] )
+            continue
+        parts[-1].append( "{" + field_name )
+        if conversion:
+            parts[-1].append( "!" + conversion )
+        if format_spec:
+            parts[-1].append( ":" + format_spec )
+        parts[-1].append( "}" )
+    if len( parts ) != 2:
+        return None
+    return ( _compile_templ( "".join( parts[0] ) ), _compile_templ( "".join( parts[1] ) ) )
+
+def _escape( val ):
+    """Make a template value safe to insert into XML."""
+    return safe_xml( val ) if val is not None else ""
+
+# ---------------------------------------------------------------------
+
+class FeedTestCase( unittest.TestCase ):
+    """Test this module."""
+
+    def test_iter_xml( self ):
+        """Test generating feed XML in pieces."""
+
+        # initialize
+        def make_feed( nitems ):
+            test_feed = Feed( "Test feed", "http://test.com", "<b>Description</b>", updated_time=1.0 )
+            for item_no in range( 1, nitems+1 ):
+                test_feed.feed_items.append( FeedItem(
+                    "Item {}".format( item_no ), "http://test.com/item{}".format( item_no ),
+                    "Content for item #{} (\u65e5\u672c)".format( item_no ), float( item_no )
+                ) )
+            return test_feed
+        def check( test_feed, templ, expected ):
+            xml = test_feed.get_xml( templ )
+            self.assertEqual( xml, expected )
+            self.assertEqual( "".join( test_feed.iter_xml( templ ) ), expected )
+            buf = io.BytesIO()
+            test_feed.write_xml( buf, templ )
+            self.assertEqual( buf.getvalue(), expected.encode( "utf-8" ) )
+            buf = io.StringIO()
+            test_feed.write_xml( buf, templ )
+            self.assertEqual( buf.getvalue(), expected )
+
+        # check generating feeds using the default template
+        header = """<?xml version="1.0" encoding="UTF-8"?>\n""" \
+            """<feed xmlns="http://www.w3.org/2005/Atom" xmlns:xh="http://www.w3.org/1999/xhtml">\n""" \
+            """<title type="text">Test feed</title>\n""" \
+            """<subtitle type="html">&lt;b&gt;Description&lt;/b&gt;</subtitle>\n""" \
+            """<link href="http://test.com" />\n""" \
+            """<logo></logo>\n""" \
+            """<updated>1970-01-01T00:00:01Z</updated>\n"""
+        item = """<entry><title type="text">Item {0}</title><link href="http://test.com/item{0}" />""" \
+            """<updated>1970-01-01T00:00:0{0}Z</updated>""" \
+            """<content type="html">Content for item #{0} (\u65e5\u672c)</content></entry>"""
+        check( make_feed( 0 ), None, header + "</feed>" )
+        check( make_feed( 2 ), None,
+            header + item.format( 1 ) + "\n" + item.format( 2 ) + "\n</feed>"
+        )
+
+        # check generating feeds using custom templates
+        check( make_feed( 2 ), "{{title}}={title!r:>12} [{feed_items}] {{feed_items}}",
+            "{title}= 'Test feed' [" + item.format( 1 ) + "\n" + item.format( 2 ) + "] {feed_items}"
+        )
+        check( make_feed( 1 ), "{feed_items} | {feed_items}",
+            item.format( 1 ) + " | " + item.format( 1 )
+        )
+        check( make_feed( 0 ), "<feed>\n{feed_items}\n</feed>", "<feed>\n</feed>" )
+
+    def test_parallel( self ):
+        """Test rendering feed items in parallel."""
+
+        # initialize
+        test_feed = Feed( "Test feed", "http://test.com", updated_time=1.0 )
+        for item_no in range( 1, 51 ):
+            test_feed.feed_items.append( FeedItem(
+                "Item {}".format( item_no ), "http://test.com/item{}".format( item_no ),
+                "Content for item #{}".format( item_no ), float( item_no ),
+                templ = "<item>{title}: {content} ({extra})</item>" if item_no % 2 else None,
+                extra_args = { "extra": item_no }
+            ) )
+        def get_xml( **kwargs ):
+            # nb: we capture the log output, to check that it's coherent
+            return _capture_log( lambda: test_feed.get_xml( log=True, **kwargs ) )
+
+        # check that the feed items are rendered (and logged) the same way
+        expected = get_xml()
+        prev_threshold = Feed.PARALLEL_THRESHOLD
+        Feed.PARALLEL_THRESHOLD = 10
+        try:
+            self.assertEqual( get_xml( workers=3 ), expected )
+            self.assertEqual( get_xml( workers=2, use_processes=True ), expected )
+        finally:
+            Feed.PARALLEL_THRESHOLD = prev_threshold
+
+    def test_render_cache( self ):
+        """Test caching the XML generated for feed items."""
+
+        # initialize
+        def make_feed( render_cache, content="Content" ):
+            test_feed = Feed( "Test feed", "http://test.com", updated_time=1.0, render_cache=render_cache )
+            for item_no in range( 1, 11 ):
+                test_feed.feed_items.append( FeedItem(
+                    "Item {}".format( item_no ), "http://test.com/item{}".format( item_no ),
+                    "{} #{}".format( content, item_no ), float( item_no )
+                ) )
+            return test_feed
+        expected = make_feed( None ).get_xml()
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+
+            # generate a feed
+            fname = os.path.join( temp_dir, "render.cache" )
+            render_cache = RenderCache( fname )
+            self.assertEqual( make_feed( render_cache ).get_xml(), expected )
+            self.assertEqual( ( render_cache.hits, render_cache.misses ), ( 0, 10 ) )
+            self.assertTrue( os.path.isfile( fname ) )
+
+            # generate the feed again (the feed items should be loaded from the cache)
+            render_cache = RenderCache( fname )
+            self.assertEqual( make_feed( render_cache ).get_xml(), expected )
+            self.assertEqual( ( render_cache.hits, render_cache.misses ), ( 10, 0 ) )
+
+            # change a feed item
+            test_feed = make_feed( render_cache )
+            test_feed.feed_items[3].content = "<b>Changed</b>"
+            xml = test_feed.get_xml()
+            self.assertIn( "&lt;b&gt;Changed&lt;/b&gt;", xml )
+            self.assertEqual( ( render_cache.hits, render_cache.misses ), ( 19, 1 ) )
+            test_feed.feed_items[3].extra_args = { "unused": object() } # nb: this doesn't affect the XML
+            self.assertEqual( test_feed.get_xml(), xml )
+            self.assertEqual( ( render_cache.hits, render_cache.misses ), ( 29, 1 ) )
+
+            # check that values that we don't know how to hash are not cached
+            test_feed.feed_items[0].templ = "<item>{title} {author}</item>"
+            test_feed.feed_items[0].extra_args = { "author": object() }
+            test_feed.get_xml()
+            test_feed.get_xml()
+            self.assertEqual( ( render_cache.hits, render_cache.misses ), ( 47, 3 ) )
+
+            # check that values that compare equal, but are rendered differently, are cached separately
+            render_cache = RenderCache( fname )
+            vals = [ True, 1, 1.0, 0.0, -0.0, False, 0, None, "1" ]
+            for _ in range( 2 ):
+                test_feed = Feed( "Test feed", "http://test.com", updated_time=1.0, render_cache=render_cache )
+                for val in vals:
+                    test_feed.feed_items.append( FeedItem( "Item", None,
+                        templ="<item>{title} {flag}</item>", extra_args={ "flag": val }
+                    ) )
+                self.assertEqual( [ line for line in test_feed.get_xml().splitlines() if line.startswith( "<item>" ) ],
+                    [ "<item>Item {}</item>".format( "" if val is None else val ) for val in vals ]
+                )
+                render_cache = RenderCache( fname )
+
+            # check that the cache stays within its size limit
+            feed_item = make_feed( None, "Other" ).feed_items[0]
+            key = RenderCache.make_key( *feed_item._get_templ_args() ) #pylint: disable=protected-access
+            max_size = _get_entry_size( key, feed_item.get_xml() ) * 5
+            render_cache = RenderCache( fname, max_size=max_size )
+            self.assertEqual( make_feed( render_cache, "Other" ).get_xml(),
+                expected.replace( "Content", "Other" )
+            )
+            render_cache = RenderCache( fname, max_size=max_size )
+            self.assertEqual( make_feed( render_cache, "Other" ).get_xml(),
+                expected.replace( "Content", "Other" )
+            )
+            self.assertLessEqual( render_cache._size, max_size ) #pylint: disable=protected-access
+            self.assertEqual( render_cache.hits, 4 )
+
+    def test_feed_item_batch( self ):
+        """Test storing feed items in a FeedItemBatch."""
+
+        # initialize
+        feed_items = [
+            FeedItem( "Item 1", "http://test.com/item1", "Content #1", 1.0,
+                templ="<item>{title} by {author}</item>", extra_args={ "author": "Joe" }
+            ),
+            FeedItem( "Item 2", "http://test.com/item2", None, "2000-01-01T00:00:00Z" ),
+            FeedItem( "Item 3", "http://test.com/item3", "Content #3", 3,
+                templ="<item>{title} by {author}</item>", extra_args={ "author": "Joe", "n": 3 }
+            ),
+            FeedItem( "Item 4", None, "Content #4", math.nan, templ="<item>{title}</item>", extra_args={} ),
+        ]
+        def get_vals( feed_item ):
+            return { k: getattr( feed_item, k ) for k in FeedItem.__slots__ }
+
+        # check storing feed items in a batch
+        batch = FeedItemBatch( feed_items[:2] )
+        batch.extend( feed_items[2:3] )
+        batch.add( "Item 4", None, "Content #4", math.nan, templ="<item>{title}</item>", extra_args={} )
+        self.assertEqual( len( batch ), 4 )
+        vals = [ get_vals( feed_item ) for feed_item in batch ]
+        self.assertEqual( str( vals ), str( [ get_vals( feed_item ) for feed_item in feed_items ] ) )
+        self.assertEqual( get_vals( batch[-3] ), get_vals( feed_items[1] ) )
+        self.assertEqual( [ get_vals(f) for f in batch[1:3] ], [ get_vals(f) for f in feed_items[1:3] ] )
+        self.assertIsInstance( batch[2].updated_time, int )
+        self.assertIs( batch[0].templ, batch[2].templ )
+        with self.assertRaises( IndexError ):
+            batch[4] #pylint: disable=pointless-statement
+        with self.assertRaises( IndexError ):
+            batch[-5] #pylint: disable=pointless-statement
+
+        # check storing values that can't be interned
+        extra_args = [
+            { "tags": [ "a", "b" ] }, { "x": ( 1, [ 2 ] ) }, { "x": ( 1, ) }, { "x": ( True, ) }, { 1: "a" }
+        ]
+        batch2 = FeedItemBatch( FeedItem( "Item", None, extra_args=args ) for args in extra_args )
+        self.assertEqual( [ str( f.extra_args ) for f in batch2 ], [ str( args ) for args in extra_args ] )
+
+        # check generating a feed from a batch
+        test_feed = Feed( "Test feed", "http://test.com", updated_time=1.0 )
+        test_feed.feed_items = feed_items
+        expected = test_feed.get_xml()
+        test_feed.feed_items = batch
+        self.assertEqual( test_feed.get_xml(), expected )
+        test_feed.feed_items = FeedItemBatch()
+        self.assertEqual( test_feed.get_xml(), Feed( "Test feed", "http://test.com", updated_time=1.0 ).get_xml() )
+
+    def test_newest_feed_items( self ):
+        """Test keeping only the newest feed items."""
+
+        # initialize
+        def make_feed_items( updated_times ):
+            return [
+                FeedItem( "Item {}".format( item_no ), None, None, updated_time )
+                for item_no, updated_time in enumerate( updated_times, start=1 )
+            ]
+        def get_titles( feed_items ):
+            return [ feed_item.title for feed_item in feed_items ]
+
+        # check keeping the newest feed items
+        feed_items = NewestFeedItems( 3 )
+        self.assertEqual( len( feed_items ), 0 )
+        feed_items.extend( iter( make_feed_items( [ 5.0, 1.0, 7.0, 3.0, 9.0, 2.0 ] ) ) )
+        self.assertEqual( len( feed_items ), 3 )
+        self.assertEqual( get_titles( feed_items ), [ "Item 5", "Item 3", "Item 1" ] )
+        feed_items.append( FeedItem( "Item 7", None, None, 8 ) )
+        self.assertEqual( get_titles( feed_items ), [ "Item 5", "Item 7", "Item 3" ] )
+
+        # check feed items with strings (or missing) updated times, and feed items with the same time
+        feed_items = NewestFeedItems( 4, make_feed_items( [
+            "2020-01-01T00:00:00Z", None, 1577836800.0, "Wed, 01 Jan 2020 01:00:00 +0200",
+            "2020-01-01T00:00:00.5+00:00", "rubbish", 1577836800,
+        ] ) )
+        self.assertEqual( get_titles( feed_items ), [ "Item 5", "Item 1", "Item 3", "Item 7" ] )
+        self.assertEqual( _parse_time( "Wed, 01 Jan 2020 01:00:00 +0200" ), 1577833200.0 )
+        self.assertEqual( _parse_time( "2020-01-01T00:00:00" ), 1577836800.0 )
+
+        # check generating a feed
+        test_feed = Feed( "Test feed", "http://test.com", updated_time=1.0, max_items=2 )
+        test_feed.feed_items.extend( FeedItem( "Item {}".format( i ), None, None, float( i ) ) for i in range( 100 ) )
+        self.assertEqual( test_feed.get_xml( "{feed_items}" ),
+            "\n".join( FeedItem( "Item {}".format( i ), None, None, float( i ) ).get_xml() for i in ( 99, 98 ) )
+        )
+        with self.assertRaises( ValueError ):
+            NewestFeedItems( 0 )
+
+    def test_save_xml( self ):
+        """Test saving feed XML to a file."""
+
+        # initialize
+        test_feed = Feed( "Test feed", "http://test.com", updated_time=1.0 )
+        test_feed.feed_items.append( FeedItem( "Item 1", "http://test.com/item1", "Content", 1.0 ) )
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fname = os.path.join( temp_dir, "feed.xml" )
+            def check_files( expected, gzip_fname=None ):
+                with open( fname, "r", encoding="utf-8" ) as fp:
+                    self.assertEqual( fp.read(), expected )
+                if gzip_fname:
+                    with gzip.open( gzip_fname, "rt", encoding="utf-8" ) as fp:
+                        self.assertEqual( fp.read(), expected )
+                self.assertEqual( sorted( os.listdir( temp_dir ) ),
+                    sorted( [ "feed.xml", "feed.xml.digest" ] + ( [ "feed.xml.gz" ] if gzip_fname else [] ) )
+                )
+
+            # save the feed
+            self.assertTrue( test_feed.save_xml( fname ) )
+            check_files( test_feed.get_xml() )
+            self.assertFalse( test_feed.save_xml( fname ) )
+
+            # change the feed
+            test_feed.feed_items[0].title = "Item \u65e5\u672c"
+            self.assertTrue( test_feed.save_xml( fname ) )
+            check_files( test_feed.get_xml() )
+            self.assertFalse( test_feed.save_xml( fname ) )
+
+            # save a compressed copy
+            gzip_fname = fname + ".gz"
+            self.assertTrue( test_feed.save_xml( fname, gzip_fname=True ) )
+            check_files( test_feed.get_xml(), gzip_fname )
+            with open( gzip_fname, "rb" ) as fp:
+                gzip_data = fp.read()
+            self.assertFalse( test_feed.save_xml( fname, gzip_fname=gzip_fname ) )
+            os.unlink( gzip_fname )
+            self.assertTrue( test_feed.save_xml( fname, gzip_fname=True ) )
+            with open( gzip_fname, "rb" ) as fp:
+                self.assertEqual( fp.read(), gzip_data )
+
+            # check that the file is re-written if it was changed by someone else
+            with open( fname, "w", encoding="utf-8" ) as fp:
+                fp.write( "<feed/>" )
+            self.assertTrue( test_feed.save_xml( fname ) )
+            check_files( test_feed.get_xml(), gzip_fname )
+
+    def test_feed_item_logger( self ):
+        """Test controlling how feed items are logged."""
+
+        # initialize
+        test_feed = Feed( "Test feed", "http://test.com", updated_time=1.0 )
+        for item_no in range( 10 ):
+            test_feed.feed_items.append( FeedItem(
+                "Item {}".format( item_no ), "http://test.com", "<p>{}</p>".format( "x" * item_no ), 1.0
+            ) )
+        def get_logged_items( log ):
+            _, log_lines = _capture_log( lambda: test_feed.get_xml( log=log ) )
+            return [ line[10:] for line in log_lines if line.startswith( "- title = " ) ], log_lines
+
+        # check logging only some of the feed items
+        expected_xml, expected_log = _capture_log( lambda: test_feed.get_xml( log=True ) )
+        self.assertEqual( get_logged_items( FeedItemLogger() ),
+            ( [ "Item {}".format( i ) for i in range( 10 ) ], expected_log )
+        )
+        self.assertEqual( get_logged_items( FeedItemLogger( first=2 ) )[0], [ "Item 0", "Item 1" ] )
+        self.assertEqual( get_logged_items( FeedItemLogger( every=4 ) )[0], [ "Item 0", "Item 4", "Item 8" ] )
+        self.assertEqual( get_logged_items( FeedItemLogger( first=2, every=3 ) )[0],
+            [ "Item 0", "Item 1", "Item 3", "Item 6", "Item 9" ]
+        )
+        self.assertEqual( get_logged_items( FeedItemLogger( first=0 ) )[0], [] )
+
+        # check truncating values, and not pretty-printing the XML
+        log_lines = get_logged_items( FeedItemLogger( first=1, max_val_len=4 ) )[1]
+        self.assertEqual( log_lines[2:7], [
+            "- title = Item... (6 chars)", "- url = http... (15 chars)", "- updated_time = 1970... (20 chars)",
+            "- content = <p><... (7 chars)", "Generated feed item XML:"
+        ] )
+        log_lines = get_logged_items( FeedItemLogger( first=1, pretty=False ) )[1]
+        self.assertEqual( log_lines[-1], test_feed.feed_items[0].get_xml() )
+
+        # check logging in the background
+        logger = FeedItemLogger( background=True )
+        xml, log_lines = _capture_log( lambda: ( test_feed.get_xml( log=logger ), logger.flush() )[0] )
+        self.assertEqual( ( xml, log_lines ), ( expected_xml, expected_log ) )
+
+        # check that the feed items are counted from the start of each feed
+        logger = FeedItemLogger( first=2 )
+        self.assertEqual( get_logged_items( logger )[0], [ "Item 0", "Item 1" ] )
+        self.assertEqual( get_logged_items( logger )[0], [ "Item 0", "Item 1" ] )
+
+        # check that background loggers share the same thread
+        def log_in_background():
+            logger = FeedItemLogger( background=True )
+            test_feed.get_xml( log=logger )
+            logger.flush()
+        nthreads = threading.active_count()
+        for _ in range( 3 ):
+            _capture_log( log_in_background )
+        self.assertEqual( threading.active_count(), nthreads )
+
+        # check that the background thread keeps going if logging something fails
+        class BadVal: #pylint: disable=too-few-public-methods
+            """A value that can't be formatted."""
+            def __format__( self, format_spec ):
+                raise RuntimeError( "Bad value." )
+        def log_bad_val():
+            logger = FeedItemLogger( background=True )
+            logger.log_args( { "bad": BadVal() } )
+            logger.log_xml( "<item>After</item>" )
+            thread = threading.Thread( target=logger.flush, daemon=True )
+            thread.start()
+            thread.join( 5 )
+            self.assertFalse( thread.is_alive() )
+        log_lines = _capture_log( log_bad_val )[1]
+        self.assertIn( "Can't log feed item: Bad value.", log_lines )
+        self.assertEqual( log_lines[-1], "<item>After</item>" )
+        self.assertEqual( threading.active_count(), nthreads )
+
+        # check that nothing is done if logging hasn't been enabled
+        logger = FeedItemLogger()
+        self.assertEqual( test_feed.get_xml( log=logger ), expected_xml )
+        self.assertEqual( logger.should_log(), True )
+        self.assertEqual( next( logger._item_nos ), 1 ) #pylint: disable=protected-access
+
+    def test_merge_feed_items( self ):
+        """Test merging feed items from several sources."""
+
+        # initialize
+        def make_feed_items( updated_times, url_prefix="" ):
+            return [
+                FeedItem( "Item {}".format( updated_time ),
+                    "http://test.com/{}item{}".format( url_prefix, updated_time ), None, updated_time
+                )
+                for updated_time in updated_times
+            ]
+        def get_titles( feed_items ):
+            return [ feed_item.title for feed_item in feed_items ]
+        sources = [
+            make_feed_items( [ 9.0, 5.0, 3.0 ] ),
+            make_feed_items( [ 8.0, "1970-01-01T00:00:05Z", 4.0, 1.0 ], "x/" ),
+            iter( make_feed_items( [ 9.0, 7.0, 6.0 ] ) ),
+            [],
+        ]
+
+        # check merging feed items
+        self.assertEqual( get_titles( merge_feed_items( *sources ) ),
+            [ "Item 9.0", "Item 8.0", "Item 7.0", "Item 6.0", "Item 5.0",
+              "Item 1970-01-01T00:00:05Z", "Item 4.0", "Item 3.0", "Item 1.0" ]
+        )
+        sources[2] = iter( make_feed_items( [ 9.0, 7.0, 6.0 ] ) )
+        self.assertEqual( get_titles( merge_feed_items( *sources, limit=3 ) ),
+            [ "Item 9.0", "Item 8.0", "Item 7.0" ]
+        )
+        self.assertEqual( list( merge_feed_items( *sources, limit=0 ) ), [] )
+
+        # check de-duplicating feed items
+        feed_items = list( merge_feed_items(
+            make_feed_items( [ 3.0, 2.0, 1.0 ] ), make_feed_items( [ 3.0, 2.0, 1.0 ] ),
+            key = lambda f: f.url[-4:] if f.updated_time != 1.0 else None
+        ) )
+        self.assertEqual( get_titles( feed_items ), [ "Item 3.0", "Item 2.0", "Item 1.0", "Item 1.0" ] )
+        feed_items = list( merge_feed_items(
+            make_feed_items( [ 3.0, 3.0, 3.0, 3.0 ] ),
+            key = lambda f: f.url, max_seen=2
+        ) )
+        self.assertEqual( len( feed_items ), 1 )
+        feed_items = list( merge_feed_items(
+            make_feed_items( [ 5.0, 4.0, 3.0 ] ), make_feed_items( [ 5.0, 1.0 ] ), max_seen=2
+        ) )
+        self.assertEqual( get_titles( feed_items ), [ "Item 5.0", "Item 4.0", "Item 3.0", "Item 1.0" ] )
+        feed_items = list( merge_feed_items(
+            make_feed_items( [ 5.0, 4.0, 3.0 ] ), make_feed_items( [ 3.0 ] ), max_seen=1
+        ) )
+        self.assertEqual( get_titles( feed_items ), [ "Item 5.0", "Item 4.0", "Item 3.0" ] )
+
+        # check generating a feed from the merged feed items
+        test_feed = Feed( "Test feed", "http://test.com", updated_time=1.0, max_items=2 )
+        test_feed.feed_items.extend( merge_feed_items( *sources[:2] ) )
+        self.assertEqual( get_titles( test_feed.feed_items ), [ "Item 9.0", "Item 8.0" ] )
+
+    def test_templates( self ):
+        """Test compiling templates."""
+
+        # check compiling a simple template
+        templ = _compile_templ( "<item>{title}|{url}|{title}</item>" )
+        self.assertIs( _compile_templ( "<item>{title}|{url}|{title}</item>" ), templ )
+        self.assertEqual( templ.field_names, ( "title", "url" ) )
+        self.assertEqual(
+            templ.render( { "title": "<title>", "url": None, "unused": object() } ),
+            "<item>&lt;title&gt;||&lt;title&gt;</item>"
+        )
+
+        # check compiling a template with conversions and format specs
+        templ = _compile_templ( "{{{title!r:>12}}} {extra[0]} {content}" )
+        self.assertEqual( templ.field_names, ( "title", "extra", "content" ) )
+        self.assertEqual(
+            templ.render( { "title": "a&b", "extra": "xyz" }, { "content": "<raw/>" } ),
+            "{   'a&amp;b'} x <raw/>"
+        )
+
+        # check rendering a feed item with a custom template
+        feed_item = FeedItem( "Title", "http://test.com", templ="<item>{title} by {author}</item>",
+            extra_args = { "author": "Joe & co." }
+        )
+        self.assertEqual( feed_item.get_xml(), "<item>Title by Joe &amp; co.</item>" )
+
+def _capture_log( func ):
+    """Call a function, and capture any log messages it generates."""
+    prev_log_file = awasu_tools.log._log_file #pylint: disable=protected-access
+    awasu_tools.log._log_file = buf = io.StringIO() #pylint: disable=protected-access
+    try:
+        retval = func()
+    finally:
+        awasu_tools.log._log_file = prev_log_file #pylint: disable=protected-access
+    log_lines = [
+        re.sub( r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d \| ", "", line )
+        for line in buf.getvalue().splitlines()
+    ]
+    return retval, log_lines
+
 # ---------------------------------------------------------------------
 
 if __name__ == "__main__":
@@ -0,0 +1,403 @@
+""" Read Atom and RSS feeds. """
+
+# COPYRIGHT:   (c) Awasu Pty. Ltd. 2015 (all rights reserved).
+#              Unauthorized use of this code is prohibited.
+#
+# LICENSE:     This software is provided 'as-is', without any express
+#              or implied warranty.
+#
+#              In no event will the author be held liable for any damages
+#              arising from the use of this software.
+#
+#              Permission is granted to anyone to use this software
+#              for any purpose, and to alter it and redistribute it freely,
+#              subject to the following restrictions:
+#
+#              - The origin of this software must not be misrepresented;
+#                you must not claim that you wrote the original software.
+#                If you use this software, an acknowledgement is requested
+#                but not required.
+#
+#              - Altered source versions must be plainly marked as such,
+#                and must not be misrepresented as being the original software.
+#                Altered source is encouraged to be submitted back to
+#                the original author so it can be shared with the community.
+#                Please share your changes.
+#
+#              - This notice may not be removed or altered from any
+#                source distribution.
+
+import sys
+import os
+import io
+import xml.etree.ElementTree as ET
+import tempfile
+import unittest
+
+from awasu_tools.feed import Feed, FeedItem, NewestFeedItems
+from awasu_tools.timestamps import parse_timestamp
+
+_XHTML_NS = "http://www.w3.org/1999/xhtml"
+_CONTENT_NS = "http://purl.org/rss/1.0/modules/content/"
+
+_ITEM_TAGS = ( "item", "entry" )
+_CHANNEL_TAGS = ( "channel", "feed", "RDF" ) # nb: in RSS 1.0, some things are children of the <rdf:RDF> root
+
+# NOTE: This maps the elements that contain details about the feed itself to FeedReader attributes.
+_FEED_VALS = {
+    "title": "title",
+    "link": "home_url",
+    "subtitle": "description", "description": "description",
+    "updated": "updated_time", "lastBuildDate": "updated_time", "pubDate": "updated_time", "date": "updated_time",
+    "logo": "image_url", "icon": "image_url", "image": "image_url",
+}
+
+# ---------------------------------------------------------------------
+
+class FeedReader:
+    """Read an Atom or RSS feed, one feed item at a time.
+
+    src can be the name of a file, a file object (or pipe), or the feed XML itself. Iterating over
+    the FeedReader parses the feed incrementally, and yields a FeedItem for each item. Elements
+    are discarded once they have been processed, so memory use doesn't depend on the size of the feed.
+    Details about the feed itself (title, etc.) are stored in the FeedReader as they are found.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__( self, src ):
+        """Initialize the FeedReader."""
+        self.src = src
+        self.title = None
+        self.home_url = None
+        self.description = None
+        self.image_url = None
+        self.updated_time = None
+
+    def __iter__( self ):
+        """Parse the feed, and yield each feed item."""
+
+        # initialize
+        parser = ET.XMLPullParser( events=( "start", "end" ) )
+        stack = [] # nb: the elements that are currently open
+        item_depth = 0
+
+        def process_events():
+            nonlocal item_depth
+            for event, elem in parser.read_events():
+                name = _local_name( elem.tag )
+                if event == "start":
+                    stack.append( elem )
+                    if name in _ITEM_TAGS:
+                        item_depth += 1
+                    continue
+                stack.pop()
+                parent = stack[-1] if stack else None
+                if name in _ITEM_TAGS:
+                    # we've found a feed item
+                    item_depth -= 1
+                    if item_depth == 0:
+                        item = _make_feed_item( elem )
+                        if parent is not None:
+                            parent.remove( elem )
+                        yield item
+                    continue
+                if item_depth > 0:
+                    continue # nb: this element is part of a feed item, we process it later
+                if parent is not None and _local_name( parent.tag ) in _CHANNEL_TAGS:
+                    self._set_feed_val( name, elem )
+                # NOTE: We remove elements near the top of the tree once they've been processed,
+                # so that the tree doesn't grow. Anything deeper will be removed with its ancestor
+                # (we can't remove it earlier, since it may be needed e.g. the <url> in an RSS 1.0 <image>).
+                if parent is not None and ( len( stack ) == 1 or _local_name( parent.tag ) in _CHANNEL_TAGS ):
+                    parent.remove( elem )
+
+        # parse the feed
+        for chunk in self._read_chunks():
+            parser.feed( chunk )
+            yield from process_events()
+        parser.close()
+        yield from process_events()
+
+    def _read_chunks( self ):
+        """Read the feed XML, in chunks."""
+        src = self.src
+        if hasattr( src, "read" ):
+            yield from _read_chunks( src, self.CHUNK_SIZE )
+        elif os.path.isfile( src ):
+            with open( src, "rb" ) as fp:
+                yield from _read_chunks( fp, self.CHUNK_SIZE )
+        else:
+            yield src
+
+    def _set_feed_val( self, name, elem ):
+        """Save a detail about the feed itself."""
+        attr = _FEED_VALS.get( name )
+        if not attr or getattr( self, attr ) is not None:
+            return # nb: we use the first value we find
+        if name == "link":
+            val = _get_link( elem )
+        elif name == "image":
+            # nb: this is RSS (the URL is in the same namespace as the <image> element, for RSS 1.0)
+            val = _get_text( elem.find( elem.tag[ : -len(name) ] + "url" ) )
+        elif attr == "updated_time":
+            val = _parse_timestamp( _get_text( elem ) )
+        else:
+            val = _get_text( elem )
+        setattr( self, attr, val )
+
+def _read_chunks( fp, chunk_size ):
+    """Read a file in chunks."""
+    while True:
+        chunk = fp.read( chunk_size )
+        if not chunk:
+            break
+        yield chunk
+
+# ---------------------------------------------------------------------
+
+def read_feed( src, max_items=None ):
+    """Read an Atom or RSS feed into a Feed.
+
+    If max_items is set, only the newest feed items are kept.
+    """
+    reader = FeedReader( src )
+    feed_items = NewestFeedItems( max_items ) if max_items else []
+    feed_items.extend( reader )
+    feed = Feed( reader.title, reader.home_url, reader.description, reader.image_url, reader.updated_time )
+    feed.feed_items = feed_items
+    return feed
+
+# ---------------------------------------------------------------------
+
+def _make_feed_item( elem ):
+    """Create a FeedItem from an <item> (RSS) or <entry> (Atom) element."""
+
+    # extract the values from the element
+    vals = {}
+    for child in elem:
+        name = _local_name( child.tag )
+        if name == "link":
+            val = _get_link( child )
+            if val:
+                vals.setdefault( "link", val )
+        elif name == "author":
+            # NOTE: Atom authors have child elements, RSS authors are just text.
+            author = child.find( "{http://www.w3.org/2005/Atom}name" )
+            vals.setdefault( "author", _get_text( author if author is not None else child ) )
+        elif name == "encoded" and child.tag.startswith( "{" + _CONTENT_NS ):
+            vals[ "content" ] = _get_text( child ) # nb: RSS <content:encoded> overrides <description>
+        else:
+            vals.setdefault( name, child )
+
+    # create the FeedItem
+    def get_val( *names ):
+        for name in names:
+            val = vals.get( name )
+            if val is not None:
+                return _get_text( val ) if isinstance( val, ET.Element ) else val
+        return None
+    link = get_val( "link" )
+    guid = vals.get( "guid" )
+    if not link and guid is not None and guid.get( "isPermaLink", "true" ) == "true":
+        link = _get_text( guid )
+    extra_args = {
+        k: v for k, v in (
+            ( "id", get_val( "id", "guid" ) ),
+            ( "author", get_val( "author", "creator" ) )
+        )
+        if v is not None
+    }
+    return FeedItem(
+        get_val( "title" ), link, get_val( "content", "summary", "description" ),
+        _parse_timestamp( get_val( "updated", "published", "pubDate", "date" ) ),
+        extra_args = extra_args or None
+    )
+
+def _get_link( elem ):
+    """Get the URL from a <link> element."""
+    href = elem.get( "href" )
+    if href is None:
+        return _get_text( elem ) # nb: this is RSS
+    # NOTE: Atom <link>'s without a "rel" attribute are the same as rel="alternate".
+    return href if elem.get( "rel", "alternate" ) == "alternate" else None
+
+def _get_text( elem ):
+    """Get the text from an element."""
+    if elem is None:
+        return None
+    if elem.get( "type" ) == "xhtml":
+        # NOTE: Atom XHTML content is wrapped in a <div>, which is not part of the content.
+        div = elem.find( "{{{}}}div".format( _XHTML_NS ) )
+        if div is None:
+            div = elem
+        xhtml_prefix = "{{{}}}".format( _XHTML_NS )
+        for e in div.iter():
+            if e.tag.startswith( xhtml_prefix ):
+                e.tag = e.tag[ len(xhtml_prefix): ]
+        return ( ( div.text or "" ) + "".join( ET.tostring( e, encoding="unicode" ) for e in div ) ).strip()
+    return "".join( elem.itertext() ).strip()
+
+def _parse_timestamp( val ):
+    """Parse a timestamp (RFC 2822 or ISO 8601)."""
+    if not val:
+        return None
+    tstamp = parse_timestamp( val ) # nb: this returns None if we get weird rubbish :-/
+    return float( tstamp ) if tstamp is not None else None
+
+def _local_name( tag ):
+    """Remove the namespace from an element's tag."""
+    return tag.rpartition( "}" )[2]
+
+# ---------------------------------------------------------------------
+
+class FeedReaderTestCase( unittest.TestCase ):
+    """Test this module."""
+
+    def test_atom( self ):
+        """Test reading Atom feeds."""
+
+        # read an Atom feed
+        reader = FeedReader( """<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title type="text">Test feed</title>
+  <link rel="self" href="http://test.com/feed.xml" />
+  <link href="http://test.com" />
+  <entry>
+    <title>Item 1</title>
+    <link rel="alternate" href="http://test.com/item1" />
+    <id>urn:item1</id>
+    <updated>2014-04-01T12:02:03+04:00</updated>
+    <author><name>Joe Bloggs</name><email>joe@test.com</email></author>
+    <content type="html">&lt;p&gt;Content #1&lt;/p&gt;</content>
+  </entry>
+  <entry>
+    <title type="html">Item 2 &amp;amp; co.</title>
+    <published>2014-04-01T08:02:04Z</published>
+    <summary>Summary #2</summary>
+    <content type="xhtml"><div xmlns="http://www.w3.org/1999/xhtml"> <p>Content <b>#2</b></p> </div></content>
+  </entry>
+  <updated>2014-04-01T08:02:05Z</updated>
+  <subtitle>About the feed</subtitle>
+</feed>
+""" )
+        feed_items = list( reader )
+        self.assertEqual( [ _get_vals( f ) for f in feed_items ], [
+            ( "Item 1", "http://test.com/item1", "<p>Content #1</p>", 1396339323.0,
+              { "id": "urn:item1", "author": "Joe Bloggs" } ),
+            ( "Item 2 &amp; co.", None, "<p>Content <b>#2</b></p>", 1396339324.0, None ),
+        ] )
+        self.assertEqual(
+            ( reader.title, reader.home_url, reader.description, reader.image_url, reader.updated_time ),
+            ( "Test feed", "http://test.com", "About the feed", None, 1396339325.0 )
+        )
+
+    def test_rss( self ):
+        """Test reading RSS feeds."""
+
+        # read an RSS 2.0 feed
+        xml = """<?xml version="1.0" encoding="windows-1252"?>
+<rss version="2.0" xmlns:content="http://purl.org/rss/1.0/modules/content/" xmlns:dc="http://purl.org/dc/elements/1.1/">
+<channel>
+  <title>Test feed \u201cRSS\u201d</title>
+  <link>http://test.com</link>
+  <description>About the feed</description>
+  <image><url>http://test.com/logo.png</url><title>Logo</title></image>
+  <item>
+    <title>Item 1</title>
+    <link>http://test.com/item1</link>
+    <description>Description #1</description>
+    <content:encoded><![CDATA[<p>Content #1</p>]]></content:encoded>
+    <pubDate>Tue, 01 Apr 2014 12:02:03 +0400</pubDate>
+    <dc:creator>Joe Bloggs</dc:creator>
+  </item>
+  <item>
+    <guid>http://test.com/item2</guid>
+    <description>Description #2</description>
+    <dc:date>2014-04-01T08:02:04Z</dc:date>
+  </item>
+  <item>
+    <title>Item 3</title>
+    <guid isPermaLink="false">item3</guid>
+    <pubDate>rubbish</pubDate>
+  </item>
+</channel>
+</rss>
+""".encode( "windows-1252" )
+        expected = [
+            ( "Item 1", "http://test.com/item1", "<p>Content #1</p>", 1396339323.0, { "author": "Joe Bloggs" } ),
+            ( None, "http://test.com/item2", "Description #2", 1396339324.0, { "id": "http://test.com/item2" } ),
+            ( "Item 3", None, None, None, { "id": "item3" } ),
+        ]
+        reader = FeedReader( xml )
+        self.assertEqual( [ _get_vals( f ) for f in reader ], expected )
+        self.assertEqual(
+            ( reader.title, reader.home_url, reader.description, reader.image_url, reader.updated_time ),
+            ( "Test feed \u201cRSS\u201d", "http://test.com", "About the feed", "http://test.com/logo.png", None )
+        )
+
+        # read the feed from a file, and a file object (using small chunks)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fname = os.path.join( temp_dir, "feed.xml" )
+            with open( fname, "wb" ) as fp:
+                fp.write( xml )
+            self.assertEqual( [ _get_vals( f ) for f in FeedReader( fname ) ], expected )
+        reader = FeedReader( io.BytesIO( xml ) )
+        reader.CHUNK_SIZE = 7
+        self.assertEqual( [ _get_vals( f ) for f in reader ], expected )
+
+        # read an RSS 1.0 feed
+        reader = FeedReader( """<?xml version="1.0"?>
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" xmlns="http://purl.org/rss/1.0/"
+  xmlns:dc="http://purl.org/dc/elements/1.1/">
+  <channel rdf:about="http://test.com">
+    <title>Test feed</title>
+    <link>http://test.com</link>
+    <items><rdf:Seq><rdf:li resource="http://test.com/item1" /></rdf:Seq></items>
+  </channel>
+  <image rdf:about="http://test.com/logo.png"><url>http://test.com/logo.png</url></image>
+  <item rdf:about="http://test.com/item1">
+    <title>Item 1</title>
+    <link>http://test.com/item1</link>
+    <dc:date>2014-04-01T08:02:03Z</dc:date>
+  </item>
+</rdf:RDF>
+""" )
+        self.assertEqual( [ _get_vals( f ) for f in reader ], [
+            ( "Item 1", "http://test.com/item1", None, 1396339323.0, None )
+        ] )
+        self.assertEqual( ( reader.title, reader.home_url, reader.image_url ),
+            ( "Test feed", "http://test.com", "http://test.com/logo.png" )
+        )
+
+        # check that we get an error for bad XML (after the feed items that could be read)
+        feed_items = []
+        with self.assertRaises( ET.ParseError ):
+            feed_items.extend( FeedReader( "<rss><channel><item><title>Item 1</title></item><item>&nbsp;" ) )
+        self.assertEqual( [ f.title for f in feed_items ], [ "Item 1" ] )
+
+    def test_read_feed( self ):
+        """Test reading a feed into a Feed."""
+
+        # generate a feed, then read it back in
+        feed = Feed( "Test feed", "http://test.com", "<b>Description</b>", updated_time=1.0 )
+        for item_no in range( 1, 6 ):
+            feed.feed_items.append( FeedItem(
+                "Item {} & co.".format( item_no ), "http://test.com/item{}".format( item_no ),
+                "<p>Content for item #{} (\u65e5\u672c)</p>".format( item_no ), float( item_no )
+            ) )
+        feed2 = read_feed( io.BytesIO( feed.get_xml().encode( "utf-8" ) ) )
+        self.assertEqual( feed2.get_xml(), feed.get_xml() )
+        feed2 = read_feed( feed.get_xml(), max_items=2 )
+        self.assertEqual( [ f.title for f in feed2.feed_items ], [ "Item 5 & co.", "Item 4 & co." ] )
+
+def _get_vals( item ):
+    """Get the values from a FeedItem."""
+    return ( item.title, item.url, item.content, item.updated_time, item.extra_args )
+
+# ---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    # a simple example
+    for feed_item in FeedReader( sys.argv[1] if len( sys.argv ) > 1 else sys.stdin.buffer ):
+        print( "{} | {}".format( feed_item.title, feed_item.url ) )
@@ -0,0 +1,642 @@
+""" Fetch URLs concurrently (using asyncio). """
+
+# COPYRIGHT:   (c) Awasu Pty. Ltd. 2015 (all rights reserved).
+#              Unauthorized use of this code is prohibited.
+#
+# LICENSE:     This software is provided 'as-is', without any express
+#              or implied warranty.
+#
+#              In no event will the author be held liable for any damages
+#              arising from the use of this software.
+#
+#              Permission is granted to anyone to use this software
+#              for any purpose, and to alter it and redistribute it freely,
+#              subject to the following restrictions:
+#
+#              - The origin of this software must not be misrepresented;
+#                you must not claim that you wrote the original software.
+#                If you use this software, an acknowledgement is requested
+#                but not required.
+#
+#              - Altered source versions must be plainly marked as such,
+#                and must not be misrepresented as being the original software.
+#                Altered source is encouraged to be submitted back to
+#                the original author so it can be shared with the community.
+#                Please share your changes.
+#
+#              - This notice may not be removed or altered from any
+#                source distribution.
+
+import sys
+import os
+import asyncio
+import ssl
+import socket
+import gzip
+import zlib
+import collections
+import contextlib
+import marshal
+import threading
+import time
+import tempfile
+import urllib.parse
+import http.server
+import unittest
+
+_VALIDATOR_CACHE_VERSION = 1
+
+_REDIRECT_STATUSES = ( 301, 302, 303, 307, 308 )
+_RETRY_STATUSES = ( 500, 502, 503, 504 )
+
+# ---------------------------------------------------------------------
+
+class FetchError( Exception ):
+    """Error while fetching a URL."""
+
+class FetchResult:
+    """The result of fetching a URL."""
+
+    __slots__ = ( "url", "status", "headers", "body", "error", "final_url", "attempts" )
+
+    def __init__( self, url, status=None, headers=None, body=None, error=None, final_url=None ):
+        """Initialize the FetchResult."""
+        self.url = url
+        self.status = status
+        self.headers = headers if headers is not None else {} # nb: names are in lower-case
+        self.body = body
+        self.error = error
+        self.final_url = final_url if final_url else url
+        self.attempts = 1
+
+    @property
+    def ok( self ):
+        """Check if the URL was fetched successfully."""
+        return self.error is None and self.status == 200
+
+    @property
+    def not_modified( self ):
+        """Check if the URL hasn't changed (since it was last fetched)."""
+        return self.error is None and self.status == 304
+
+    def __repr__( self ):
+        return "<FetchResult: {} {}>".format( self.url, self.error if self.error else self.status )
+
+# ---------------------------------------------------------------------
+
+class Fetcher:
+    """Fetch URLs concurrently, using asyncio.
+
+    Connections are pooled (and kept alive) for each host, and at most max_per_host requests
+    are made to a host at the same time (and at most max_total overall). Each request times out
+    after timeout seconds (not counting time spent waiting for a connection), and failed attempts
+    (connection errors, timeouts, and 5xx responses) are retried up to retries times.
+
+    If validator_cache is set (a ValidatorCache, or the name of a file), conditional GET's
+    are used, and a 304 result means that the URL hasn't changed since it was last fetched.
+
+    A Fetcher must only be used with one event loop, and should be closed when it's no longer needed.
+    """
+
+    USER_AGENT = "awasu_tools"
+    MAX_REDIRECTS = 5
+
+    def __init__( self, max_per_host=4, max_total=20, timeout=30, retries=2, retry_delay=0.5,
+        validator_cache=None, headers=None
+    ):
+        """Initialize the Fetcher."""
+        self.max_per_host = max_per_host
+        self.max_total = max_total
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        if isinstance( validator_cache, str ):
+            validator_cache = ValidatorCache( validator_cache )
+        self.validator_cache = validator_cache
+        self.headers = headers
+        self._idle_conns = {} # nb: ( scheme, host, port ) => [ ( reader, writer ) ]
+        self._host_semaphores = {}
+        self._total_semaphore = None
+        self._ssl_context = None
+
+    async def __aenter__( self ):
+        return self
+
+    async def __aexit__( self, exc_type, exc_val, exc_tb ):
+        await self.close()
+
+    async def fetch( self, url ):
+        """Fetch a URL.
+
+        Errors are returned in the FetchResult, not raised.
+        """
+        # fetch the URL
+        validators = self.validator_cache.get( url ) if self.validator_cache is not None else None
+        attempt = 0
+        while True:
+            try:
+                result = await self._fetch_url( url, validators )
+            except ( OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, FetchError ) as ex:
+                result = FetchResult( url, error=ex )
+            if attempt >= self.retries or not _should_retry( result ):
+                break
+            await asyncio.sleep( self.retry_delay * 2**attempt )
+            attempt += 1
+        result.attempts = attempt + 1
+        # update the validator cache
+        if self.validator_cache is not None and result.ok:
+            self.validator_cache.put( url, result.headers.get( "etag" ), result.headers.get( "last-modified" ) )
+        return result
+
+    async def fetch_all( self, urls ):
+        """Fetch URLs concurrently, yielding a FetchResult for each one as it completes."""
+        tasks = [ asyncio.ensure_future( self.fetch( url ) ) for url in urls ]
+        try:
+            for task in asyncio.as_completed( tasks ):
+                yield await task
+        finally:
+            # NOTE: If the caller stops early, we cancel any fetches that are still running.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather( *tasks, return_exceptions=True )
+
+    async def close( self ):
+        """Close the Fetcher."""
+        for conns in self._idle_conns.values():
+            for _, writer in conns:
+                writer.close()
+        self._idle_conns = {}
+        if self.validator_cache is not None:
+            self.validator_cache.save()
+
+    async def _fetch_url( self, url, validators ):
+        """Fetch a URL (following redirects)."""
+        orig_url = url
+        for _ in range( self.MAX_REDIRECTS + 1 ):
+            status, headers, body = await self._request( url, validators if url == orig_url else None )
+            if status in _REDIRECT_STATUSES and "location" in headers:
+                url = urllib.parse.urljoin( url, headers["location"] )
+                continue
+            return FetchResult( orig_url, status, headers, body, final_url=url )
+        raise FetchError( "Too many redirects: {}".format( orig_url ) )
+
+    async def _request( self, url, validators ):
+        """Make an HTTP request."""
+
+        # prepare the request
+        parts = urllib.parse.urlsplit( url )
+        if parts.scheme not in ( "http", "https" ) or not parts.hostname:
+            raise FetchError( "Invalid URL: {}".format( url ) )
+        default_port = 443 if parts.scheme == "https" else 80
+        port = parts.port or default_port
+        host_key = ( parts.scheme, parts.hostname, port )
+        host = "[{}]".format( parts.hostname ) if ":" in parts.hostname else parts.hostname
+        headers = collections.OrderedDict( [
+            ( "Host", host if port == default_port else "{}:{}".format( host, port ) ),
+            ( "User-Agent", self.USER_AGENT ),
+            ( "Accept-Encoding", "gzip, deflate" ),
+            ( "Connection", "keep-alive" ),
+        ] )
+        if validators:
+            if validators[0]:
+                headers[ "If-None-Match" ] = validators[0]
+            if validators[1]:
+                headers[ "If-Modified-Since" ] = validators[1]
+        if self.headers:
+            headers.update( self.headers )
+        req = "GET {} HTTP/1.1\r\n{}\r\n\r\n".format(
+            urllib.parse.urlunsplit( ( "", "", parts.path or "/", parts.query, "" ) ),
+            "\r\n".join( "{}: {}".format( k, v ) for k, v in headers.items() )
+        ).encode( "latin-1" )
+
+        # make the request
+        if self._total_semaphore is None:
+            self._total_semaphore = asyncio.Semaphore( self.max_total )
+        host_semaphore = self._host_semaphores.get( host_key )
+        if host_semaphore is None:
+            host_semaphore = self._host_semaphores[ host_key ] = asyncio.Semaphore( self.max_per_host )
+        async with host_semaphore, self._total_semaphore:
+            # NOTE: The timeout starts once we're allowed to make the request, so that requests
+            # waiting for a connection don't time out before they've been sent.
+            return await asyncio.wait_for( self._send_request( host_key, req ), self.timeout )
+
+    async def _send_request( self, host_key, req ):
+        """Send an HTTP request, and read the response."""
+        while True:
+            reader, writer, reused = await self._get_connection( host_key )
+            try:
+                writer.write( req )
+                await writer.drain()
+                status, resp_headers, body, keep_alive = await _read_response( reader )
+            except ( OSError, asyncio.IncompleteReadError ):
+                writer.close()
+                if reused:
+                    continue # nb: the server closed an idle connection, try again with a new one
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive and len( self._idle_conns.setdefault( host_key, [] ) ) < self.max_per_host:
+                self._idle_conns[ host_key ].append( ( reader, writer ) )
+            else:
+                writer.close()
+            return status, resp_headers, body
+
+    async def _get_connection( self, host_key ):
+        """Get a connection to a host (re-using an idle one, if possible)."""
+        conns = self._idle_conns.get( host_key )
+        while conns:
+            reader, writer = conns.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        scheme, host, port = host_key
+        if scheme == "https" and self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        reader, writer = await asyncio.open_connection( host, port,
+            ssl = self._ssl_context if scheme == "https" else None
+        )
+        return reader, writer, False
+
+def _should_retry( result ):
+    """Check if a failed fetch should be retried."""
+    if result.error is not None:
+        return not isinstance( result.error, ( FetchError, ValueError ) )
+    return result.status in _RETRY_STATUSES
+
+async def _read_response( reader ):
+    """Read an HTTP response."""
+
+    # read the status line
+    line = await reader.readline()
+    if not line:
+        raise ConnectionResetError( "Connection closed." )
+    parts = line.decode( "latin-1" ).split( None, 2 )
+    if len( parts ) < 2 or not parts[0].startswith( "HTTP/" ):
+        raise FetchError( "Invalid status line: {}".format( line ) )
+    status = int( parts[1] )
+
+    # read the headers
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionResetError( "Connection closed." )
+        if line in ( b"\r\n", b"\n" ):
+            break
+        name, _, val = line.decode( "latin-1" ).partition( ":" )
+        name, val = name.strip().lower(), val.strip()
+        headers[ name ] = "{}, {}".format( headers[name], val ) if name in headers else val
+    conn_header = headers.get( "connection", "" ).lower()
+    if parts[0] == "HTTP/1.0":
+        keep_alive = conn_header == "keep-alive"
+    else:
+        keep_alive = conn_header != "close"
+
+    # read the body
+    if status in ( 204, 304 ) or 100 <= status < 200:
+        body = b""
+    elif "chunked" in headers.get( "transfer-encoding", "" ).lower():
+        chunks = []
+        while True:
+            size = int( ( await reader.readline() ).split( b";" )[0], 16 )
+            if size == 0:
+                break
+            chunks.append( await reader.readexactly( size ) )
+            await reader.readexactly( 2 ) # nb: CRLF
+        while await reader.readline() not in ( b"\r\n", b"\n", b"" ):
+            pass # nb: skip any trailers
+        body = b"".join( chunks )
+    elif "content-length" in headers:
+        body = await reader.readexactly( int( headers["content-length"] ) )
+    else:
+        body = await reader.read()
+        keep_alive = False
+
+    # decompress the body
+    encoding = headers.get( "content-encoding", "" ).lower()
+    try:
+        if encoding in ( "gzip", "x-gzip" ):
+            body = gzip.decompress( body )
+        elif encoding == "deflate":
+            try:
+                body = zlib.decompress( body )
+            except zlib.error:
+                body = zlib.decompress( body, -zlib.MAX_WBITS ) # nb: some servers send raw deflate data
+    except ( OSError, EOFError, zlib.error ) as ex:
+        raise FetchError( "Can't decompress the response: {}".format( ex ) ) from ex
+
+    return status, headers, body, keep_alive
+
+# ---------------------------------------------------------------------
+
+def fetch_urls( urls, **kwargs ):
+    """Fetch URLs concurrently, yielding a FetchResult for each one as it completes.
+
+    This is for code that doesn't use asyncio; kwargs are passed through to Fetcher.
+    NOTE: URLs are only fetched while we are waiting for the next result.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        fetcher = Fetcher( **kwargs )
+        results = fetcher.fetch_all( urls )
+        try:
+            while True:
+                try:
+                    result = loop.run_until_complete( results.__anext__() )
+                except StopAsyncIteration:
+                    break
+                yield result
+        finally:
+            loop.run_until_complete( results.aclose() )
+            loop.run_until_complete( fetcher.close() )
+    finally:
+        loop.close()
+
+# ---------------------------------------------------------------------
+
+class ValidatorCache:
+    """Store the ETag and Last-Modified headers returned for URLs (for conditional GET's).
+
+    The cache is saved in a file, and the least-recently used URLs are dropped
+    once there are more than max_entries of them.
+    """
+
+    def __init__( self, fname, max_entries=10000 ):
+        """Initialize the ValidatorCache."""
+        self.fname = fname
+        self.max_entries = max_entries
+        self._entries = None # nb: URL => ( etag, last_modified ) (loaded on demand)
+        self._changed = False
+
+    def get( self, url ):
+        """Return the ( etag, last_modified ) validators for a URL (or None)."""
+        if self._entries is None:
+            self._load()
+        return self._entries.get( url )
+
+    def put( self, url, etag, last_modified ):
+        """Save the validators for a URL."""
+        if self._entries is None:
+            self._load()
+        if etag is None and last_modified is None:
+            if self._entries.pop( url, None ):
+                self._changed = True
+            return
+        self._entries[ url ] = ( etag, last_modified )
+        self._entries.move_to_end( url )
+        while len( self._entries ) > self.max_entries:
+            self._entries.popitem( last=False )
+        self._changed = True
+
+    def save( self ):
+        """Save the cache (if it has changed)."""
+        if not self._changed:
+            return
+        # NOTE: This is just an optimization, so we ignore any errors.
+        temp_fname = "{}.{}.tmp".format( self.fname, os.getpid() )
+        try:
+            with open( temp_fname, "wb" ) as fp:
+                marshal.dump( ( _VALIDATOR_CACHE_VERSION, list( self._entries.items() ) ), fp )
+            os.replace( temp_fname, self.fname )
+        except OSError:
+            try:
+                os.unlink( temp_fname )
+            except OSError:
+                pass
+            return
+        self._changed = False
+
+    def _load( self ):
+        """Load the cache."""
+        self._entries = collections.OrderedDict()
+        try:
+            with open( self.fname, "rb" ) as fp:
+                saved = marshal.load( fp )
+        except ( OSError, EOFError, ValueError, TypeError ):
+            saved = None
+        if isinstance( saved, tuple ) and len( saved ) == 2 and saved[0] == _VALIDATOR_CACHE_VERSION:
+            self._entries.update( saved[1] )
+
+# ---------------------------------------------------------------------
+
+class FetchTestCase( unittest.TestCase ):
+    """Test this module."""
+
+    def test_fetch( self ):
+        """Test fetching URLs."""
+        with _test_server() as server:
+
+            # fetch some URLs
+            async def fetch( urls ):
+                async with Fetcher( retries=0 ) as fetcher:
+                    return [ await fetcher.fetch( url ) for url in urls ]
+            results = asyncio.run( fetch( [
+                server.base_url + url for url in ( "/feed", "/redirect", "/chunked", "/gzip", "/close", "/missing" )
+            ] ) )
+            self.assertEqual( [ r.status for r in results ], [ 200, 200, 200, 200, 200, 404 ] )
+            self.assertEqual( [ r.body for r in results[:5] ], [ _TEST_FEED ] * 5 )
+            self.assertEqual( results[1].final_url, server.base_url + "/feed" )
+            self.assertTrue( results[0].ok )
+            self.assertFalse( results[5].ok )
+            # NOTE: The connection gets closed after "/close", the others re-use the same connection.
+            self.assertEqual( server.nconnections, 2 )
+
+            # check fetching a bad URL
+            result = asyncio.run( fetch( [ "foo://bar" ] ) )[0]
+            self.assertIsInstance( result.error, FetchError )
+            self.assertFalse( result.ok )
+
+            # check that idle connections closed by the server are handled
+            async def fetch2():
+                async with Fetcher( retries=0 ) as fetcher:
+                    result = await fetcher.fetch( server.base_url + "/feed" )
+                    server.close_idle_connections()
+                    await asyncio.sleep( 0.1 )
+                    return result, await fetcher.fetch( server.base_url + "/feed" )
+            results = asyncio.run( fetch2() )
+            self.assertEqual( [ r.status for r in results ], [ 200, 200 ] )
+
+    def test_conditional_get( self ):
+        """Test conditional GET's."""
+        with _test_server() as server, tempfile.TemporaryDirectory() as temp_dir:
+            fname = os.path.join( temp_dir, "validators.cache" )
+            urls = [ server.base_url + "/feed", server.base_url + "/chunked" ]
+            results = list( fetch_urls( urls, validator_cache=fname ) )
+            self.assertEqual( sorted( r.status for r in results ), [ 200, 200 ] )
+            # nb: the URLs are fetched concurrently, so the requests can arrive in any order
+            self.assertEqual( sorted( server.requests[-2:] ), [ ( "/chunked", None ), ( "/feed", None ) ] )
+            results = { r.url: r for r in fetch_urls( urls, validator_cache=fname ) }
+            self.assertTrue( results[ urls[0] ].not_modified )
+            self.assertEqual( results[ urls[0] ].body, b"" )
+            self.assertTrue( results[ urls[1] ].ok ) # nb: this URL doesn't return an ETag
+            self.assertEqual( sorted( server.requests[-2:] ), [ ( "/chunked", None ), ( "/feed", '"v1"' ) ] )
+
+    def test_timeouts( self ):
+        """Test timeouts and retries."""
+        with _test_server() as server:
+            async def fetch( url, **kwargs ):
+                async with Fetcher( retry_delay=0.01, **kwargs ) as fetcher:
+                    return await fetcher.fetch( server.base_url + url )
+            result = asyncio.run( fetch( "/slow", timeout=0.1, retries=1 ) )
+            self.assertIsInstance( result.error, asyncio.TimeoutError )
+            self.assertEqual( result.attempts, 2 )
+            result = asyncio.run( fetch( "/flaky/1", retries=2 ) )
+            self.assertEqual( ( result.status, result.attempts, result.body ), ( 200, 3, _TEST_FEED ) )
+            result = asyncio.run( fetch( "/flaky/2", retries=1 ) )
+            self.assertEqual( ( result.status, result.attempts ), ( 503, 2 ) )
+
+            # check that time spent waiting for a connection isn't counted towards the timeout
+            # nb: each request takes 0.1 seconds, and only 1 can be made at a time
+            urls = [ server.base_url + "/wait/{}".format( i ) for i in range( 8 ) ]
+            results = list( fetch_urls( urls, max_per_host=1, timeout=0.35, retries=0 ) )
+            self.assertEqual( [ r.status for r in results ], [ 200 ] * 8 )
+
+    def test_concurrency( self ):
+        """Test fetching URLs concurrently."""
+        with _test_server() as server:
+
+            # fetch some URLs concurrently
+            urls = [ server.base_url + "/wait/{}".format( i ) for i in range( 8 ) ]
+            results = list( fetch_urls( urls, max_per_host=3 ) )
+            self.assertEqual( sorted( r.url for r in results ), sorted( urls ) )
+            self.assertEqual( server.max_in_flight, 3 )
+            self.assertLessEqual( server.nconnections, 3 )
+
+            # check that the results can be fed straight into a Feed
+            from awasu_tools.feed import Feed #pylint: disable=import-outside-toplevel
+            from awasu_tools.feed_reader import FeedReader #pylint: disable=import-outside-toplevel
+            urls = [ server.base_url + "/feed", server.base_url + "/gzip" ]
+            feed = Feed( "Test feed", "http://test.com", max_items=5 )
+            for result in fetch_urls( urls ):
+                feed.feed_items.extend( FeedReader( result.body ) )
+            self.assertEqual( [ f.title for f in feed.feed_items ], [ "Item 2", "Item 2", "Item 1", "Item 1" ] )
+
+_TEST_FEED = b"""<?xml version="1.0"?>
+<rss><channel><title>Test feed</title>
+<item><title>Item 1</title><link>http://test.com/item1</link><pubDate>Tue, 01 Apr 2014 12:02:03 +0400</pubDate></item>
+<item><title>Item 2</title><link>http://test.com/item2</link><pubDate>Tue, 01 Apr 2014 12:02:04 +0400</pubDate></item>
+</channel></rss>
+"""
+
+class _TestRequestHandler( http.server.BaseHTTPRequestHandler ):
+    """Handle requests for the test server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup( self ):
+        super().setup()
+        with self.server.lock:
+            self.server.nconnections += 1
+            self.server.open_conns.append( self.connection )
+
+    def do_GET( self ): #pylint: disable=invalid-name
+        """Handle a GET request."""
+        server = self.server
+        with server.lock:
+            server.requests.append( ( self.path, self.headers.get( "If-None-Match" ) ) )
+            server.in_flight += 1
+            server.max_in_flight = max( server.in_flight, server.max_in_flight )
+        try:
+            self._handle_get()
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _handle_get( self ):
+        """Handle a GET request."""
+        path = self.path
+        if path == "/feed":
+            if self.headers.get( "If-None-Match" ) == '"v1"':
+                self.send_response( 304 )
+                self.send_header( "ETag", '"v1"' )
+                self.end_headers()
+                return
+            self._send_body( _TEST_FEED, ETag='"v1"', **{ "Last-Modified": "Tue, 01 Apr 2014 08:02:03 GMT" } )
+        elif path == "/redirect":
+            self.send_response( 302 )
+            self.send_header( "Location", "/feed" )
+            self.send_header( "Content-Length", "0" )
+            self.end_headers()
+        elif path == "/chunked":
+            self.send_response( 200 )
+            self.send_header( "Transfer-Encoding", "chunked" )
+            self.end_headers()
+            for pos in range( 0, len(_TEST_FEED), 100 ):
+                chunk = _TEST_FEED[ pos : pos+100 ]
+                self.wfile.write( "{:x};ext=1\r\n".format( len(chunk) ).encode() + chunk + b"\r\n" )
+            self.wfile.write( b"0\r\nX-Trailer: 1\r\n\r\n" )
+        elif path == "/gzip":
+            self._send_body( gzip.compress( _TEST_FEED ), **{ "Content-Encoding": "gzip" } )
+        elif path == "/close":
+            self.send_response( 200 )
+            self.send_header( "Connection", "close" )
+            self.end_headers()
+            self.wfile.write( _TEST_FEED )
+            self.close_connection = True
+        elif path == "/slow":
+            time.sleep( 0.5 )
+            self._send_body( b"" )
+        elif path.startswith( "/flaky/" ):
+            # NOTE: This fails the first 2 times.
+            with self.server.lock:
+                count = self.server.counts[ path ] = self.server.counts.get( path, 0 ) + 1
+            if count <= 2:
+                self.send_response( 503 )
+                self.send_header( "Content-Length", "0" )
+                self.end_headers()
+            else:
+                self._send_body( _TEST_FEED )
+        elif path.startswith( "/wait/" ):
+            time.sleep( 0.1 )
+            self._send_body( path.encode() )
+        else:
+            self.send_error( 404 )
+
+    def _send_body( self, body, **headers ):
+        """Send a response."""
+        self.send_response( 200 )
+        self.send_header( "Content-Length", str( len( body ) ) )
+        for key, val in headers.items():
+            self.send_header( key, val )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message( self, format, *args ): #pylint: disable=redefined-builtin
+        pass
+
+@contextlib.contextmanager
+def _test_server():
+    """Run a local HTTP server (for testing)."""
+    server = http.server.ThreadingHTTPServer( ( "127.0.0.1", 0 ), _TestRequestHandler )
+    server.daemon_threads = True
+    server.handle_error = lambda request, client_address: None # nb: e.g. the client timed out
+    server.base_url = "http://127.0.0.1:{}".format( server.server_address[1] )
+    server.lock = threading.Lock()
+    server.nconnections = server.in_flight = server.max_in_flight = 0
+    server.requests = []
+    server.counts = {}
+    server.open_conns = []
+    def close_idle_connections():
+        with server.lock:
+            for conn in server.open_conns:
+                try:
+                    conn.shutdown( socket.SHUT_RDWR )
+                except OSError:
+                    pass # nb: the connection has already been closed
+    server.close_idle_connections = close_idle_connections
+    thread = threading.Thread( target=server.serve_forever, kwargs={ "poll_interval": 0.05 }, daemon=True )
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+# ---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    # a simple example
+    for _result in fetch_urls( sys.argv[1:] ):
+        print( _result, len( _result.body or b"" ) )
@@ -27,9 +27,26 @@
 #              - This notice may not be removed or altered from any
 #                source distribution.
 
+import os
 import time
+import functools
+import threading
+import collections
+import atexit
+import tempfile
+import unittest
 
 _log_file = None
+_log_queue = None # nb: this is set if log messages are being written in the background
+_log_reqs = [] # nb: requests for the background thread
+_log_cond = threading.Condition( threading.Lock() ) # nb: this protects _log_queue and _log_reqs
+_rotation = None # nb: ( fname, max_size, backup_count ), if the log file is being rotated
+_log_size = 0
+
+_FLUSH = object()
+_STOP = object()
+_WAKEUP_SIZE = 10000 # nb: the number of queued log messages that will wake up the background thread
+_MAX_QUEUE_SIZE = 50000
 
 # ---------------------------------------------------------------------
 
@@ -38,12 +55,11 @@ def log_msg( msg, *args, **kwargs ):
     if not _log_file:
         return
     # log the message
-    if msg == "":
-        _log_file.write( "\n" )
+    buf = _format_msg( time.time(), msg, args, kwargs )
+    if _log_queue is not None:
+        _queue_msg( buf )
         return
-    _log_file.write( "{} | ".format( time.strftime( "%Y-%m-%d %H:%M:%S" ) ) )
-    _log_file.write( msg.format( *args, **kwargs ) )
-    _log_file.write( "\n" )
+    _write( buf )
     _log_file.flush()
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -53,22 +69,270 @@ def log_raw_msg( msg ):
     if not _log_file:
         return
     # log the message
-    _log_file.write( msg )
-    if not msg.endswith( "\n" ):
-        _log_file.write( "\n" )
+    buf = _format_msg( None, msg, None, None )
+    if _log_queue is not None:
+        _queue_msg( buf )
+        return
+    _write( buf )
     _log_file.flush()
 
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def is_logging():
+    """Check if logging has been enabled."""
+    return _log_file is not None
+
 # ---------------------------------------------------------------------
 
-def init_logging( log_filename ):
-    """Initialize logging."""
+def init_logging( log_filename, background=False, max_size=None, backup_count=3,
+    flush_size=64*1024, flush_interval=1.0
+):
+    """Initialize logging.
+
+    If background is set, log messages are written in a background thread, and the log file is flushed
+    every flush_interval seconds, or when flush_size characters have been written (call flush_logging()
+    to force it). If max_size is set, the log file is rotated when it gets to (roughly) that many bytes,
+    and up to backup_count old log files are kept (as .1, .2, etc.)
+    """
     if not log_filename:
         return
-    global _log_file
+    close_logging()
+    global _log_file, _log_queue, _rotation, _log_size
     if log_filename.startswith( "+" ):
         # append to the log file
-        _log_file = open( log_filename[1:], "a", encoding="utf-8" )
+        log_filename = log_filename[1:]
+        _log_file = open( log_filename, "a", encoding="utf-8" ) #pylint: disable=consider-using-with
         _log_file.write( "\n\n\n=== NEW SESSION ===\n" )
     else:
         # start a new log file
         _log_file = open( log_filename, "w", encoding="utf-8" ) #pylint: disable=consider-using-with
+    if max_size:
+        _rotation = ( log_filename, max_size, backup_count )
+        _log_size = _log_file.tell()
+    if background:
+        _log_queue = collections.deque()
+        threading.Thread(
+            target=_run_background, args=( _log_queue, flush_size, flush_interval ), daemon=True
+        ).start()
+
+def flush_logging():
+    """Wait for any log messages being written in the background, and flush the log file."""
+    if _log_queue is not None:
+        _send_request( _FLUSH )
+    elif _log_file:
+        _log_file.flush()
+
+def close_logging():
+    """Stop logging."""
+    global _log_file, _log_queue, _rotation
+    if _log_queue is not None:
+        _send_request( _STOP )
+        with _log_cond:
+            _log_queue = None
+            _log_cond.notify_all() # nb: wake up anyone waiting for space in the queue
+    if _log_file:
+        _log_file.close()
+        _log_file = None
+    _rotation = None
+
+atexit.register( flush_logging )
+
+# ---------------------------------------------------------------------
+
+def _queue_msg( buf ):
+    """Queue a log message, to be written in the background."""
+    # NOTE: Appending to a deque is much faster than using a Queue, and we only wake up
+    # the background thread when there are enough log messages waiting to be written.
+    with _log_cond:
+        # NOTE: We limit the size of the queue, so that it can't grow without limit
+        # if messages are logged faster than they can be written.
+        while _log_queue is not None and len( _log_queue ) >= _MAX_QUEUE_SIZE:
+            _log_cond.wait()
+        if _log_queue is None:
+            return # nb: logging was stopped while we were waiting
+        _log_queue.append( buf )
+        if len( _log_queue ) == _WAKEUP_SIZE:
+            _log_cond.notify_all()
+
+def _send_request( req ):
+    """Send a request to the background thread, and wait for it to be done."""
+    done = threading.Event()
+    with _log_cond:
+        _log_reqs.append( ( req, done ) )
+        _log_cond.notify_all()
+    done.wait()
+
+def _run_background( queue_, flush_size, flush_interval ):
+    """Write log messages in the background."""
+    unflushed, last_flush = 0, time.monotonic()
+    while True:
+
+        # wait until there are log messages to write (or they need to be flushed)
+        with _log_cond:
+            if len( queue_ ) < _WAKEUP_SIZE and not _log_reqs:
+                _log_cond.wait( flush_interval )
+            bufs = list( queue_ )
+            queue_.clear()
+            reqs = _log_reqs[:]
+            _log_reqs.clear()
+            _log_cond.notify_all() # nb: wake up anyone waiting for space in the queue
+
+        # write out the log messages
+        # NOTE: There's nothing we can do if logging fails, but we need to keep going,
+        # otherwise anyone waiting for the log to be flushed will wait forever.
+        for buf in bufs:
+            try:
+                _write( buf )
+            except Exception: #pylint: disable=broad-except
+                continue
+            unflushed += len( buf )
+            if unflushed >= flush_size:
+                _flush_log_file()
+                unflushed, last_flush = 0, time.monotonic()
+        if unflushed and ( reqs or time.monotonic() - last_flush >= flush_interval ):
+            _flush_log_file()
+            unflushed, last_flush = 0, time.monotonic()
+
+        # handle any requests
+        for req, done in reqs:
+            done.set()
+            if req is _STOP:
+                return
+
+def _flush_log_file():
+    """Flush the log file (from the background thread)."""
+    try:
+        _log_file.flush()
+    except Exception: #pylint: disable=broad-except
+        pass
+
+def _format_msg( tstamp, msg, args, kwargs ):
+    """Format a log message."""
+    if tstamp is None:
+        # nb: this is a raw message
+        return msg if msg.endswith( "\n" ) else msg + "\n"
+    if msg == "":
+        return "\n"
+    return "{} | {}\n".format( _format_tstamp( int( tstamp ) ), msg.format( *args, **kwargs ) )
+
+@functools.lru_cache( maxsize=1 )
+def _format_tstamp( tstamp ):
+    """Format a log message's timestamp."""
+    # NOTE: Log messages are often written in bursts, so we remember the last timestamp we formatted.
+    return time.strftime( "%Y-%m-%d %H:%M:%S", time.localtime( tstamp ) )
+
+def _write( buf ):
+    """Write to the log file (and rotate it, if necessary)."""
+    global _log_size
+    _log_file.write( buf )
+    if _rotation:
+        # nb: the log file is UTF-8, so we only need to encode messages that aren't ASCII
+        _log_size += len( buf ) if buf.isascii() else len( buf.encode( "utf-8" ) )
+        if _log_size >= _rotation[1]:
+            _rotate_log_file()
+
+def _rotate_log_file():
+    """Rotate the log file."""
+    global _log_file, _log_size
+    fname, _, backup_count = _rotation
+    _log_file.close()
+    for i in range( backup_count, 0, -1 ):
+        fname2 = "{}.{}".format( fname, i-1 ) if i > 1 else fname
+        if os.path.isfile( fname2 ):
+            os.replace( fname2, "{}.{}".format( fname, i ) )
+    _log_file = open( fname, "w", encoding="utf-8" ) #pylint: disable=consider-using-with
+    _log_size = 0
+
+# ---------------------------------------------------------------------
+
+class LogTestCase( unittest.TestCase ):
+    """Test this module."""
+
+    def setUp( self ):
+        self.temp_dir = tempfile.TemporaryDirectory() #pylint: disable=consider-using-with
+        self.fname = os.path.join( self.temp_dir.name, "test.log" )
+
+    def tearDown( self ):
+        close_logging()
+        self.temp_dir.cleanup()
+
+    def test_logging( self ):
+        """Test logging messages."""
+        for background in ( False, True ):
+            init_logging( self.fname, background=background )
+            self.assertTrue( is_logging() )
+            log_msg( "Hello, {}!", "world" )
+            log_msg( "" )
+            log_msg( "{val}", val=42 )
+            log_raw_msg( "raw\nmessage" )
+            log_raw_msg( "raw message\n" )
+            with self.assertRaises( IndexError ):
+                log_msg( "Bad message: {}" )
+            flush_logging()
+            self.assertEqual( self._read_log(),
+                [ "Hello, world!", "", "42", "raw", "message", "raw message" ]
+            )
+            close_logging()
+            self.assertFalse( is_logging() )
+            log_msg( "not logged" )
+
+        # check appending to the log file
+        init_logging( "+" + self.fname, background=True )
+        log_msg( "Appended" )
+        close_logging()
+        self.assertEqual( self._read_log()[-5:], [ "", "", "", "=== NEW SESSION ===", "Appended" ] )
+
+    def test_background( self ):
+        """Test logging messages in the background."""
+
+        # log a lot of messages
+        init_logging( self.fname, background=True, flush_size=1000, flush_interval=0.05 )
+        for i in range( 120000 ):
+            log_msg( "Message #{}", i )
+        flush_logging()
+        self.assertEqual( self._read_log(), [ "Message #{}".format( i ) for i in range( 120000 ) ] )
+
+        # check that the message is logged as it was when it was logged, not when it was written
+        vals = [ 1 ]
+        log_msg( "Values: {}", vals )
+        vals.append( 2 )
+        flush_logging()
+        self.assertEqual( self._read_log()[-1], "Values: [1]" )
+
+        # check that nothing is logged once logging has been stopped
+        close_logging()
+        log_msg( "Not logged" )
+        self.assertEqual( self._read_log()[-1], "Values: [1]" )
+
+    def test_rotation( self ):
+        """Test rotating log files."""
+        for background in ( False, True ):
+            init_logging( self.fname, background=background, max_size=1000, backup_count=2 )
+            for i in range( 200 ):
+                log_msg( "Message #{:03d} (\u65e5\u672c\u8a9e)", i ) # nb: the log file size is in bytes, not characters
+            close_logging()
+            fnames = sorted( os.listdir( self.temp_dir.name ) )
+            self.assertEqual( fnames, [ "test.log", "test.log.1", "test.log.2" ] )
+            lines = []
+            for fname in reversed( fnames ):
+                lines.extend( self._read_log( os.path.join( self.temp_dir.name, fname ) ) )
+                self.assertLess( os.path.getsize( os.path.join( self.temp_dir.name, fname ) ), 1000 + 100 )
+            self.assertEqual( lines,
+                [ "Message #{:03d} (\u65e5\u672c\u8a9e)".format( i ) for i in range( 200 - len(lines), 200 ) ]
+            )
+            for fname in fnames:
+                os.unlink( os.path.join( self.temp_dir.name, fname ) )
+
+    def _read_log( self, fname=None ):
+        """Read the log file (without timestamps)."""
+        with open( fname or self.fname, "r", encoding="utf-8" ) as fp:
+            return [
+                line[22:] if line[4:5] == "-" and line[19:22] == " | " else line
+                for line in fp.read().splitlines()
+            ]
+
+# ---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    # run the unit tests
+    unittest.main()
@@ -0,0 +1,245 @@
+""" Collect timing statistics. """
+
+# COPYRIGHT:   (c) Awasu Pty. Ltd. 2015 (all rights reserved).
+#              Unauthorized use of this code is prohibited.
+#
+# LICENSE:     This software is provided 'as-is', without any express
+#              or implied warranty.
+#
+#              In no event will the author be held liable for any damages
+#              arising from the use of this software.
+#
+#              Permission is granted to anyone to use this software
+#              for any purpose, and to alter it and redistribute it freely,
+#              subject to the following restrictions:
+#
+#              - The origin of this software must not be misrepresented;
+#                you must not claim that you wrote the original software.
+#                If you use this software, an acknowledgement is requested
+#                but not required.
+#
+#              - Altered source versions must be plainly marked as such,
+#                and must not be misrepresented as being the original software.
+#                Altered source is encouraged to be submitted back to
+#                the original author so it can be shared with the community.
+#                Please share your changes.
+#
+#              - This notice may not be removed or altered from any
+#                source distribution.
+
+import os
+import sys
+import time
+import json
+import functools
+import atexit
+import unittest
+
+from awasu_tools.log import log_msg, log_raw_msg
+
+# NOTE: Statistics are enabled by setting AWASU_TOOLS_STATS in the environment (to "json" to also log them
+# as JSON), or by calling enable_stats() *before* importing any other awasu_tools modules. Functions are
+# only instrumented when they are defined, so if statistics are disabled, there is no overhead at all
+# (but we remember which functions weren't instrumented, so that enable_stats() can complain if it's too late).
+_enabled = os.environ.get( "AWASU_TOOLS_STATS", "" ).lower()
+if _enabled in ( "0", "no", "false", "off" ):
+    _enabled = ""
+_stats = {} # nb: name => [ calls, total time, max time ] (in ns)
+_untimed = set() # nb: the names of functions that weren't instrumented (because statistics were disabled)
+
+# ---------------------------------------------------------------------
+
+def enable_stats( json_lines=False ):
+    """Enable statistics.
+
+    This must be called before any other awasu_tools modules are imported (a RuntimeError is raised
+    if it's too late). If json_lines is set, the statistics are also logged as JSON (one line per timer).
+    """
+    global _enabled
+    if _untimed:
+        raise RuntimeError( "Statistics must be enabled before these are defined: {}".format(
+            ", ".join( sorted( _untimed ) )
+        ) )
+    _enabled = "json" if json_lines else "1"
+
+def is_stats_enabled():
+    """Check if statistics are enabled."""
+    return bool( _enabled )
+
+def timed( name ):
+    """Decorator that records how long a function takes to run (if statistics are enabled)."""
+    def decorator( func ):
+        if not _enabled:
+            _untimed.add( name )
+            return func
+        stats = _stats.setdefault( name, [ 0, 0, 0 ] )
+        perf_counter_ns = time.perf_counter_ns
+        @functools.wraps( func )
+        def wrapper( *args, **kwargs ):
+            start_time = perf_counter_ns()
+            try:
+                return func( *args, **kwargs )
+            finally:
+                # NOTE: We don't lock while updating the statistics, since it would double the overhead.
+                # This means that a few calls might not be counted, if several threads are being timed.
+                elapsed = perf_counter_ns() - start_time
+                stats[0] += 1
+                stats[1] += elapsed
+                if elapsed > stats[2]:
+                    stats[2] = elapsed
+        # nb: so that functools.lru_cache's can still be managed
+        for attr in ( "cache_info", "cache_clear" ):
+            if hasattr( func, attr ):
+                setattr( wrapper, attr, getattr( func, attr ) )
+        return wrapper
+    return decorator
+
+# ---------------------------------------------------------------------
+
+def get_stats():
+    """Get the statistics that have been collected.
+
+    Returns a dict of timer names => { "calls", "total", "max" } (times are in seconds). Timers that were
+    never called are not included. Calls made in other processes (e.g. a process pool) are not recorded.
+    """
+    return {
+        name: { "calls": stats[0], "total": stats[1] / 1e9, "max": stats[2] / 1e9 }
+        for name, stats in sorted( _stats.items() )
+        if stats[0] > 0
+    }
+
+def reset_stats():
+    """Reset the statistics that have been collected."""
+    for stats in _stats.values():
+        stats[:] = [ 0, 0, 0 ]
+
+def log_stats( json_lines=None ):
+    """Log the statistics that have been collected.
+
+    If json_lines is not specified, the statistics are logged as JSON if that was requested when
+    statistics were enabled.
+    """
+    stats = get_stats()
+    if not stats:
+        return
+    log_msg( "" )
+    log_msg( "Statistics:" )
+    name_len = max( len( name ) for name in stats )
+    log_msg( "  {:<{}} {:>10} {:>12} {:>12} {:>12}", "", name_len, "calls", "total (ms)", "avg (us)", "max (us)" )
+    for name, vals in stats.items():
+        log_msg( "  {:<{}} {:>10,} {:>12,.1f} {:>12,.2f} {:>12,.1f}", name, name_len,
+            vals["calls"], vals["total"] * 1e3, vals["total"] / vals["calls"] * 1e6, vals["max"] * 1e6
+        )
+    if json_lines is None:
+        json_lines = _enabled == "json"
+    if json_lines:
+        for name, vals in stats.items():
+            log_raw_msg( json.dumps( { "name": name, **vals } ) )
+
+def _log_stats_at_exit():
+    """Log the statistics when the program exits."""
+    if _enabled:
+        log_stats()
+
+atexit.register( _log_stats_at_exit )
+
+# ---------------------------------------------------------------------
+
+class StatsTestCase( unittest.TestCase ):
+    """Test this module."""
+
+    def test_timed( self ):
+        """Test timing functions."""
+
+        # check that functions aren't instrumented if statistics are disabled
+        global _enabled
+        prev_enabled, prev_untimed = _enabled, set( _untimed )
+        _enabled = ""
+        try:
+            def func( val ):
+                return val * 2
+            self.assertIs( timed( "test.disabled" )( func ), func )
+            self.assertNotIn( "test.disabled", _stats )
+
+            # check that statistics can't be enabled once functions have been defined without them
+            with self.assertRaisesRegex( RuntimeError, "test.disabled" ):
+                enable_stats()
+            self.assertFalse( is_stats_enabled() )
+
+            # check instrumenting functions
+            _untimed.clear()
+            enable_stats()
+            self.assertTrue( is_stats_enabled() )
+            wrapped = timed( "test.func" )( func )
+            self.assertIsNot( wrapped, func )
+            self.assertEqual( wrapped.__name__, "func" )
+            self.assertEqual( [ wrapped( i ) for i in range( 5 ) ], [ 0, 2, 4, 6, 8 ] )
+            def fail():
+                raise RuntimeError()
+            fail = timed( "test.fail" )( fail )
+            with self.assertRaises( RuntimeError ):
+                fail()
+            cached = timed( "test.cached" )( functools.lru_cache( maxsize=10 )( func ) )
+            cached( 1 )
+            cached( 1 )
+            self.assertEqual( cached.cache_info().hits, 1 )
+            cached.cache_clear()
+            stats = get_stats()
+            self.assertEqual( [ stats[k]["calls"] for k in ( "test.func", "test.fail", "test.cached" ) ], [ 5, 1, 2 ] )
+            self.assertGreater( stats["test.func"]["total"], 0 )
+            self.assertLessEqual( stats["test.func"]["max"], stats["test.func"]["total"] )
+            reset_stats()
+            self.assertNotIn( "test.func", get_stats() )
+        finally:
+            _enabled = prev_enabled
+            _untimed.clear()
+            _untimed.update( prev_untimed )
+            for key in ( "test.func", "test.fail", "test.cached" ):
+                _stats.pop( key, None )
+
+    def test_instrumentation( self ):
+        """Test instrumenting the awasu_tools modules."""
+        import subprocess #pylint: disable=import-outside-toplevel
+
+        # run a script with statistics enabled
+        script = "\n".join( [
+            "from awasu_tools.log import init_logging",
+            "from awasu_tools.config import ConfigFile",
+            "from awasu_tools.feed import Feed, FeedItem",
+            "init_logging( {!r} )".format( os.devnull ),
+            "config = ConfigFile( b'[Test]\\nkey = val' )",
+            "assert config.get_string( 'Test', 'key' ) == 'val'",
+            "feed = Feed( 'Test feed', 'http://test.com' )",
+            "feed.feed_items.append( FeedItem( 'Item 1', 'http://test.com/item1', None, '2020-01-01T00:00:00Z' ) )",
+            "feed.feed_items.append( FeedItem( 'Item 2', 'http://test.com/item2', None, 1.0 ) )",
+            "feed.get_xml()",
+            "feed.feed_items[0].get_xml()",
+            "from awasu_tools.utils import parse_rfc2822_timestamp",
+            "parse_rfc2822_timestamp( 'Tue, 01 Apr 2014 12:02:03 +0400' )",
+            "from awasu_tools.stats import get_stats",
+            "import json",
+            "print( json.dumps( get_stats() ) )",
+        ] )
+        env = dict( os.environ, AWASU_TOOLS_STATS="json" )
+        env["PYTHONPATH"] = os.pathsep.join(
+            [ os.path.join( os.path.dirname( __file__ ), ".." ), env.get( "PYTHONPATH", "" ) ]
+        )
+        proc = subprocess.run( [ sys.executable, "-c", script ],
+            env=env, capture_output=True, text=True, check=True
+        )
+        stats = json.loads( proc.stdout )
+        self.assertEqual( { k: v["calls"] for k, v in stats.items() }, {
+            "config.init": 1,
+            "config.get_val": 1,
+            "feed.get_xml": 1,
+            "feed_item.get_xml": 3,
+            "safe_xml": 12,
+            "timestamps.format_iso8601": 2,
+            "timestamps.parse_rfc2822": 1,
+        } )
+
+# ---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    # run the unit tests
+    unittest.main()
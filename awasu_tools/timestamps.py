@@ -0,0 +1,332 @@
+""" Parse and format timestamps. """
+
+# COPYRIGHT:   (c) Awasu Pty. Ltd. 2015 (all rights reserved).
+#              Unauthorized use of this code is prohibited.
+#
+# LICENSE:     This software is provided 'as-is', without any express
+#              or implied warranty.
+#
+#              In no event will the author be held liable for any damages
+#              arising from the use of this software.
+#
+#              Permission is granted to anyone to use this software
+#              for any purpose, and to alter it and redistribute it freely,
+#              subject to the following restrictions:
+#
+#              - The origin of this software must not be misrepresented;
+#                you must not claim that you wrote the original software.
+#                If you use this software, an acknowledgement is requested
+#                but not required.
+#
+#              - Altered source versions must be plainly marked as such,
+#                and must not be misrepresented as being the original software.
+#                Altered source is encouraged to be submitted back to
+#                the original author so it can be shared with the community.
+#                Please share your changes.
+#
+#              - This notice may not be removed or altered from any
+#                source distribution.
+
+import sys
+import re
+import math
+import time
+import calendar
+import datetime
+import functools
+import random
+import unittest
+
+from awasu_tools.stats import timed
+
+# NOTE: Timestamps often repeat (e.g. when the same feed is processed over and over),
+# so we remember the results for this many of them.
+CACHE_SIZE = 16384
+
+_MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12
+}
+_DAY_NAMES = frozenset( ( "mon", "tue", "wed", "thu", "fri", "sat", "sun" ) )
+
+# NOTE: These are the time zones defined in RFC 2822, plus a few common ones (offsets are in minutes).
+# Other alphabetic time zones are treated as UTC, as recommended by RFC 2822.
+_ZONES = {
+    "UT": 0, "UTC": 0, "GMT": 0, "Z": 0,
+    "EST": -5*60, "EDT": -4*60, "CST": -6*60, "CDT": -5*60,
+    "MST": -7*60, "MDT": -6*60, "PST": -8*60, "PDT": -7*60,
+    "BST": 60, "CET": 60, "CEST": 2*60, "EET": 2*60, "EEST": 3*60,
+    "JST": 9*60, "AEST": 10*60, "AEDT": 11*60,
+}
+
+_ISO8601_REGEX = re.compile( r"""
+    ^ \s* ( \d{4} ) - ( \d\d ) - ( \d\d )
+    (?: [Tt ] ( \d\d ) : ( \d\d ) (?: : ( \d\d ) ( [.,] \d+ )? )? )?
+    \s* ( [Zz] | [+-] \d\d (?: :? \d\d )? )? \s* $
+""", re.VERBOSE | re.ASCII )
+
+# ---------------------------------------------------------------------
+
+# NOTE: The parse functions check their argument before calling the cached functions that do the work,
+# since lru_cache raises an exception for unhashable arguments.
+
+@timed( "timestamps.parse" )
+def parse_timestamp( val ):
+    """Parse an RFC 2822 or ISO 8601 timestamp, and return it as an epoch time (or None)."""
+    if not isinstance( val, str ):
+        return None
+    if val.lstrip()[:4].isdecimal():
+        return _parse_iso8601( val )
+    return _parse_rfc2822( val )
+
+def parse_timestamps( vals ):
+    """Parse a list of RFC 2822 or ISO 8601 timestamps."""
+    return list( map( parse_timestamp, vals ) )
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+@timed( "timestamps.parse_rfc2822" )
+def parse_rfc2822( val ):
+    """Parse an RFC 2822 timestamp (e.g. "Tue, 01 Apr 2014 12:02:03 +0400").
+
+    Returns the epoch time (or None, if the timestamp is invalid).
+    """
+    if not isinstance( val, str ):
+        return None
+    return _parse_rfc2822( val )
+
+@functools.lru_cache( maxsize=CACHE_SIZE )
+def _parse_rfc2822( val ):
+    """Parse an RFC 2822 timestamp."""
+
+    # split the timestamp into its parts
+    #   0   1   2    3        4
+    #   01  Apr 2014 15:07:51 +0000
+    parts = val.replace( ",", " " ).split()
+    if parts and parts[0][:3].lower() in _DAY_NAMES:
+        del parts[0] # nb: we sometimes get timestamps without the DOW :shrug:
+    if len( parts ) < 4:
+        return None
+
+    # parse the date
+    date, month, year = parts[0], _MONTHS.get( parts[1][:3].lower() ), parts[2]
+    if not month or not date.isdecimal() or not year.isdecimal() or len( date ) > 2:
+        return None # nb: we sometimes get weird rubbish :-/
+    date = int( date ) # nb: we sometimes get single-digit dates :-/
+    if len( year ) == 2:
+        year = int( year ) + ( 2000 if int( year ) < 50 else 1900 )
+    elif len( year ) == 3:
+        year = int( year ) + 1900
+    elif len( year ) == 4:
+        year = int( year )
+    else:
+        return None
+    if not 1 <= date <= _days_in_month( year, month ):
+        return None
+
+    # parse the time
+    hms = parts[3].split( ":" )
+    if len( hms ) not in ( 2, 3 ) or not all( v.isdecimal() and len( v ) <= 2 for v in hms ):
+        return None
+    hours, minutes = int( hms[0] ), int( hms[1] )
+    seconds = int( hms[2] ) if len( hms ) == 3 else 0
+    if hours > 23 or minutes > 59 or seconds > 60: # nb: allow for leap seconds
+        return None
+
+    # parse the time zone
+    tz_offset = _parse_zone( parts[4] ) if len( parts ) > 4 else 0
+    if tz_offset is None:
+        return None
+
+    return _days_from_civil( year, month, date ) * 86400 + hours*3600 + minutes*60 + seconds - tz_offset*60
+
+@timed( "timestamps.parse_iso8601" )
+def parse_iso8601( val ):
+    """Parse an ISO 8601 timestamp (e.g. "2014-04-01T08:02:03Z").
+
+    Timestamps without a time zone are assumed to be UTC. Returns the epoch time (as a float, if it has
+    fractional seconds), or None if the timestamp is invalid.
+    """
+    if not isinstance( val, str ):
+        return None
+    return _parse_iso8601( val )
+
+@functools.lru_cache( maxsize=CACHE_SIZE )
+def _parse_iso8601( val ):
+    """Parse an ISO 8601 timestamp."""
+
+    # parse the timestamp
+    mo = _ISO8601_REGEX.search( val )
+    if not mo:
+        return None
+    year, month, date = int( mo.group(1) ), int( mo.group(2) ), int( mo.group(3) )
+    hours, minutes, seconds = ( int( v ) if v else 0 for v in mo.group( 4, 5, 6 ) )
+    if not 1 <= month <= 12 or not 1 <= date <= _days_in_month( year, month ) \
+      or hours > 23 or minutes > 59 or seconds > 60:
+        return None
+    tstamp = _days_from_civil( year, month, date ) * 86400 + hours*3600 + minutes*60 + seconds
+
+    # adjust for the time zone
+    tz = mo.group( 8 )
+    if tz and tz not in ( "Z", "z" ):
+        tz_offset = int( tz[1:3] ) * 60 + ( int( tz[-2:] ) if len( tz ) > 3 else 0 )
+        tstamp -= 60 * ( tz_offset if tz[0] == "+" else -tz_offset )
+
+    # check for fractional seconds
+    frac = mo.group( 7 )
+    if frac and frac[1:].strip( "0" ):
+        return tstamp + float( "0." + frac[1:] )
+    return tstamp
+
+def _parse_zone( zone ):
+    """Parse an RFC 2822 time zone, and return its offset (in minutes)."""
+    if zone[0] in "+-":
+        digits = zone[1:].replace( ":", "" )
+        if len( digits ) != 4 or not digits.isdecimal():
+            return None
+        tz_offset = int( digits[:2] ) * 60 + int( digits[2:] )
+        return tz_offset if zone[0] == "+" else -tz_offset
+    if not zone.isalpha():
+        return None if not zone.startswith( "(" ) else 0 # nb: e.g. a comment, "(PDT)"
+    return _ZONES.get( zone.upper(), 0 )
+
+# ---------------------------------------------------------------------
+
+@timed( "timestamps.format_iso8601" )
+def format_iso8601( tstamp ):
+    """Format an epoch time as an ISO 8601 timestamp (e.g. "2014-04-01T08:02:03Z")."""
+    # NOTE: Fractional seconds are dropped (the same as time.gmtime() does).
+    return _format_iso8601( math.floor( tstamp ) if isinstance( tstamp, float ) else tstamp )
+
+def format_iso8601_batch( tstamps ):
+    """Format a list of epoch times as ISO 8601 timestamps."""
+    return list( map( format_iso8601, tstamps ) )
+
+@functools.lru_cache( maxsize=CACHE_SIZE )
+def _format_iso8601( tstamp ):
+    """Format an (integer) epoch time as an ISO 8601 timestamp."""
+    # NOTE: time.gmtime() and time.strftime() are implemented in C, and are much faster
+    # than doing the arithmetic in Python.
+    return time.strftime( "%Y-%m-%dT%H:%M:%SZ", time.gmtime( tstamp ) )
+
+# ---------------------------------------------------------------------
+
+# NOTE: This converts a date to the number of days since the epoch, using only integer arithmetic.
+# nb: see http://howardhinnant.github.io/date_algorithms.html
+
+def _days_from_civil( year, month, date ):
+    """Convert a date to the number of days since the epoch."""
+    year -= month <= 2
+    era = year // 400
+    yoe = year - era * 400
+    doy = ( 153 * ( month - 3 if month > 2 else month + 9 ) + 2 ) // 5 + date - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+def _days_in_month( year, month ):
+    """Return the number of days in a month."""
+    if month == 2:
+        return 29 if year % 4 == 0 and ( year % 100 != 0 or year % 400 == 0 ) else 28
+    return 30 if month in ( 4, 6, 9, 11 ) else 31
+
+# ---------------------------------------------------------------------
+
+class TimestampsTestCase( unittest.TestCase ):
+    """Test this module."""
+
+    def test_rfc2822( self ):
+        """Test parsing RFC 2822 timestamps."""
+
+        # test parsing valid timestamps
+        for val, expected in [
+            ( "Tue, 01 Apr 2014 12:02:03 +0400", 1396339323 ),
+            ( "1 Apr 2014 12:02:03 +0400", 1396339323 ),
+            ( "Tuesday, 1 April 2014 08:02:03 GMT", 1396339323 ),
+            ( "Tue, 01 Apr 2014 04:02:03 EDT", 1396339323 ),
+            ( "Tue, 01 Apr 2014 08:02:03 +00:00 (UTC)", 1396339323 ),
+            ( "Tue, 01 Apr 2014 09:02 CET", 1396339320 ),
+            ( "Tue, 01 Apr 14 08:02:03 XYZ", 1396339323 ),
+            ( "01 Apr 2014 08:02:03", 1396339323 ),
+            ( "Thu, 01 Jan 1970 00:00:00 -0000", 0 ),
+            ( "Wed, 31 Dec 1969 23:59:59 +0000", -1 ),
+            ( "Tue, 29 Feb 2000 00:00:00 +0000", 951782400 ),
+            ( "01 Jan 99 00:00:00 +0000", 915148800 ),
+        ]:
+            self.assertEqual( parse_rfc2822( val ), expected, val )
+            self.assertEqual( parse_timestamp( val ), expected, val )
+
+        # test parsing invalid timestamps
+        for val in [
+            "", "foo", "Tue, 01 Apr", "Tue, 01 Foo 2014 12:02:03 +0400", "Tue, 32 Apr 2014 12:02:03 +0400",
+            "Tue, 31 Apr 2014 12:02:03 +0400", "Tue, 29 Feb 2100 00:00:00 +0000", "Tue, 01 Apr 2014 24:00:00 +0000",
+            "Tue, 01 Apr 2014 12:60 +0000", "Tue, 01 Apr 2014 12:02:03 +04", "Tue, 01 Apr 2014 12:02:03 ?",
+            "Tue, 01 Apr 20145 12:02:03", "Tue, 001 Apr 2014 12:02:03", "Tue, 01 Apr 2014 1:2:3:4",
+            "Tue, ² Apr 2014 12:02:03", None, 42, [ "Tue, 01 Apr 2014 12:02:03 +0400" ],
+        ]:
+            self.assertIsNone( parse_rfc2822( val ), val )
+            self.assertIsNone( parse_timestamp( val ), val )
+
+    def test_iso8601( self ):
+        """Test parsing ISO 8601 timestamps."""
+
+        # test parsing valid timestamps
+        for val, expected in [
+            ( "2014-04-01T08:02:03Z", 1396339323 ),
+            ( "2014-04-01T12:02:03+04:00", 1396339323 ),
+            ( "2014-04-01T05:32:03-0230", 1396339323 ),
+            ( "2014-04-01T10:02:03+02", 1396339323 ),
+            ( " 2014-04-01 08:02:03 ", 1396339323 ),
+            ( "2014-04-01t08:02:03z", 1396339323 ),
+            ( "2014-04-01T08:02Z", 1396339320 ),
+            ( "2014-04-01", 1396310400 ),
+            ( "2014-04-01T08:02:03.000Z", 1396339323 ),
+            ( "2014-04-01T08:02:03.25Z", 1396339323.25 ),
+        ]:
+            self.assertEqual( parse_iso8601( val ), expected, val )
+            self.assertEqual( parse_timestamp( val ), expected, val )
+        self.assertIsInstance( parse_iso8601( "2014-04-01T08:02:03.000Z" ), int )
+
+        # test parsing invalid timestamps
+        for val in [
+            "", "foo", "2014-13-01T00:00:00Z", "2014-02-29", "2014-04-01T24:00:00Z", "2014-04-01T08:02:03+4:00",
+            "2014-04-01T08:02:03 rubbish", "2014-4-1", "١٢٣٤-04-01", None, [ "2014-04-01" ],
+        ]:
+            self.assertIsNone( parse_iso8601( val ), val )
+            self.assertIsNone( parse_timestamp( val ), val )
+
+    def test_format( self ):
+        """Test formatting ISO 8601 timestamps."""
+        self.assertEqual( format_iso8601( 1396339323 ), "2014-04-01T08:02:03Z" )
+        self.assertEqual( format_iso8601( 1396339323.99 ), "2014-04-01T08:02:03Z" )
+        self.assertEqual( format_iso8601( 0 ), "1970-01-01T00:00:00Z" )
+        self.assertEqual( format_iso8601( -0.5 ), "1969-12-31T23:59:59Z" )
+        self.assertEqual( format_iso8601_batch( [ 951782400, 951868800.0 ] ),
+            [ "2000-02-29T00:00:00Z", "2000-03-01T00:00:00Z" ]
+        )
+        self.assertEqual( parse_timestamps( [ "2014-04-01", "foo", "01 Apr 2014 00:00 GMT" ] ),
+            [ 1396310400, None, 1396310400 ]
+        )
+
+    def test_random( self ):
+        """Test parsing and formatting random timestamps."""
+        rng = random.Random( 42 )
+        for _ in range( 2000 ):
+            tstamp = rng.randint( -2208988800, 4102444800 ) # nb: 1900-2100
+            tm = time.gmtime( tstamp )
+            self.assertEqual( format_iso8601( tstamp ), time.strftime( "%Y-%m-%dT%H:%M:%SZ", tm ) )
+            self.assertEqual( parse_iso8601( format_iso8601( tstamp ) ), tstamp )
+            self.assertEqual( calendar.timegm( tm ), tstamp )
+            tz_offset = rng.randint( -12*60, 14*60 )
+            dt = datetime.datetime.fromtimestamp( tstamp, datetime.timezone( datetime.timedelta( minutes=tz_offset ) ) )
+            self.assertEqual( parse_rfc2822( dt.strftime( "%d {} %Y %H:%M:%S %z" ).format(
+                list( _MONTHS )[ dt.month-1 ].title()
+            ) ), tstamp )
+            self.assertEqual( parse_iso8601( dt.isoformat() ), tstamp )
+
+# ---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    # a simple example
+    for _val in sys.argv[1:]:
+        _tstamp = parse_timestamp( _val )
+        print( "{} => {} ({})".format( _val, _tstamp, format_iso8601( _tstamp ) if _tstamp is not None else "-" ) )
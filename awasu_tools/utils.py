@@ -29,90 +29,293 @@
 
 import sys
 import os
+import io
 import re
+import math
 import time
-import datetime
-import calendar
-import xml.dom.minidom
+import mmap
 import xml.parsers.expat
+import tempfile
 import unittest
 
+from awasu_tools.timestamps import parse_rfc2822, parse_iso8601, format_iso8601
+from awasu_tools.stats import timed
+
+# NOTE: These are the characters that aren't allowed in XML 1.0.
+_INVALID_XML_CHARS_REGEX = re.compile( "[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]" )
+_INVALID_XML_BYTES = bytes( range( 0x00, 0x09 ) ) + b"\x0b\x0c" + bytes( range( 0x0e, 0x20 ) )
+
 # ---------------------------------------------------------------------
 
-def safe_xml( val ):
-    """Convert a value into something that's safe to insert into XML."""
+@timed( "safe_xml" )
+def safe_xml( val, strip_invalid=False ):
+    """Convert a value into something that's safe to insert into XML.
+
+    If strip_invalid is set, characters that aren't allowed in XML (e.g. most control characters)
+    are removed.
+    """
+    if type( val ) is not str: #pylint: disable=unidiomatic-typecheck
+        val = _to_str( val )
+    if strip_invalid:
+        val = _strip_invalid_xml_chars( val )
+    return _escape_xml( val )
+
+@timed( "safe_xml_batch" )
+def safe_xml_batch( vals, strip_invalid=False ):
+    """Convert a list of values into something that's safe to insert into XML.
+
+    This is faster than calling safe_xml() for each value, if there are a lot of them.
+    """
+    if strip_invalid:
+        vals = [ _strip_invalid_xml_chars( _to_str( v ) ) for v in vals ]
+    elif not isinstance( vals, list ):
+        vals = list( vals )
+    if len( vals ) <= 1:
+        return [ safe_xml( v ) for v in vals ]
+    # NOTE: We join the values together, escape them in one go, then split them up again.
+    # This only works if the separator doesn't appear in any of the values (it's not allowed
+    # in XML, so it normally won't).
+    try:
+        buf = "\x00".join( vals )
+    except TypeError:
+        # nb: some of the values are not strings
+        vals = [ _to_str( v ) for v in vals ]
+        buf = "\x00".join( vals )
+    if buf.count( "\x00" ) != len( vals ) - 1:
+        return [ safe_xml( v ) for v in vals ]
+    return _escape_xml( buf ).split( "\x00" )
+
+def _to_str( val ):
+    """Convert a value to a string (for safe_xml())."""
+    if type( val ) is str: #pylint: disable=unidiomatic-typecheck
+        return val
     if val is None:
         return ""
     if isinstance( val, bytes ):
-        val = val.encode( "utf-8" )
-    else:
-        val = str( val )
-    val = val.replace( "&", "&amp;" ).replace( "<", "&lt;" ).replace( ">", "&gt;" )
-    val = val.replace( "\"", "&quot;" ) # nb: in case the value is an attribute
+        return val.decode( "utf-8", errors="replace" )
+    return str( val )
+
+def _escape_xml( val ):
+    """Escape the special XML characters in a string."""
+    # NOTE: Checking for a character is much faster than replacing it, and most values
+    # don't contain all (or any) of these characters, so we only replace the ones that are there.
+    if "&" in val:
+        val = val.replace( "&", "&amp;" )
+    if "<" in val:
+        val = val.replace( "<", "&lt;" )
+    if ">" in val:
+        val = val.replace( ">", "&gt;" )
+    if "\"" in val:
+        val = val.replace( "\"", "&quot;" ) # nb: in case the value is an attribute
     return val
 
+def _strip_invalid_xml_chars( val ):
+    """Remove characters that aren't allowed in XML."""
+    if val.isascii():
+        # NOTE: This is much faster than using a regex.
+        buf = val.encode( "ascii" )
+        buf2 = buf.translate( None, _INVALID_XML_BYTES )
+        return val if len( buf2 ) == len( buf ) else buf2.decode( "ascii" )
+    return _INVALID_XML_CHARS_REGEX.sub( "", val )
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 def pretty_xml( val ):
     """Prettify XML."""
+    buf = io.StringIO()
+    if write_pretty_xml( val, buf ):
+        return buf.getvalue().rstrip( "\n" )
+    return buf.getvalue()
+
+def write_pretty_xml( src, out, indent="  ", chunk_size=1024*1024 ):
+    """Prettify XML, and write it to a stream.
+
+    src can be a string, bytes, or a file object. The XML is indented as it is parsed, so large documents
+    don't need to be loaded into memory. If the XML is invalid, it is written out verbatim (with a warning),
+    and False is returned. Note that if src or out can't be rewound (e.g. they are pipes), the XML read
+    and/or the output is held in memory, in case the XML is invalid.
+    """
+
+    # initialize
+    # NOTE: If the XML turns out to be invalid, we rewind the streams (if we can),
+    # so that we can write out the original XML. If we can't, we have to remember what we read
+    # from src, and hold on to the output until we know the XML is valid.
+    src_pos, out_pos = _tell( src ), _tell( out )
+    read_chunks = [] if src_pos is None and not isinstance( src, ( str, bytes ) ) else None
+    writer = _PrettyXmlWriter( indent )
+    parser = writer.make_parser()
+
+    # pretty-print the XML
+    if isinstance( src, ( str, bytes ) ):
+        chunks = ( src[ pos : pos+chunk_size ] for pos in range( 0, len(src), chunk_size ) )
+    else:
+        chunks = iter( lambda: src.read( chunk_size ), src.read( 0 ) )
     try:
-        # NOTE: We remove blank lines generated by toprettyxml() (because it preserves
-        # whitespace between XML tags).
-        buf = xml.dom.minidom.parseString( val ).toprettyxml( indent="  " )
-        lines = buf.split( "\n" )
-        if lines[0] == "<?xml version=\"1.0\" ?>":
-            del lines[0]
-        return "\n".join( x for x in lines if x.strip() )
+        for chunk in chunks:
+            if read_chunks is not None:
+                read_chunks.append( chunk )
+            parser.Parse( chunk, False )
+            if out_pos is not None:
+                out.write( "".join( writer.buf ) )
+                writer.buf.clear()
+        parser.Parse( b"", True )
+        out.write( "".join( writer.buf ) )
+        return True
     except xml.parsers.expat.ExpatError:
-        # NOTE: If the XML is invalid, we just return it verbatim.
-        return "*** WARNING: Invalid XML ***\n" + val
+        pass
+
+    # NOTE: If the XML is invalid, we just write it out verbatim.
+    def write_chunk( chunk ):
+        out.write( chunk.decode( "utf-8", errors="replace" ) if isinstance( chunk, bytes ) else chunk )
+    if out_pos is not None:
+        out.seek( out_pos )
+        out.truncate()
+    out.write( "*** WARNING: Invalid XML ***\n" )
+    if isinstance( src, ( str, bytes ) ):
+        write_chunk( src )
+        return False
+    if src_pos is not None:
+        src.seek( src_pos )
+    else:
+        # nb: we write out what we've already read, then the rest of the stream
+        write_chunk( src.read( 0 ).join( read_chunks ) )
+    for chunk in iter( lambda: src.read( chunk_size ), src.read( 0 ) ):
+        write_chunk( chunk )
+    return False
+
+class _PrettyXmlWriter:
+    """Generate pretty-printed XML from expat parser events."""
+
+    # NOTE: The output matches what minidom's toprettyxml() used to generate (with blank lines removed),
+    # except that text in mixed content is stripped, and CDATA sections are kept intact.
+
+    _BLANK_LINES_REGEX = re.compile( r"\n[^\S\n]*(?=\n)" )
+
+    def __init__( self, indent ):
+        self.buf = []
+        self._indent = indent
+        self._tags = [] # nb: the elements that are currently open
+        self._open_tag = False # nb: if the current element's start tag hasn't been closed yet
+        self._text = []
+        self._cdata = None
+
+    def make_parser( self ):
+        """Create an expat parser that will generate pretty-printed XML."""
+        parser = xml.parsers.expat.ParserCreate()
+        parser.ordered_attributes = True
+        parser.buffer_text = True
+        parser.buffer_size = 64 * 1024
+        parser.StartElementHandler = self._on_start_element
+        parser.EndElementHandler = self._on_end_element
+        parser.CharacterDataHandler = self._on_text
+        parser.StartCdataSectionHandler = self._on_start_cdata
+        parser.EndCdataSectionHandler = self._on_end_cdata
+        parser.CommentHandler = lambda data: self._write_node( "<!--{}-->".format( data ) )
+        parser.ProcessingInstructionHandler = lambda target, data: self._write_node(
+            "<?{} {}?>".format( target, data ) if data else "<?{}?>".format( target )
+        )
+        parser.StartDoctypeDeclHandler = self._on_doctype
+        return parser
+
+    def _on_start_element( self, tag, attrs ):
+        """Process the start of an element."""
+        self._start_child()
+        buf = self.buf
+        buf.append( self._indent * len(self._tags) + "<" + tag )
+        for i in range( 0, len(attrs), 2 ):
+            buf.append( " {}=\"{}\"".format( attrs[i], _escape_xml( attrs[i+1] ) ) )
+        self._tags.append( tag )
+        self._open_tag = True
+
+    def _on_end_element( self, tag ):
+        """Process the end of an element."""
+        if self._open_tag:
+            # NOTE: The element only contains text (if anything), so we put it all on one line.
+            text = "".join( self._text )
+            self._text.clear()
+            if text:
+                self.buf.append( ">{}</{}>\n".format( self._BLANK_LINES_REGEX.sub( "", text ), tag ) )
+            else:
+                self.buf.append( "/>\n" )
+            self._open_tag = False
+            self._tags.pop()
+        else:
+            self._start_child()
+            self._tags.pop()
+            self.buf.append( "{}</{}>\n".format( self._indent * len(self._tags), tag ) )
+
+    def _on_text( self, data ):
+        """Process text."""
+        if self._cdata is not None:
+            self._cdata.append( data )
+        else:
+            self._text.append( _escape_xml( data ) )
+
+    def _on_start_cdata( self ):
+        """Process the start of a CDATA section."""
+        self._cdata = []
+
+    def _on_end_cdata( self ):
+        """Process the end of a CDATA section."""
+        self._text.append( "<![CDATA[{}]]>".format( "".join( self._cdata ) ) )
+        self._cdata = None
+
+    def _on_doctype( self, name, system_id, public_id, has_internal_subset ): #pylint: disable=unused-argument
+        """Process a DOCTYPE declaration."""
+        if public_id:
+            self._write_node( "<!DOCTYPE {} PUBLIC \"{}\" \"{}\">".format( name, public_id, system_id ) )
+        elif system_id:
+            self._write_node( "<!DOCTYPE {} SYSTEM \"{}\">".format( name, system_id ) )
+        else:
+            self._write_node( "<!DOCTYPE {}>".format( name ) )
+
+    def _write_node( self, val ):
+        """Write out a node that goes on its own line."""
+        self._start_child()
+        self.buf.append( self._indent * len(self._tags) + val + "\n" )
+
+    def _start_child( self ):
+        """Prepare to write out a child of the current element."""
+        if self._open_tag:
+            self.buf.append( ">\n" )
+            self._open_tag = False
+        if self._text:
+            # NOTE: The current element contains both text and child nodes, so we put
+            # the text on its own line (whitespace between child nodes is ignored).
+            text = "".join( self._text ).strip()
+            self._text.clear()
+            if text:
+                self.buf.append( "{}{}\n".format(
+                    self._indent * len(self._tags), self._BLANK_LINES_REGEX.sub( "", text )
+                ) )
+
+def _tell( fp ):
+    """Get the current position of a stream (or None, if it's not seekable)."""
+    try:
+        return fp.tell() if fp.seekable() else None
+    except ( AttributeError, OSError ):
+        return None
 
 # ---------------------------------------------------------------------
 
 def parse_rfc2822_timestamp( tstamp ):
-    """Parse an RFC 2822 timestamp."""
-
-    # we sometimes get timestamps without the DOW :shrug:
-    if re.match( "[A-Za-z]{3}, ", tstamp ):
-        tstamp = tstamp[5:]
-
-    # parse the date
-    mo = re.match( "[0-9][0-9]?", tstamp ) # nb: we sometimes get single-digit dates :-/
-    if not mo:
-        return None # nb: we sometimes get weird rubbish :-/
-    date = int( mo.group() )
-    tstamp = tstamp[ mo.end()+1 : ]
-
-    # parse the rest of the timestamp
-    #   0----5----0----5----0----5
-    #   Apr 2014 15:07:51 +0000
-    # NOTE: We can't use strptime(), since it will look for month names
-    # using the current locale, but we need English.
-    month_names = {
-        "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
-        "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12
-    }
-    month = month_names[ tstamp[:3].lower() ]
-    year = int( tstamp[4:8] )
-    hours = int( tstamp[9:11] )
-    minutes = int( tstamp[12:14] )
-    seconds = int( tstamp[15:17] )
-    tstamp2 = datetime.datetime( year, month, date, hours, minutes, seconds )
-
-    # adjust for the time zone
-    if tstamp[18] in ( "+", "-" ):
-        tz_delta = 60 * int( tstamp[19:21] ) + int( tstamp[21:23] )
-        tz_delta *= -1 if tstamp[18] == "+" else +1
-        tstamp2 += datetime.timedelta( seconds=60*tz_delta )
-
-    return calendar.timegm( tstamp2.utctimetuple() )
+    """Parse an RFC 2822 timestamp (returns None if it's invalid)."""
+    return parse_rfc2822( tstamp )
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def parse_iso8601_timestamp( tstamp ):
+    """Parse an ISO 8601 timestamp (as used in Atom feeds)."""
+    # NOTE: Timestamps without a time zone are assumed to be UTC, and fractional seconds are dropped.
+    tstamp = parse_iso8601( tstamp )
+    return math.floor( tstamp ) if isinstance( tstamp, float ) else tstamp
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 def make_iso8601_timestamp( tstamp ):
     """Return an ISO 8601 timestamp (for Atom feeds)."""
-    if isinstance( tstamp, int ):
-        tstamp = time.gmtime( tstamp )
+    if isinstance( tstamp, ( int, float ) ):
+        return format_iso8601( tstamp )
     return "{year:4d}-{month:02d}-{date:02d}T{hours:02d}:{minutes:02d}:{seconds:02d}Z".format(
         year = tstamp.tm_year,
         month = tstamp.tm_mon,
@@ -134,29 +337,49 @@ def make_atom_text_type( mime_type ):
 
 # ---------------------------------------------------------------------
 
-def dump_bytes( buf, caption="", prefix="", out=sys.stdout ):
-    """Formatted byte dump."""
+def dump_bytes( buf, caption="", prefix="", out=sys.stdout, offset=0, length=None ):
+    """Formatted byte dump.
+
+    buf can be a string (which is dumped as UTF-8), or anything that supports the buffer protocol
+    (e.g. bytes, bytearray, memoryview, mmap). If offset and/or length are specified, only
+    that part of the buffer is dumped.
+    """
     if caption:
         print( caption, file=out ) # nb: no line prefix
-    # dump the value as bytes
-    for line_no in range( 0, int( (len(buf)+15) / 16 ) ):
-        print( "{}{:04x}: ".format( prefix, 16*line_no ), end="", file=out )
-        row_bytes = buf[ 16*line_no : 16*line_no+16 ]
-        line_buf = " ".join(
-            "{:02x}".format( ord(ch) )
-            for ch in row_bytes
-        )
+    if isinstance( buf, str ):
+        buf = buf.encode( "utf-8" )
+    # NOTE: We dump the buffer in chunks, without copying the whole thing.
+    with memoryview( buf ) as view, view.cast( "B" ) as view2:
+        end = len( view2 ) if length is None else min( offset + length, len(view2) )
+        for pos in range( offset, end, _DUMP_CHUNK_SIZE ):
+            chunk = view2[ pos : min( pos+_DUMP_CHUNK_SIZE, end ) ].tobytes()
+            out.write( _dump_rows( chunk, pos, prefix ) )
+
+def dump_file( fname, caption="", prefix="", out=sys.stdout, offset=0, length=None ):
+    """Formatted byte dump of a file."""
+    with open( fname, "rb" ) as fp:
+        if os.fstat( fp.fileno() ).st_size == 0:
+            # nb: empty files can't be mmap'ed
+            dump_bytes( b"", caption=caption, prefix=prefix, out=out )
+            return
+        # NOTE: Pages of the file are only read in as they are dumped.
+        with mmap.mmap( fp.fileno(), 0, access=mmap.ACCESS_READ ) as mem:
+            dump_bytes( mem, caption=caption, prefix=prefix, out=out, offset=offset, length=length )
+
+_DUMP_CHUNK_SIZE = 64 * 1024 # nb: this must be a multiple of 16
+_DUMP_CHARS = bytes( ch if 32 <= ch < 127 else ord(".") for ch in range( 256 ) )
+
+def _dump_rows( chunk, pos, prefix ):
+    """Format a chunk of a byte dump."""
+    hex_buf = chunk.hex( " " )
+    chars = chunk.translate( _DUMP_CHARS ).decode( "ascii" )
+    lines = []
+    for i in range( 0, len(chunk), 16 ):
+        line_buf = hex_buf[ 3*i : 3*i+47 ]
         if len( line_buf ) > 23: # nb: 23 = 8 hex values (2 digits each), plus 7 separators
             line_buf = "{} {}".format( line_buf[:23], line_buf[23:] )
-        line_buf += " " * (48 - len(line_buf))
-        print( line_buf, end="", file=out )
-        print(
-            " | " + "".join(
-                ch if 32 <= ord(ch) < 127 else "."
-                for ch in row_bytes
-            ),
-            file=out
-        )
+        lines.append( "{}{:04x}: {:<48} | {}\n".format( prefix, pos+i, line_buf, chars[ i : i+16 ] ) )
+    return "".join( lines )
 
 # ---------------------------------------------------------------------
 
@@ -176,7 +399,145 @@ class UtilsTestCase( unittest.TestCase ):
 
     def test_safe_xml( self ):
         """Test making strings safe for inclusion in XML."""
+
+        # test escaping values
         self.assertEqual( safe_xml('foo="<bar>"'), "foo=&quot;&lt;bar&gt;&quot;" )
+        self.assertEqual( safe_xml( "a && b > c" ), "a &amp;&amp; b &gt; c" )
+        self.assertEqual( safe_xml( "&lt;" ), "&amp;lt;" )
+        val = "plain text (\u65e5\u672c)"
+        self.assertIs( safe_xml( val ), val )
+        self.assertEqual( safe_xml( None ), "" )
+        self.assertEqual( safe_xml( 42 ), "42" )
+        self.assertEqual( safe_xml( "<\u65e5\u672c>".encode( "utf-8" ) ), "&lt;\u65e5\u672c&gt;" )
+        self.assertEqual( safe_xml( b"bad \xff" ), "bad \ufffd" )
+
+        # test removing invalid characters
+        val = "a\x00b\x08c\td\ne\x0bf\x0c\rg\x1fh"
+        self.assertEqual( safe_xml( val ), val )
+        self.assertEqual( safe_xml( val, strip_invalid=True ), "abc\td\nef\rgh" )
+        self.assertEqual( safe_xml( "<\u65e5\x01\ud800\ufffe\uffff\U0001f600>", strip_invalid=True ),
+            "&lt;\u65e5\U0001f600&gt;"
+        )
+
+        # test escaping values in a batch
+        vals = [ 'foo="<bar>"', None, 42, b"<\xe6\x97\xa5>", "", "a\x00&b", "x\x01y" ]
+        self.assertEqual( safe_xml_batch( vals ), [ safe_xml( v ) for v in vals ] )
+        self.assertEqual( safe_xml_batch( vals[:5] ), [ safe_xml( v ) for v in vals[:5] ] )
+        self.assertEqual( safe_xml_batch( vals, strip_invalid=True ),
+            [ safe_xml( v, strip_invalid=True ) for v in vals ]
+        )
+        self.assertEqual( safe_xml_batch( [] ), [] )
+        self.assertEqual( safe_xml_batch( [ "<" ] ), [ "&lt;" ] )
+
+    def test_pretty_xml( self ):
+        """Test pretty-printing XML."""
+
+        # test pretty-printing XML
+        val = "<?xml version=\"1.0\"?>\n<!-- comment --><feed a=\"1&amp;2\"><title>Test &lt;feed&gt;</title>" \
+              "<empty/><content>\n  line 1\n\n  line 2\n</content>\n  <mixed>text <b>bold</b> <![CDATA[<i>]]></mixed>" \
+              "<?pi data?></feed>"
+        expected = "\n".join( [
+            "<!-- comment -->",
+            "<feed a=\"1&amp;2\">",
+            "  <title>Test &lt;feed&gt;</title>",
+            "  <empty/>",
+            "  <content>",
+            "  line 1",
+            "  line 2",
+            "</content>",
+            "  <mixed>",
+            "    text",
+            "    <b>bold</b>",
+            "    <![CDATA[<i>]]>",
+            "  </mixed>",
+            "  <?pi data?>",
+            "</feed>",
+        ] )
+        self.assertEqual( pretty_xml( val ), expected )
+        self.assertEqual( pretty_xml( val.encode( "utf-8" ) ), expected )
+
+        # test pretty-printing XML from a stream, in small chunks
+        for chunk_size in ( 1, 7, 100 ):
+            buf = io.StringIO()
+            self.assertTrue( write_pretty_xml( io.BytesIO( val.encode( "utf-8" ) ), buf, chunk_size=chunk_size ) )
+            self.assertEqual( buf.getvalue(), expected + "\n" )
+        buf = io.StringIO()
+        self.assertTrue( write_pretty_xml( io.StringIO( "<a>\u65e5\u672c</a>" ), buf, indent="\t", chunk_size=2 ) )
+        self.assertEqual( buf.getvalue(), "<a>\u65e5\u672c</a>\n" )
+
+        # test pretty-printing invalid XML
+        val = "<feed><title>Test</title><entry>" + "<item/>" * 100
+        self.assertEqual( pretty_xml( val ), "*** WARNING: Invalid XML ***\n" + val )
+        self.assertEqual( pretty_xml( "" ), "*** WARNING: Invalid XML ***\n" )
+        buf = io.StringIO( "Header\n" )
+        buf.seek( 0, io.SEEK_END )
+        self.assertFalse( write_pretty_xml( io.StringIO( val ), buf, chunk_size=10 ) )
+        self.assertEqual( buf.getvalue(), "Header\n*** WARNING: Invalid XML ***\n" + val )
+
+        # test pretty-printing XML from/to streams that can't be rewound
+        class UnseekableStringIO( io.StringIO ):
+            """A StringIO that can't be rewound (like a pipe)."""
+            def seekable( self ):
+                return False
+        for xml_val, expected_val in (
+            ( val, "*** WARNING: Invalid XML ***\n" + val ),
+            ( "<a><b>ok</b></a>", "<a>\n  <b>ok</b>\n</a>\n" ),
+        ):
+            fd_in, fd_out = os.pipe()
+            with open( fd_out, "wb" ) as fp:
+                fp.write( xml_val.encode( "utf-8" ) )
+            with open( fd_in, "rb" ) as fp:
+                buf = UnseekableStringIO()
+                self.assertEqual( write_pretty_xml( fp, buf, chunk_size=8 ), xml_val != val )
+            self.assertEqual( buf.getvalue(), expected_val )
+
+    def test_dump_bytes( self ):
+        """Test dumping bytes."""
+
+        def dump( buf, **kwargs ):
+            out = io.StringIO()
+            dump_bytes( buf, out=out, **kwargs )
+            return out.getvalue()
+
+        # test dumping bytes
+        buf = b"Hello, world!\x00\x01\x02\xff\x7f\x80 12345678"
+        expected = "\n".join( [
+            "Bytes:",
+            ">>> 0000: 48 65 6c 6c 6f 2c 20 77  6f 72 6c 64 21 00 01 02 | Hello, world!...",
+            ">>> 0010: ff 7f 80 20 31 32 33 34  35 36 37 38             | ... 12345678",
+            "",
+        ] )
+        for val in ( buf, bytearray( buf ), memoryview( buf ) ):
+            self.assertEqual( dump( val, caption="Bytes:", prefix=">>> " ), expected )
+        self.assertEqual( dump( "\u65e5" ), "0000: e6 97 a5{} | ...\n".format( " " * 40 ) )
+        self.assertEqual( dump( b"12345678" ), "0000: 31 32 33 34 35 36 37 38{} | 12345678\n".format( " " * 25 ) )
+        self.assertEqual( dump( b"" ), "" )
+
+        # test dumping part of a buffer
+        self.assertEqual( dump( buf, offset=20, length=4 ), "0014: 31 32 33 34{} | 1234\n".format( " " * 37 ) )
+        self.assertEqual( dump( buf, offset=16 ), expected.split( "\n" )[2][4:] + "\n" )
+        self.assertEqual( dump( buf, offset=100 ), "" )
+        buf = bytes( range( 256 ) ) * 1000
+        lines = dump( buf, offset=70000, length=40 ).split( "\n" )
+        self.assertEqual( [ line[:6] for line in lines ], [ "11170:", "11180:", "11190:", "" ] )
+        self.assertEqual( lines[2], "11190: 90 91 92 93 94 95 96 97{} | ........".format( " " * 25 ) )
+
+        # test dumping a file
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fname = os.path.join( temp_dir, "test.bin" )
+            with open( fname, "wb" ) as fp:
+                fp.write( buf )
+            out = io.StringIO()
+            dump_file( fname, caption="File:", out=out )
+            self.assertEqual( out.getvalue(), "File:\n" + dump( buf ) )
+            out = io.StringIO()
+            dump_file( fname, out=out, offset=70000, length=40 )
+            self.assertEqual( out.getvalue(), "\n".join( lines ) )
+            with open( fname, "wb" ) as fp:
+                pass
+            out = io.StringIO()
+            dump_file( fname, out=out )
+            self.assertEqual( out.getvalue(), "" )
 
     def test_rfc2822_timestamps( self ):
         """Test parsing RFC 2822 timestamps."""
@@ -186,9 +547,25 @@ class UtilsTestCase( unittest.TestCase ):
         self.assertEqual( parse_rfc2822_timestamp( "1 Apr 2014 12:02:03 +0400" ),
             1396339323
         )
+        self.assertEqual( parse_rfc2822_timestamp( "Tue, 01 Apr 2014 04:02:03 EDT" ),
+            1396339323
+        )
         self.assertEqual( parse_rfc2822_timestamp( "foo" ),
             None
         )
+        self.assertEqual( parse_rfc2822_timestamp( "Tue, 31 Apr 2014 12:02:03 +0400" ),
+            None
+        )
+
+    def test_parse_iso8601_timestamp( self ):
+        """Test parsing ISO 8601 timestamps."""
+        self.assertEqual( parse_iso8601_timestamp( "2014-04-01T08:02:03Z" ), 1396339323 )
+        self.assertEqual( parse_iso8601_timestamp( "2014-04-01T12:02:03+04:00" ), 1396339323 )
+        self.assertEqual( parse_iso8601_timestamp( "2014-04-01T05:32:03.123-0230" ), 1396339323 )
+        self.assertEqual( parse_iso8601_timestamp( " 2014-04-01 08:02:03 " ), 1396339323 )
+        self.assertEqual( parse_iso8601_timestamp( "2014-04-01" ), 1396310400 )
+        self.assertEqual( parse_iso8601_timestamp( "2014-13-01T00:00:00Z" ), None )
+        self.assertEqual( parse_iso8601_timestamp( "foo" ), None )
 
     def test_iso8601_timestamp( self ):
         """Test creating ISO 8601 timestamps."""
@@ -196,6 +573,8 @@ class UtilsTestCase( unittest.TestCase ):
             make_iso8601_timestamp( time.struct_time( ( 2001, 2, 3, 4, 5, 6, 0,1,0 ) ) ),
             "2001-02-03T04:05:06Z"
         )
+        self.assertEqual( make_iso8601_timestamp( 1396339323 ), "2014-04-01T08:02:03Z" )
+        self.assertEqual( make_iso8601_timestamp( 1396339323.5 ), "2014-04-01T08:02:03Z" )
 
 # ---------------------------------------------------------------------
 
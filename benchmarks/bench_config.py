@@ -0,0 +1,228 @@
+""" Benchmark ConfigFile. """
+
+# COPYRIGHT:   (c) Awasu Pty. Ltd. 2015 (all rights reserved).
+#              Unauthorized use of this code is prohibited.
+#
+# LICENSE:     This software is provided 'as-is', without any express
+#              or implied warranty.
+#
+#              In no event will the author be held liable for any damages
+#              arising from the use of this software.
+#
+#              Permission is granted to anyone to use this software
+#              for any purpose, and to alter it and redistribute it freely,
+#              subject to the following restrictions:
+#
+#              - The origin of this software must not be misrepresented;
+#                you must not claim that you wrote the original software.
+#                If you use this software, an acknowledgement is requested
+#                but not required.
+#
+#              - Altered source versions must be plainly marked as such,
+#                and must not be misrepresented as being the original software.
+#                Altered source is encouraged to be submitted back to
+#                the original author so it can be shared with the community.
+#                Please share your changes.
+#
+#              - This notice may not be removed or altered from any
+#                source distribution.
+
+import sys
+import os
+import io
+import re
+import time
+import random
+import tempfile
+import tracemalloc
+
+sys.path.insert( 0, os.path.join( os.path.split(__file__)[0], ".." ) )
+#pylint: disable=wrong-import-position
+from awasu_tools.config import ConfigFile, ConfigSchema, ConfigKey, IndirectFileCache
+
+# ---------------------------------------------------------------------
+
+def make_item_sections( nitems, content_size ):
+    """Generate a config file containing feed item sections."""
+    rng = random.Random( 42 )
+    buf = []
+    for item_no in range( 1, nitems+1 ):
+        content = "".join(
+            rng.choice( "abcdefghij <>&=%0A%3D" ) for _ in range( content_size // 4 )
+        ) * 4
+        buf.append( "[Item {}]".format( item_no ) )
+        buf.append( "Title = Item #{}%0A*1".format( item_no ) )
+        buf.append( "Url = http://test.com/item{}".format( item_no ) )
+        buf.append( "Content = {}%0A*2".format( content ) )
+        for tag_no in range( 1, 6 ):
+            buf.append( "{0} = tag{0}".format( tag_no ) )
+        buf.append( "" )
+    return "\n".join( buf )
+
+def make_config_file( fname, size ):
+    """Generate a config file of (approximately) the specified size."""
+    section_buf = make_item_sections( 100, 1000 )
+    nlines = section_buf.count( "\n" ) + 1
+    nrepeats = max( size // len(section_buf), 1 )
+    with open( fname, "w", encoding="utf-8" ) as fp:
+        for _ in range( nrepeats ):
+            fp.write( section_buf )
+            fp.write( "\n" )
+    return nlines * nrepeats
+
+def legacy_parse( fname ):
+    """Parse a config file the way ConfigFile used to."""
+    with open( fname, "r", encoding="utf-8" ) as fp:
+        buf = fp.read()
+    sections = {}
+    curr_section_name = None
+    for line_buf in io.StringIO( buf ):
+        line_buf = line_buf.strip()
+        if not line_buf or line_buf.startswith( ( "#", ";", "'" ) ):
+            continue
+        mo = re.search( r"^\[\s*([^]]+)\s*\]", line_buf )
+        if mo:
+            curr_section_name = mo.group(1).strip().lower()
+            sections[ curr_section_name ] = {}
+            continue
+        mo = re.search( r"([^[=]+)\s*=", line_buf )
+        if mo and curr_section_name:
+            key = mo.group( 1 ).strip().lower()
+            sections[ curr_section_name ][ key ] = line_buf[ mo.end(0) : ].strip()
+    return sections
+
+# ---------------------------------------------------------------------
+
+def bench_parse( sizes ):
+    """Time parsing config files of different sizes."""
+
+    def run( parse, fname, nlines ):
+        # time the parse
+        start_time = time.perf_counter()
+        parse( fname )
+        elapsed = time.perf_counter() - start_time
+        # measure peak memory usage (separately, since tracemalloc slows things down)
+        tracemalloc.start()
+        parse( fname )
+        peak_mem = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print( "  - {:<8} {:7.3f}s {:>12,.0f} lines/sec   peak memory: {:7.1f} MB".format(
+            parse.__name__+":", elapsed, nlines/elapsed, peak_mem/(1024*1024)
+        ) )
+
+    def legacy( fname ):
+        legacy_parse( fname )
+    def eager( fname ):
+        ConfigFile( fname )
+    def lazy( fname ):
+        ConfigFile( fname, lazy=True ).close()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in sizes:
+            fname = os.path.join( temp_dir, "bench.ini" )
+            nlines = make_config_file( fname, size*1024*1024 )
+            print( "Parsing a {} MB config file ({:,} lines):".format( size, nlines ) )
+            for parse in ( legacy, eager, lazy ):
+                run( parse, fname, nlines )
+
+def bench_cache( sizes ):
+    """Time loading config files with and without a parse cache."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in sizes:
+            fname = os.path.join( temp_dir, "bench.ini" )
+            make_config_file( fname, size*1024*1024 )
+            print( "Loading a {} MB config file:".format( size ) )
+            for caption in ( "no cache", "cold", "warm" ):
+                start_time = time.perf_counter()
+                ConfigFile( fname, cache = temp_dir if caption != "no cache" else None )
+                print( "  - {:<9} {:.3f}s".format( caption+":", time.perf_counter() - start_time ) )
+            for fname in os.listdir( temp_dir ):
+                os.unlink( os.path.join( temp_dir, fname ) )
+
+# ---------------------------------------------------------------------
+
+def bench_repeated_lookups( nitems=200, content_size=4000, npasses=20 ):
+    """Time repeated lookups of the same values, with and without the decoded-value cache."""
+
+    config_file = ConfigFile( make_item_sections( nitems, content_size ) )
+
+    def do_pass():
+        for item_no in range( 1, nitems+1 ):
+            section = "Item {}".format( item_no )
+            config_file.get_textval( section, "Title" )
+            config_file.get_string( section, "Url" )
+            config_file.get_textval( section, "Content" )
+            config_file.get_string_list( section )
+
+    def run( clear_cache ):
+        start_time = time.perf_counter()
+        for _ in range( npasses ):
+            if clear_cache:
+                config_file._decoded_vals.clear() #pylint: disable=protected-access
+            do_pass()
+        return time.perf_counter() - start_time
+
+    uncached = run( True )
+    cached = run( False )
+    print( "Repeated lookups ({} items x {} passes):".format( nitems, npasses ) )
+    print( "- uncached: {:.3f}s".format( uncached ) )
+    print( "- cached:   {:.3f}s ({:.1f}x)".format( cached, uncached/cached ) )
+
+# ---------------------------------------------------------------------
+
+def bench_get_values( nitems=200, npasses=20 ):
+    """Time reading item sections using a ConfigSchema, vs. one key at a time."""
+
+    config_file = ConfigFile( make_item_sections( nitems, 400 ) )
+    schema = ConfigSchema(
+        ConfigKey( "title", textval=True ),
+        ConfigKey( "url" ),
+        ConfigKey( "content", textval=True ),
+        ConfigKey( "tags", list ),
+    )
+    section_names = [ "Item {}".format( item_no ) for item_no in range( 1, nitems+1 ) ]
+
+    def by_key():
+        for section in section_names:
+            config_file.get_textval( section, "Title" )
+            config_file.get_string( section, "Url" )
+            config_file.get_textval( section, "Content" )
+            config_file.get_string_list( section )
+    def by_schema():
+        for section in section_names:
+            config_file.get_values( section, schema )
+
+    print( "Reading item sections ({} items x {} passes):".format( nitems, npasses ) )
+    for func in ( by_key, by_schema ):
+        start_time = time.perf_counter()
+        for _ in range( npasses ):
+            func()
+        print( "- {:<10} {:.3f}s".format( func.__name__+":", time.perf_counter() - start_time ) )
+
+# ---------------------------------------------------------------------
+
+def bench_indirect( size=1, nlookups=200 ):
+    """Time repeated lookups of a string value from a file."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = os.path.join( temp_dir, "template.html" )
+        with open( fname, "w", encoding="utf-8" ) as fp:
+            fp.write( "<p>Some HTML.</p>\n" * ( size*1024*1024 // 18 ) )
+        config_file = ConfigFile( "[Templates]\nItem = {}\n".format( fname ) )
+        print( "Indirect lookups of a {} MB file (x {}):".format( size, nlookups ) )
+        for caption, max_bytes in ( ( "uncached", 0 ), ( "cached", 32*1024*1024 ) ):
+            config_file.indirect_cache = IndirectFileCache( max_bytes )
+            start_time = time.perf_counter()
+            for _ in range( nlookups ):
+                config_file.get_string_indirect( "Templates", "Item" )
+            print( "- {:<9} {:.3f}s".format( caption+":", time.perf_counter() - start_time ) )
+
+# ---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    # NOTE: Config file sizes (in MB) can be specified on the command line.
+    _sizes = [ int(arg) for arg in sys.argv[1:] ] or [ 1, 10, 100 ]
+    bench_parse( _sizes )
+    bench_cache( _sizes )
+    bench_repeated_lookups()
+    bench_get_values()
+    bench_indirect()
@@ -0,0 +1,316 @@
+""" Benchmark feed generation. """
+
+# COPYRIGHT:   (c) Awasu Pty. Ltd. 2015 (all rights reserved).
+#              Unauthorized use of this code is prohibited.
+#
+# LICENSE:     This software is provided 'as-is', without any express
+#              or implied warranty.
+#
+#              In no event will the author be held liable for any damages
+#              arising from the use of this software.
+#
+#              Permission is granted to anyone to use this software
+#              for any purpose, and to alter it and redistribute it freely,
+#              subject to the following restrictions:
+#
+#              - The origin of this software must not be misrepresented;
+#                you must not claim that you wrote the original software.
+#                If you use this software, an acknowledgement is requested
+#                but not required.
+#
+#              - Altered source versions must be plainly marked as such,
+#                and must not be misrepresented as being the original software.
+#                Altered source is encouraged to be submitted back to
+#                the original author so it can be shared with the community.
+#                Please share your changes.
+#
+#              - This notice may not be removed or altered from any
+#                source distribution.
+
+import sys
+import os
+import time
+import random
+import tempfile
+import tracemalloc
+
+sys.path.insert( 0, os.path.join( os.path.split(__file__)[0], ".." ) )
+#pylint: disable=wrong-import-position
+from awasu_tools.feed import Feed, FeedItem, FeedItemBatch, FeedItemLogger, NewestFeedItems, RenderCache, \
+    merge_feed_items, _format_time
+from awasu_tools.log import init_logging, flush_logging, close_logging
+from awasu_tools.utils import safe_xml
+
+# ---------------------------------------------------------------------
+
+CUSTOM_ITEM_TEMPL = """<entry>""" \
+                    """<title type="text">{title}</title>""" \
+                    """<link href="{url}" />""" \
+                    """<author><name>{author}</name></author>""" \
+                    """<content type="html">{content}</content>""" \
+                    """</entry>"""
+
+def make_feed( nitems, templ=None ):
+    """Generate a feed."""
+    feed = Feed( "Benchmark feed", "http://test.com" )
+    for item_no in range( nitems ):
+        feed.feed_items.append( FeedItem(
+            "Item #{} & co.".format( item_no ),
+            "http://test.com/item?id={}&x=1".format( item_no ),
+            "<p>Some <b>HTML</b> content for item #{}.</p>".format( item_no ) * 10,
+            1500000000.0 + item_no,
+            templ = templ,
+            extra_args = { "author": "Joe Bloggs", "category": "News", "guid": str(item_no) }
+        ) )
+    return feed
+
+def legacy_get_xml( feed_item ):
+    """Generate the feed item XML the way FeedItem used to."""
+    if feed_item.templ:
+        templ = feed_item.templ
+    else:
+        templ = """<entry>""" \
+                """<title type="text">{title}</title>""" \
+                """<link href="{url}" />""" \
+                """<updated>{updated_time}</updated>""" \
+                """<content type="html">{content}</content>""" \
+                """</entry>"""
+    args = {
+        "title": feed_item.title,
+        "url": feed_item.url,
+        "updated_time": _format_time( feed_item.updated_time ),
+        "content": feed_item.content,
+    }
+    if feed_item.extra_args:
+        args.update( feed_item.extra_args )
+    args = {
+        k: safe_xml( v ) if v is not None else ""
+        for k, v in args.items()
+    }
+    return templ.format( **args )
+
+# ---------------------------------------------------------------------
+
+def bench_render( nitems=20000 ):
+    """Time rendering feed items."""
+    for caption, templ in ( ( "default", None ), ( "custom", CUSTOM_ITEM_TEMPL ) ):
+        feed = make_feed( nitems, templ )
+        print( "Rendering {} items ({} template):".format( nitems, caption ) )
+        for func in ( legacy_get_xml, FeedItem.get_xml ):
+            start_time = time.perf_counter()
+            for feed_item in feed.feed_items:
+                func( feed_item )
+            elapsed = time.perf_counter() - start_time
+            print( "- {:<16} {:.3f}s {:>10,.0f} items/sec".format(
+                func.__name__+":", elapsed, nitems/elapsed
+            ) )
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def bench_parallel( nitems=50000 ):
+    """Time rendering a feed with different numbers of workers."""
+    feed = make_feed( nitems, CUSTOM_ITEM_TEMPL )
+    print( "Rendering a feed with {} items:".format( nitems ) )
+    start_time = time.perf_counter()
+    expected = feed.get_xml()
+    serial_elapsed = time.perf_counter() - start_time
+    print( "- serial:           {:.3f}s".format( serial_elapsed ) )
+    for use_processes in ( False, True ):
+        for workers in range( 1, (os.cpu_count() or 1) + 1 ):
+            start_time = time.perf_counter()
+            xml = feed.get_xml( workers=workers, use_processes=use_processes )
+            elapsed = time.perf_counter() - start_time
+            assert xml == expected
+            print( "- {:<10} x{:<4} {:.3f}s (x{:.2f})".format(
+                "processes:" if use_processes else "threads:", workers,
+                elapsed, serial_elapsed/elapsed
+            ) )
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def bench_render_cache( nitems=20000 ):
+    """Time rendering a feed, with and without a render cache."""
+    print( "Rendering a feed with {} items (render cache):".format( nitems ) )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = os.path.join( temp_dir, "render.cache" )
+        for caption in ( "no cache", "cold cache", "warm cache", "10% changed" ):
+            # NOTE: Each run uses a new RenderCache, the same as a new process would.
+            feed = make_feed( nitems, CUSTOM_ITEM_TEMPL )
+            if caption == "no cache":
+                render_cache = None
+            else:
+                render_cache = RenderCache( fname )
+            if caption == "10% changed":
+                for feed_item in feed.feed_items[ ::10 ]:
+                    feed_item.content += " (changed)"
+            feed.render_cache = render_cache
+            start_time = time.perf_counter()
+            feed.get_xml()
+            elapsed = time.perf_counter() - start_time
+            print( "- {:<16} {:.3f}s {:>10,.0f} items/sec".format(
+                caption+":", elapsed, nitems/elapsed
+            ) )
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+class LegacyFeedItem: #pylint: disable=too-few-public-methods
+    """A feed item, stored the way FeedItem used to be (with a __dict__)."""
+    def __init__( self, title, url, content=None, updated_time=None, templ=None, extra_args=None ):
+        self.title = title
+        self.url = url
+        self.content = content
+        self.updated_time = updated_time
+        self.templ = templ
+        self.extra_args = extra_args
+
+def bench_memory( nitems=200000 ):
+    """Measure how much memory is used to store feed items."""
+    def add_items( add ):
+        for item_no in range( nitems ):
+            # NOTE: We generate new strings for each feed item, the same as a scraper would.
+            add(
+                "Item #{}".format( item_no ),
+                "http://test.com/item?id={}".format( item_no ),
+                "Content for item #{}.".format( item_no ),
+                1500000000.0 + item_no,
+                "".join( CUSTOM_ITEM_TEMPL ),
+                { "author": "Author #{}".format( item_no % 10 ), "category": "News".lower() }
+            )
+    def make_list( item_class ):
+        feed_items = []
+        add_items( lambda *args: feed_items.append( item_class( *args ) ) )
+        return feed_items
+    def make_batch():
+        batch = FeedItemBatch()
+        add_items( batch.add )
+        return batch
+    print( "Storing {} feed items:".format( nitems ) )
+    baseline = None
+    for caption, func in [
+        ( "legacy", lambda: make_list( LegacyFeedItem ) ),
+        ( "FeedItem", lambda: make_list( FeedItem ) ),
+        ( "FeedItemBatch", make_batch ),
+    ]:
+        tracemalloc.start()
+        feed_items = func()
+        nbytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del feed_items
+        if baseline is None:
+            baseline = nbytes
+        print( "- {:<16} {:>7.1f} MB {:>6.0f} bytes/item ({:.0%})".format(
+            caption+":", nbytes/1024/1024, nbytes/nitems, nbytes/baseline
+        ) )
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def bench_newest( ncandidates=500000, max_items=100 ):
+    """Time selecting the newest feed items."""
+    def make_candidates():
+        rng = random.Random( 42 )
+        for item_no in range( ncandidates ):
+            yield FeedItem( "Item #{}".format( item_no ), None, None, 1500000000.0 + rng.random()*1e6 )
+    print( "Selecting the newest {} of {} feed items:".format( max_items, ncandidates ) )
+    def sort_and_slice():
+        feed_items = list( make_candidates() )
+        feed_items.sort( key = lambda f: f.updated_time, reverse=True )
+        return feed_items[ :max_items ]
+    def newest_feed_items():
+        return list( NewestFeedItems( max_items, make_candidates() ) )
+    for func in ( sort_and_slice, newest_feed_items ):
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start_time
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print( "- {:<18} {:.3f}s  peak {:>6.1f} MB".format( func.__name__+":", elapsed, peak/1024/1024 ) )
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def bench_merge( nsources=50, nitems=10000, limit=100 ):
+    """Time merging feed items from several sources."""
+    rng = random.Random( 42 )
+    sources = []
+    for source_no in range( nsources ):
+        feed_items = [
+            FeedItem( "Item #{}".format( item_no ),
+                # nb: some feed items appear in more than one source
+                "http://test.com/item?id={}".format( item_no if rng.random() < 0.1 else (source_no, item_no) ),
+                None, 1500000000.0 + item_no + rng.random()
+            )
+            for item_no in range( nitems )
+        ]
+        feed_items.reverse() # nb: newest first
+        sources.append( feed_items )
+    print( "Merging {} sources with {} feed items each:".format( nsources, nitems ) )
+    def sort_and_dedupe( limit ):
+        feed_items = [ f for source in sources for f in source ]
+        feed_items.sort( key = lambda f: f.updated_time, reverse=True )
+        seen, merged = set(), []
+        for feed_item in feed_items:
+            if feed_item.url not in seen:
+                seen.add( feed_item.url )
+                merged.append( feed_item )
+        return merged[ :limit ]
+    def merge( limit ):
+        return list( merge_feed_items( *sources, limit=limit ) )
+    for caption, limit2 in ( ( "all", None ), ( "first {}".format( limit ), limit ) ):
+        for func in ( sort_and_dedupe, merge ):
+            start_time = time.perf_counter()
+            func( limit2 )
+            elapsed = time.perf_counter() - start_time
+            print( "- {:<22} {:.3f}s".format( "{} ({}):".format( func.__name__, caption ), elapsed ) )
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def bench_logging( nitems=2000 ):
+    """Time rendering a feed with logging enabled."""
+    # NOTE: This enables logging, so it must be run last.
+    feed = make_feed( nitems, CUSTOM_ITEM_TEMPL )
+    print( "Rendering a feed with {} items (logging):".format( nitems ) )
+    def run( caption, log ):
+        start_time = time.perf_counter()
+        feed.get_xml( log=log )
+        elapsed = time.perf_counter() - start_time
+        print( "- {:<22} {:.3f}s {:>10,.0f} items/sec".format( caption+":", elapsed, nitems/elapsed ) )
+        if isinstance( log, FeedItemLogger ):
+            log.flush()
+        flush_logging()
+    run( "no logging", None )
+    run( "logging disabled", True )
+    init_logging( os.devnull )
+    run( "log everything", True )
+    run( "first 10", FeedItemLogger( first=10 ) )
+    run( "every 100th", FeedItemLogger( every=100 ) )
+    run( "not pretty", FeedItemLogger( pretty=False ) )
+    run( "truncated, not pretty", FeedItemLogger( max_val_len=80, pretty=False ) )
+    run( "background", FeedItemLogger( background=True ) )
+    # NOTE: Writing to a real log file is more expensive, since it gets flushed after every message
+    # (unless the log messages are written in the background).
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for caption, kwargs in [
+            ( "log file", {} ),
+            ( "log file (background)", { "background": True } ),
+            ( "log file (rotated)", { "background": True, "max_size": 1024*1024 } ),
+        ]:
+            init_logging( os.path.join( temp_dir, "bench.log" ), **kwargs )
+            run( caption, FeedItemLogger( pretty=False ) )
+            close_logging()
+
+# ---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    bench_render()
+    print()
+    bench_parallel()
+    print()
+    bench_render_cache()
+    print()
+    bench_memory()
+    print()
+    bench_newest()
+    print()
+    bench_merge()
+    print()
+    bench_logging()
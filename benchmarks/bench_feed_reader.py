@@ -0,0 +1,132 @@
+""" Benchmark FeedReader. """
+
+# COPYRIGHT:   (c) Awasu Pty. Ltd. 2015 (all rights reserved).
+#              Unauthorized use of this code is prohibited.
+#
+# LICENSE:     This software is provided 'as-is', without any express
+#              or implied warranty.
+#
+#              In no event will the author be held liable for any damages
+#              arising from the use of this software.
+#
+#              Permission is granted to anyone to use this software
+#              for any purpose, and to alter it and redistribute it freely,
+#              subject to the following restrictions:
+#
+#              - The origin of this software must not be misrepresented;
+#                you must not claim that you wrote the original software.
+#                If you use this software, an acknowledgement is requested
+#                but not required.
+#
+#              - Altered source versions must be plainly marked as such,
+#                and must not be misrepresented as being the original software.
+#                Altered source is encouraged to be submitted back to
+#                the original author so it can be shared with the community.
+#                Please share your changes.
+#
+#              - This notice may not be removed or altered from any
+#                source distribution.
+
+
+import sys
+import os
+import time
+import tempfile
+import tracemalloc
+import xml.dom.minidom
+
+sys.path.insert( 0, os.path.join( os.path.split(__file__)[0], ".." ) )
+#pylint: disable=wrong-import-position
+from awasu_tools.feed import Feed, FeedItem
+from awasu_tools.feed_reader import FeedReader
+from awasu_tools.utils import safe_xml
+
+# NOTE: Parsing feeds into a DOM takes too much memory for large feeds.
+MAX_DOM_ITEMS = 20000
+
+# ---------------------------------------------------------------------
+
+def make_atom_feed( fname, nitems ):
+    """Generate an Atom feed."""
+    feed = Feed( "Benchmark feed", "http://test.com", updated_time=1500000000.0 )
+    for item_no in range( nitems ):
+        feed.feed_items.append( FeedItem(
+            "Item #{} & co.".format( item_no ),
+            "http://test.com/item?id={}&x=1".format( item_no ),
+            "<p>Some <b>HTML</b> content for item #{}.</p>".format( item_no ) * 10,
+            1500000000.0 + item_no
+        ) )
+    with open( fname, "wb" ) as fp:
+        feed.write_xml( fp )
+
+def make_rss_feed( fname, nitems ):
+    """Generate an RSS feed."""
+    with open( fname, "w", encoding="utf-8" ) as fp:
+        fp.write( """<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0"><channel>\n""" )
+        fp.write( "<title>Benchmark feed</title><link>http://test.com</link>\n" )
+        for item_no in range( nitems ):
+            fp.write( "<item><title>{}</title><link>{}</link><description>{}</description>"
+                "<pubDate>{}</pubDate><guid>{}</guid></item>\n".format(
+                    safe_xml( "Item #{} & co.".format( item_no ) ),
+                    safe_xml( "http://test.com/item?id={}&x=1".format( item_no ) ),
+                    safe_xml( "<p>Some <b>HTML</b> content for item #{}.</p>".format( item_no ) * 10 ),
+                    time.strftime( "%a, %d %b %Y %H:%M:%S +0000", time.gmtime( 1500000000 + item_no ) ),
+                    item_no
+            ) )
+        fp.write( "</channel></rss>\n" )
+
+def dom_read( fname ):
+    """Read a feed by parsing it into a DOM."""
+    def get_text( node, tag ):
+        nodes = node.getElementsByTagName( tag )
+        return "".join( n.data for n in nodes[0].childNodes if n.nodeType == n.TEXT_NODE ) if nodes else None
+    doc = xml.dom.minidom.parse( fname )
+    return [
+        ( get_text( node, "title" ), get_text( node, "content" ) or get_text( node, "description" ) )
+        for node in doc.getElementsByTagName( "entry" ) + doc.getElementsByTagName( "item" )
+    ]
+
+def stream_read( fname ):
+    """Read a feed using FeedReader."""
+    nitems = 0
+    for _ in FeedReader( fname ):
+        nitems += 1
+    return nitems
+
+# ---------------------------------------------------------------------
+
+def bench_read( sizes ):
+    """Time reading feeds of different sizes."""
+
+    def run( read, fname, nitems ):
+        # time the read
+        start_time = time.perf_counter()
+        read( fname )
+        elapsed = time.perf_counter() - start_time
+        # measure peak memory usage (separately, since tracemalloc slows things down)
+        tracemalloc.start()
+        read( fname )
+        peak_mem = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print( "  - {:<12} {:7.3f}s {:>10,.0f} items/sec {:7.1f} MB/sec   peak memory: {:7.1f} MB".format(
+            read.__name__+":", elapsed, nitems/elapsed, os.path.getsize(fname)/elapsed/(1024*1024),
+            peak_mem/(1024*1024)
+        ) )
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for make_feed in ( make_atom_feed, make_rss_feed ):
+            for nitems in sizes:
+                fname = os.path.join( temp_dir, "feed.xml" )
+                make_feed( fname, nitems )
+                print( "Reading a {:,} item feed ({}, {:.1f} MB):".format(
+                    nitems, make_feed.__name__.split( "_" )[1], os.path.getsize(fname)/(1024*1024)
+                ) )
+                if nitems <= MAX_DOM_ITEMS:
+                    run( dom_read, fname, nitems )
+                run( stream_read, fname, nitems )
+
+# ---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    # NOTE: Feed sizes (number of items) can be specified on the command line.
+    bench_read( [ int(arg) for arg in sys.argv[1:] ] or [ 1000, 10000, 100000 ] )
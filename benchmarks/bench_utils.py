@@ -0,0 +1,289 @@
+""" Benchmark the utility functions. """
+
+# COPYRIGHT:   (c) Awasu Pty. Ltd. 2015 (all rights reserved).
+#              Unauthorized use of this code is prohibited.
+#
+# LICENSE:     This software is provided 'as-is', without any express
+#              or implied warranty.
+#
+#              In no event will the author be held liable for any damages
+#              arising from the use of this software.
+#
+#              Permission is granted to anyone to use this software
+#              for any purpose, and to alter it and redistribute it freely,
+#              subject to the following restrictions:
+#
+#              - The origin of this software must not be misrepresented;
+#                you must not claim that you wrote the original software.
+#                If you use this software, an acknowledgement is requested
+#                but not required.
+#
+#              - Altered source versions must be plainly marked as such,
+#                and must not be misrepresented as being the original software.
+#                Altered source is encouraged to be submitted back to
+#                the original author so it can be shared with the community.
+#                Please share your changes.
+#
+#              - This notice may not be removed or altered from any
+#                source distribution.
+
+
+import sys
+import os
+import re
+import time
+import datetime
+import calendar
+import random
+import timeit
+import tempfile
+import tracemalloc
+import xml.dom.minidom
+
+sys.path.insert( 0, os.path.join( os.path.split(__file__)[0], ".." ) )
+#pylint: disable=wrong-import-position
+from awasu_tools.utils import safe_xml, safe_xml_batch, pretty_xml, write_pretty_xml, dump_bytes, dump_file
+from awasu_tools.feed import Feed, FeedItem
+from awasu_tools import timestamps
+
+# NOTE: These are typical feed item values.
+FIELD_VALS = [
+    ( "title", "Government announces new infrastructure plan" ),
+    ( "title (&)", "Tom & Jerry's \"great\" <adventure>" ),
+    ( "url", "http://test.com/news/item?id=12345&ref=rss" ),
+    ( "timestamp", "2014-04-01T08:02:03Z" ),
+    ( "text (1K)", "Some plain text content for a feed item. " * 25 ),
+    ( "unicode (1K)", "日本語のテキスト " * 170 ),
+    ( "HTML (1K)", "<p>Some <b>HTML</b> content for a feed item.</p>" * 20 ),
+    ( "HTML (20K)", "<p>Some <b>HTML</b> content for a feed item.</p>" * 400 ),
+    ( "control chars (1K)", "Some text\x0b with\x1b control chars." * 30 ),
+]
+
+# ---------------------------------------------------------------------
+
+def legacy_safe_xml( val ):
+    """Make a value safe for XML, the way safe_xml() used to."""
+    if val is None:
+        return ""
+    val = str( val )
+    val = val.replace( "&", "&amp;" ).replace( "<", "&lt;" ).replace( ">", "&gt;" )
+    val = val.replace( "\"", "&quot;" )
+    return val
+
+def _time( func, val ):
+    """Time how long a function takes (in ns)."""
+    timer = timeit.Timer( lambda: func( val ) )
+    count, _ = timer.autorange()
+    return min( timer.repeat( 3, count ) ) / count * 1e9
+
+def bench_safe_xml():
+    """Time escaping values of different sizes."""
+    print( "Escaping values (ns per call):" )
+    print( "  {:<20} {:>10} {:>10} {:>10}".format( "", "legacy", "safe_xml", "strip" ) )
+    for caption, val in FIELD_VALS:
+        print( "  {:<20} {:>10,.0f} {:>10,.0f} {:>10,.0f}".format(
+            caption,
+            _time( legacy_safe_xml, val ),
+            _time( safe_xml, val ),
+            _time( lambda v: safe_xml( v, strip_invalid=True ), val ),
+        ) )
+
+def bench_safe_xml_batch( nitems=1000 ):
+    """Time escaping values in a batch."""
+    vals = [ val for _ in range( nitems ) for _, val in FIELD_VALS[:4] ]
+    print( "Escaping {:,} short values (ms):".format( len(vals) ) )
+    for caption, func in [
+        ( "legacy", lambda vals: [ legacy_safe_xml( v ) for v in vals ] ),
+        ( "safe_xml", lambda vals: [ safe_xml( v ) for v in vals ] ),
+        ( "safe_xml_batch", safe_xml_batch ),
+    ]:
+        print( "  {:<20} {:>10.2f}".format( caption, _time( func, vals ) / 1e6 ) )
+
+# ---------------------------------------------------------------------
+
+def legacy_parse_rfc2822( tstamp ):
+    """Parse an RFC 2822 timestamp, the way parse_rfc2822_timestamp() used to."""
+    if re.match( "[A-Za-z]{3}, ", tstamp ):
+        tstamp = tstamp[5:]
+    mo = re.match( "[0-9][0-9]?", tstamp )
+    if not mo:
+        return None
+    date = int( mo.group() )
+    tstamp = tstamp[ mo.end()+1 : ]
+    month_names = {
+        "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+        "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12
+    }
+    month = month_names[ tstamp[:3].lower() ]
+    tstamp2 = datetime.datetime(
+        int( tstamp[4:8] ), month, date, int( tstamp[9:11] ), int( tstamp[12:14] ), int( tstamp[15:17] )
+    )
+    if tstamp[18] in ( "+", "-" ):
+        tz_delta = 60 * int( tstamp[19:21] ) + int( tstamp[21:23] )
+        tz_delta *= -1 if tstamp[18] == "+" else +1
+        tstamp2 += datetime.timedelta( seconds=60*tz_delta )
+    return calendar.timegm( tstamp2.utctimetuple() )
+
+def legacy_format_iso8601( tstamp ):
+    """Format an ISO 8601 timestamp, the way feed items used to."""
+    return time.strftime( "%Y-%m-%dT%H:%M:%SZ", time.gmtime( tstamp ) )
+
+def bench_timestamps( nvals=10000, nunique=500 ):
+    """Time parsing and formatting timestamps."""
+
+    # generate the timestamps
+    # NOTE: We test with all the timestamps being different, and with most of them repeating
+    # (e.g. when the same feeds are processed over and over).
+    rng = random.Random( 42 )
+    tstamps = [ rng.randint( 946684800, 1893456000 ) + rng.random() for _ in range( nvals ) ]
+    months = ( "Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec" )
+    rfc2822_vals = [
+        time.strftime( "%a, %d {} %Y %H:%M:%S +0000", time.gmtime( t ) ).format( months[ time.gmtime(t).tm_mon-1 ] )
+        for t in tstamps
+    ]
+    iso8601_vals = [ legacy_format_iso8601( t ) for t in tstamps ]
+
+    def clear_caches( func ):
+        def wrapper( vals ):
+            for f in ( timestamps._parse_rfc2822, timestamps._parse_iso8601, #pylint: disable=protected-access
+                       timestamps._format_iso8601 ): #pylint: disable=protected-access
+                f.cache_clear()
+            return func( vals )
+        return wrapper
+
+    print( "Timestamps ({:,} values, ms):".format( nvals ) )
+    print( "  {:<20} {:>10} {:>10} {:>10}".format( "", "legacy", "unique", "repeated" ) )
+    for caption, legacy_func, func, vals in [
+        ( "parse RFC 2822", legacy_parse_rfc2822, timestamps.parse_rfc2822, rfc2822_vals ),
+        ( "parse ISO 8601", None, timestamps.parse_iso8601, iso8601_vals ),
+        ( "parse (auto)", None, timestamps.parse_timestamp, rfc2822_vals ),
+        ( "format ISO 8601", legacy_format_iso8601, timestamps.format_iso8601, tstamps ),
+    ]:
+        repeated_vals = [ vals[ i % nunique ] for i in range( nvals ) ]
+        if legacy_func:
+            legacy_elapsed = "{:.2f}".format( _time( lambda v, f=legacy_func: [ f(x) for x in v ], vals ) / 1e6 )
+        else:
+            legacy_elapsed = "-"
+        print( "  {:<20} {:>10} {:>10.2f} {:>10.2f}".format(
+            caption,
+            legacy_elapsed,
+            _time( clear_caches( lambda v, f=func: [ f(x) for x in v ] ), vals ) / 1e6,
+            _time( lambda v, f=func: [ f(x) for x in v ], repeated_vals ) / 1e6,
+        ) )
+    print( "  {:<20} {:>10} {:>10.2f} {:>10.2f}".format(
+        "format (batch)", "-",
+        _time( clear_caches( timestamps.format_iso8601_batch ), tstamps ) / 1e6,
+        _time( timestamps.format_iso8601_batch, [ tstamps[ i % nunique ] for i in range( nvals ) ] ) / 1e6,
+    ) )
+
+# ---------------------------------------------------------------------
+
+def legacy_pretty_xml( val ):
+    """Prettify XML, the way pretty_xml() used to."""
+    buf = xml.dom.minidom.parseString( val ).toprettyxml( indent="  " )
+    lines = buf.split( "\n" )
+    if lines[0] == "<?xml version=\"1.0\" ?>":
+        del lines[0]
+    return "\n".join( x for x in lines if x.strip() )
+
+def _peak_memory( func ):
+    """Measure the peak memory used by a function (in MB)."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+def bench_pretty_xml( sizes=( 100, 2000, 20000 ) ):
+    """Time pretty-printing feed XML."""
+    print( "Pretty-printing XML (ms, peak MB):" )
+    print( "  {:<20} {:>18} {:>18} {:>18}".format( "", "legacy", "pretty_xml", "file -> file" ) )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for nitems in sizes:
+
+            # generate the feed XML
+            feed = Feed( "Test feed", "http://test.com", updated_time=1.0 )
+            feed.feed_items.extend(
+                FeedItem( "Item {}".format( i ), "http://test.com/item{}".format( i ),
+                    "<p>Some <b>HTML</b> content for feed item #{}.</p>".format( i ) * 10, float( i )
+                )
+                for i in range( nitems )
+            )
+            val = feed.get_xml()
+            fname = os.path.join( temp_dir, "feed.xml" )
+            with open( fname, "w", encoding="utf-8" ) as fp:
+                fp.write( val )
+            assert pretty_xml( val ) == legacy_pretty_xml( val )
+
+            # pretty-print the XML
+            def write_file( fname=fname ):
+                with open( fname, "rb" ) as src, \
+                     open( os.path.join( temp_dir, "pretty.xml" ), "w", encoding="utf-8" ) as out:
+                    write_pretty_xml( src, out )
+            results = []
+            for func in (
+                lambda v=val: legacy_pretty_xml( v ),
+                lambda v=val: pretty_xml( v ),
+                write_file
+            ):
+                elapsed = _time( lambda _, f=func: f(), None ) / 1e6
+                results.append( "{:.1f} / {:.1f}".format( elapsed, _peak_memory( func ) ) )
+            print( "  {:<20} {:>18} {:>18} {:>18}".format(
+                "{:,} items ({:.1f}MB)".format( nitems, len(val) / 1024 / 1024 ), *results
+            ) )
+
+# ---------------------------------------------------------------------
+
+def legacy_dump_bytes( buf, caption="", prefix="", out=sys.stdout ):
+    """Formatted byte dump, the way dump_bytes() used to do it."""
+    if caption:
+        print( caption, file=out )
+    for line_no in range( 0, int( (len(buf)+15) / 16 ) ):
+        print( "{}{:04x}: ".format( prefix, 16*line_no ), end="", file=out )
+        row_bytes = buf[ 16*line_no : 16*line_no+16 ]
+        line_buf = " ".join( "{:02x}".format( ord(ch) ) for ch in row_bytes )
+        if len( line_buf ) > 23:
+            line_buf = "{} {}".format( line_buf[:23], line_buf[23:] )
+        line_buf += " " * (48 - len(line_buf))
+        print( line_buf, end="", file=out )
+        print( " | " + "".join( ch if 32 <= ord(ch) < 127 else "." for ch in row_bytes ), file=out )
+
+def bench_dump_bytes( sizes=( 1024, 1024*1024, 8*1024*1024 ) ):
+    """Time dumping bytes."""
+    print( "Dumping bytes (ms, peak MB):" )
+    print( "  {:<12} {:>18} {:>18} {:>18}".format( "", "legacy (str)", "dump_bytes", "dump_file" ) )
+    rng = random.Random( 42 )
+    with tempfile.TemporaryDirectory() as temp_dir, open( os.devnull, "w", encoding="utf-8" ) as out:
+        for size in sizes:
+            # NOTE: The old version only worked with strings (ord() fails on bytes).
+            buf = bytes( rng.getrandbits( 7 ) for _ in range( size ) )
+            val = buf.decode( "ascii" )
+            fname = os.path.join( temp_dir, "test.bin" )
+            with open( fname, "wb" ) as fp:
+                fp.write( buf )
+            results = []
+            for func in (
+                lambda v=val: legacy_dump_bytes( v, out=out ),
+                lambda b=buf: dump_bytes( b, out=out ),
+                lambda f=fname: dump_file( f, out=out ),
+            ):
+                if size > 1024*1024 and len( results ) == 0:
+                    results.append( "-" ) # nb: this takes too long
+                    continue
+                elapsed = _time( lambda _, f=func: f(), None ) / 1e6
+                results.append( "{:.1f} / {:.1f}".format( elapsed, _peak_memory( func ) ) )
+            print( "  {:<12} {:>18} {:>18} {:>18}".format( "{:,}K".format( size // 1024 ), *results ) )
+
+# ---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    bench_safe_xml()
+    print()
+    bench_safe_xml_batch()
+    print()
+    bench_timestamps()
+    print()
+    bench_pretty_xml()
+    print()
+    bench_dump_bytes()